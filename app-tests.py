@@ -1,5 +1,10 @@
 import unittest
+from unittest.mock import patch
+from passwords import PasswordPool
+import app as app_module
+import ratelimit
 from app import app
+import database
 
 
 class TestApp(unittest.TestCase):
@@ -14,6 +19,42 @@ class TestApp(unittest.TestCase):
         response = self.app.get("/search.html")
         self.assertEqual(response.status_code, 200)
 
+    def test_search_page_caching(self):
+        response = self.app.get("/search.html")
+        self.assertIn(b'value="13000"', response.data)
+        self.assertIn("private", response.headers["Cache-Control"])
+        self.assertEqual(self.app.get("/search.html", headers={"If-None-Match": response.headers["ETag"]}).status_code, 304)
+        with self.app.session_transaction() as session:
+            session["user_id"] = 1
+        logged_in = self.app.get("/search.html", headers={"If-None-Match": response.headers["ETag"]})
+        self.assertEqual(logged_in.status_code, 200)
+        self.assertIn(b"Account", logged_in.data)
+
+    def test_search_page_cache_ignores_host(self):
+        self.app.get("/search.html")
+        response = self.app.get("/search.html", headers={"Host": "attacker.example"})
+        self.assertNotIn(b"attacker.example", response.data)
+        self.assertLessEqual(len(app_module.search_pages), 2)
+
+    def test_static_urls_are_versioned(self):
+        response = self.app.get("/")
+        self.assertIn(b"/static/images/logo.png?v=", response.data)
+        url = response.data.split(b'src="')[1].split(b'"')[0].decode()
+        static = self.app.get(url)
+        self.assertEqual(static.status_code, 200)
+        self.assertIn("immutable", static.headers["Cache-Control"])
+        static.close()
+        stale = self.app.get("/static/images/logo.png?v=old")
+        self.assertNotIn("immutable", stale.headers.get("Cache-Control", ""))
+        stale.close()
+
+    def test_search_options(self):
+        response = self.app.get("/api/search/options")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()["radii"], [500, 1000, 2500, 5000, 10000])
+        self.assertIn("public", response.headers["Cache-Control"])
+        self.assertEqual(self.app.get("/api/search/options", headers={"If-None-Match": response.headers["ETag"]}).status_code, 304)
+
     def test_search_location(self):
         response = self.app.post("/search", data={"search": "SE1 9DD", "categories": ["restaurant"], "radius": 1000})
         self.assertEqual(response.status_code, 200)
@@ -51,12 +92,54 @@ class TestApp(unittest.TestCase):
         response = self.app.get("/search_history")
         self.assertEqual(response.status_code, 200)
 
+    def test_show_search_history_page(self):
+        with self.app.session_transaction() as session:
+            session["user_id"] = 1
+        response = self.app.get("/search_history?page=3&cursor=not-a-cursor")
+        self.assertEqual(response.status_code, 200)
+
+    def test_history_pages_conditional_get(self):
+        with app.app_context():
+            user = database.User(username="cachetestuser", password=database.hash_password("password123"))
+            database.db.session.add(user)
+            database.db.session.commit()
+            user_id = user.user_id
+        try:
+            with self.app.session_transaction() as session:
+                session["user_id"] = user_id
+            for url in ["/search_history", "/popular_searches", "/popular_searches?mode=7d", "/search_keyword?keyword=tower"]:
+                response = self.app.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertIn("no-cache", response.headers["Cache-Control"])
+                # an unchanged history is revalidated without running any history query
+                with patch.object(database, "get_history", side_effect=AssertionError), patch.object(database, "get_top_searches", side_effect=AssertionError), \
+                        patch.object(database, "search_history", side_effect=AssertionError):
+                    self.assertEqual(self.app.get(url, headers={"If-None-Match": response.headers["ETag"]}).status_code, 304)
+
+            etag = self.app.get("/search_history").headers["ETag"]
+            with app.app_context():
+                database.save_history(database.db.session, user_id, [{"name": "Tower Bridge", "location": {"formatted_address": "Tower Bridge Rd, London SE1 2UP"}}])
+            response = self.app.get("/search_history", headers={"If-None-Match": etag})
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(b"Tower Bridge", response.data)
+            self.assertIsNotNone(response.headers.get("Last-Modified"))
+        finally:
+            with app.app_context():
+                database.delete_account(database.db.session, user_id)
+
     def test_show_popular_searches(self):
         with self.app.session_transaction() as session:
             session["user_id"] = 1
         response = self.app.get("/popular_searches")
         self.assertEqual(response.status_code, 200)
 
+    def test_show_popular_searches_modes(self):
+        with self.app.session_transaction() as session:
+            session["user_id"] = 1
+        for mode in ["today", "7d", "30d", "decay", "unknown"]:
+            response = self.app.get(f"/popular_searches?mode={mode}")
+            self.assertEqual(response.status_code, 200)
+
     def test_register_new_user(self):
         response = self.app.post("/register.html", data={"username": "newtestuser", "password": "newtestpass"})
         self.assertEqual(response.status_code, 200)
@@ -66,6 +149,74 @@ class TestApp(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertIn(b"Username already exists - try another", response.data)
 
+    def test_register_username_race(self):
+        # another registration for the same username commits between the existence check and this one's commit
+        with app.app_context(), patch.object(database.db.session, "query") as query:
+            query.return_value.filter_by.return_value.first.return_value = None
+            response = self.app.post("/register.html", data={"username": "existingtestuser", "password": "existingtestpass"})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"Username already exists - try another", response.data)
+
+    def test_login_rehashes_password(self):
+        with app.app_context():
+            user = database.User(username="rehashtestuser", password=database.hash_password("password123", 4))
+            database.db.session.add(user)
+            database.db.session.commit()
+            user_id = user.user_id
+        try:
+            with patch.object(database.settings, "BCRYPT_ROUNDS", 5):
+                response = self.app.post("/login.html", data={"username": "rehashtestuser", "password": "password123"})
+                self.assertEqual(response.status_code, 302)
+                with app.app_context():
+                    hashed_password = database.db.session.get(database.User, user_id).password
+                self.assertFalse(database.password_needs_rehash(hashed_password))
+                self.assertTrue(database.verify_password("password123", hashed_password))
+
+            # a login flood beyond the pool's queue depth is turned away rather than queued
+            with patch.object(app_module, "password_pool", PasswordPool(workers=0, max_pending=0)):
+                response = self.app.post("/login.html", data={"username": "rehashtestuser", "password": "password123"})
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response.headers["Retry-After"], "1")
+        finally:
+            with app.app_context():
+                database.delete_account(database.db.session, user_id)
+
+    def test_login_rate_limited(self):
+        limiter = ratelimit.RateLimiter(ratelimit.MemoryBucketStore(), {"login_ip": (4, 60), "login_username": (2, 300)})
+        with patch.object(app_module, "rate_limiter", limiter):
+            for _ in range(2):
+                self.assertEqual(self.app.post("/login.html", data={"username": "nosuchuser", "password": "wrong"}).status_code, 200)
+            # further attempts for the username are refused before any password check, and other usernames are still limited by IP
+            with patch.object(app_module.password_pool, "verify_password", side_effect=AssertionError):
+                response = self.app.post("/login.html", data={"username": "nosuchuser", "password": "wrong"})
+                self.assertEqual(response.status_code, 429)
+                self.assertIn(b"Too many login attempts", response.data)
+                self.assertEqual(response.headers["Retry-After"], "150")
+            self.assertEqual(self.app.post("/login.html", data={"username": "othertestuser", "password": "wrong"}).status_code, 200)
+            self.assertEqual(self.app.post("/login.html", data={"username": "othertestuser", "password": "wrong"}).status_code, 429)
+
+    def test_search_rate_limited(self):
+        limiter = ratelimit.RateLimiter(ratelimit.MemoryBucketStore(), {"search_ip": (1, 60), "batch_ip": (2, 60)})
+        with patch.object(app_module, "rate_limiter", limiter), patch.object(app_module.utils, "get_coordinates", return_value=(None, None, "Location not found")) as get_coordinates:
+            self.assertEqual(self.app.post("/search", data={"search": "London"}).json, {"error": "Location not found"})
+            for url in ["/search", "/search/async"]:
+                response = self.app.post(url, data={"search": "London"})
+                self.assertEqual(response.status_code, 429)
+                self.assertIn("Too many searches", response.json["error"])
+            self.assertEqual(get_coordinates.call_count, 1)
+            response = self.app.post("/api/search/batch", json=[{"search": "London"}] * 3)
+            self.assertEqual(response.status_code, 429)
+
+    def test_upstream_quota(self):
+        quotas = database.settings.UPSTREAM_QUOTAS
+        with patch.object(app_module.upstream, "quotas", app_module.upstream.QuotaAccountant(quotas)) as accountant:
+            accountant.acquire("foursquare", "secret key")
+            response = self.app.get("/api/upstream/quota")
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(b"secret key", response.data)
+        self.assertEqual(response.json["quotas"]["foursquare:" + accountant.fingerprint("secret key")]["remaining"], quotas["foursquare"]["daily"] - 1)
+        self.assertIn("coalesced", response.json["coalescing"])
+
     def test_delete_account_success(self):
         with self.app.session_transaction() as session:
             session["user_id"] = 1
@@ -1,34 +1,95 @@
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, current_app, Response, stream_with_context
 from database import User, db
+from history_queue import HistoryWriter
+from passwords import PasswordPool, PasswordPoolBusy
+from sqlalchemy.exc import IntegrityError
+from cache import page_cache
+from werkzeug.http import is_resource_modified
+from datetime import datetime
+from pathlib import Path
+import click
+import hashlib
+import assets
+import compression
+import export
+import json
 import database
+import migrations
 import config
+import settings
 import utils
+import async_utils
+import batch
+import rollup
+import places
+import ranking
+import ratelimit
+import upstream
 
 # create Flask app instance, obtaining the secret key from config file
 app = Flask(__name__)
 app.secret_key = config.key3
 
-# set SQLAlchemy database URI configuration for the Flask app
-app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///hotelhelper.db"
+# set SQLAlchemy database URI and connection pool configuration for the Flask app from settings.py
+app.config["SQLALCHEMY_DATABASE_URI"] = settings.DATABASE_URI
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = database.engine_options(settings.DATABASE_URI)
 
 # initialise database object with the Flask app
 db.init_app(app)
 
+# create any missing tables, then apply pending schema migrations to an existing database file
+with app.app_context():
+    db.create_all()
+    migrations.run_migrations(db.engine)
+    # open the read-only engine history pages and exports are read from, so browsing reports never holds up the writes made by searches
+    if settings.DATABASE_READ_ROUTING:
+        database.use_read_engine(db.engine)
+
+# start the search history write-behind queue if enabled, so searches do not wait on history commits
+if settings.HISTORY_WRITE_BEHIND:
+    database.history_writer = HistoryWriter(app).start()
+
+# bounded pool of worker processes for bcrypt, so a burst of logins cannot take every request thread's CPU away from searches
+password_pool = PasswordPool()
+
+# token bucket rate limiter for logins, registrations and searches, checked before any bcrypt or upstream work
+rate_limiter = ratelimit.create_rate_limiter()
+
 
 # function to remove database session when the app context is torn down
 @app.teardown_appcontext
 def close_db(exception):
-    # removes current session from database object
+    # removes current session from database object, and the read-only session if one was used
     db.session.remove()
+    if database.read_sessions is not None:
+        database.read_sessions.remove()
 
 
 # function to process image into a template context
 @app.context_processor
 def inject_image_url():
-    # static image to be used in website header which contains a link to the index page (handled in layout.html)
+    # static image to be used in website header which contains a link to the index page (handled in layout.html), with its content hash added by version_static_urls
     return {"image_url": url_for("static", filename="images/logo.png")}
 
 
+# function to add the content hash of static files to every url_for("static", ...) URL, so browsers can cache them until the file changes
+@app.url_defaults
+def version_static_urls(endpoint, values):
+    assets.add_static_version(app.static_folder, endpoint, values)
+
+
+# function run after each request: static files requested with their current content hash can be cached for settings.STATIC_MAX_AGE seconds without revalidating,
+# and JSON and HTML responses are compressed for clients that accept it
+@app.after_request
+def cache_and_compress(response):
+    filename = request.view_args.get("filename") if request.endpoint == "static" and request.view_args else None
+    if filename and request.args.get("v") == assets.static_version(app.static_folder, filename):
+        response.cache_control.public = True
+        response.cache_control.max_age = settings.STATIC_MAX_AGE
+        response.cache_control.immutable = True
+    return compression.compress_response(response, request)
+
+
 # route for the root Flask app url, the homepage
 @app.route("/")
 def home():
@@ -36,20 +97,48 @@ def home():
     return render_template("index.html")
 
 
+# rendered search pages with their ETags, keyed only by whether the user is logged in (which changes the header buttons)
+# the page links to its script by path rather than by the client's Host header, so there are at most two entries and a forged host cannot be cached
+search_pages = {}
+
+
 # route for the search.html URL Flask app path, utilising the GET method
+# the page is rendered once per key in search_pages and then served from memory, with an ETag so browsers revalidate it with a 304 response
 @app.route("/search.html", methods=["GET"])
 def search_page():
-    # generates checkboxes with generate_checkboxes function from utils.py
-    checkboxes = utils.generate_checkboxes()
-    # generates radio buttons with generate_radio_buttons function from utils.py
-    radius_buttons = utils.generate_radio_buttons()
-    # renders search.html template with checkboxes and radius_buttons to display
-    return render_template("search.html", checkboxes=checkboxes, radius_buttons=radius_buttons)
+    key = "user_id" in session
+    page = search_pages.get(key)
+    if page is None:
+        # renders search.html template with the compiled checkboxes and radius_buttons from utils.py to display
+        body = render_template("search.html", checkboxes=utils.generate_checkboxes(), radius_buttons=utils.generate_radio_buttons())
+        page = search_pages[key] = (body, hashlib.sha256(body.encode("utf-8")).hexdigest()[:32])
+
+    # the page depends on the session cookie, so it may only be cached by the browser
+    response = Response(page[0], mimetype="text/html")
+    response.set_etag(page[1])
+    response.cache_control.private = True
+    response.cache_control.max_age = settings.SEARCH_PAGE_MAX_AGE
+    return response.make_conditional(request)
+
+
+# route for /api/search/options URL Flask app path, returning the search form categories and radius choices as JSON for the frontend
+# the body is compiled once at startup, and its ETag lets browsers and proxies revalidate it with a 304 response
+@app.route("/api/search/options", methods=["GET"])
+def search_options():
+    response = Response(utils.search_options["json"], mimetype="application/json")
+    response.set_etag(utils.search_options["etag"])
+    response.cache_control.public = True
+    response.cache_control.max_age = settings.SEARCH_OPTIONS_MAX_AGE
+    return response.make_conditional(request)
 
 
 # route for search.html URL Flask app path, utilising the POST method
 @app.route("/search", methods=["POST"])
 def search_location():
+    # turn the search away if this client has used up its searches, before any geocoding or FourSquare requests
+    retry_after = rate_limiter.check("search_ip", request.remote_addr)
+    if retry_after:
+        return jsonify({"error": f"Too many searches - try again in {retry_after} seconds"}), 429, {"Retry-After": str(retry_after)}
     try:
         # obtain query value from an input box in a form
         query = request.form["search"]
@@ -67,17 +156,84 @@ def search_location():
         categories_str = ",".join(request.form.getlist("categories"))
         # convert radius value from a form and JavaScript into an integer value
         radius = int(request.form.get("radius"))
+        # obtain any extra "latitude,longitude" origins results should also be near, returning a JSON response with an error message if they are invalid
+        try:
+            origins = ranking.parse_origins(request.form.getlist("origins"))
+        except ValueError as e:
+            return jsonify({"error": str(e)})
         # obtain user ID through current session, will be None if the user is not logged in (handled in get_destinations)
         user_id = session.get("user_id")
         # obtain locations with get_destinations taking parameters from get_coordinates, form values and database-related values to save the locations to the user account if logged in
-        results = utils.get_destinations(latitude, longitude, categories_str, radius, user_id, db.session)
+        results = utils.get_destinations(latitude, longitude, categories_str, radius, user_id, db.session, origins)
         # return JSON response with location results
-        return jsonify({"results": results})
+        return jsonify({"results": utils.project_results(results)})
     except Exception as e:
         # return JSON response with error message in cases of unknown error
         return jsonify({"error": str(e)})
 
 
+# route for /search/async URL Flask app path, an async version of /search accepting the same form
+# geocoding and FourSquare requests do not block on each other's sockets, one FourSquare request is sent per category concurrently, and history is saved after the response is returned
+@app.route("/search/async", methods=["POST"])
+async def search_location_async():
+    # limit searches in the same way as /search
+    retry_after = rate_limiter.check("search_ip", request.remote_addr)
+    if retry_after:
+        return jsonify({"error": f"Too many searches - try again in {retry_after} seconds"}), 429, {"Retry-After": str(retry_after)}
+    try:
+        # validate the query in the same way as /search
+        query, error_message = utils.enter_query(request.form["search"])
+        if not query:
+            return jsonify({"error": error_message})
+        categories_str = ",".join(request.form.getlist("categories"))
+        radius = int(request.form.get("radius"))
+        try:
+            origins = ranking.parse_origins(request.form.getlist("origins"))
+        except ValueError as e:
+            return jsonify({"error": str(e)})
+        user_id = session.get("user_id")
+
+        async with upstream.create_async_client() as client:
+            # obtain latitude and longitude, then the merged results for every selected category
+            latitude, longitude, error_message = await async_utils.get_coordinates_async(client, query)
+            if not latitude or not longitude:
+                return jsonify({"error": error_message})
+            results = await async_utils.get_destinations_async(client, latitude, longitude, categories_str, radius)
+
+        # queue the history write for logged in users rather than waiting for the commit, then rank the results in the same way as /search
+        if user_id is not None and isinstance(results, list):
+            async_utils.save_history_later(current_app._get_current_object(), user_id, results)
+        if settings.RANKING_ENABLED and isinstance(results, list) and results:
+            results = utils.rank_destinations(latitude, longitude, categories_str, radius, results, db.session, origins)
+        return jsonify({"results": utils.project_results(results)})
+    except Exception as e:
+        # return JSON response with error message in cases of unknown error
+        return jsonify({"error": str(e)})
+
+
+# route for /api/search/batch URL Flask app path, with POST method, searching for places around many locations in one request
+# accepts a JSON list of items (or an object with a "queries" list), each with a "search" query and optional "categories" and "radius",
+# and streams one NDJSON line per item as it completes, each containing the item's index and either its results or an error message
+@app.route("/api/search/batch", methods=["POST"])
+def search_batch():
+    data = request.get_json(silent=True)
+    items = data.get("queries") if isinstance(data, dict) else data
+    # return an error for a missing, empty or oversized batch before any upstream calls are made
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "Error: request body must be a JSON list of search queries"}), 400
+    if len(items) > settings.BATCH_MAX_ITEMS:
+        return jsonify({"error": f"Error: a batch can contain at most {settings.BATCH_MAX_ITEMS} queries"}), 400
+    # charge every query in the batch to the client's batch limit
+    retry_after = rate_limiter.check("batch_ip", request.remote_addr, len(items))
+    if retry_after:
+        return jsonify({"error": f"Too many batch queries - try again in {retry_after} seconds"}), 429, {"Retry-After": str(retry_after)}
+
+    # results are saved to the history of a logged in user, in the same way as /search
+    user_id = session.get("user_id")
+    lines = (json.dumps(result) + "\n" for result in batch.search_batch(current_app._get_current_object(), items, user_id))
+    return Response(stream_with_context(lines), mimetype="application/x-ndjson")
+
+
 # route for register.html URL Flask app path, with GET and POST methods
 @app.route("/register.html", methods=["GET", "POST"])
 def register():
@@ -88,19 +244,33 @@ def register():
         # obtain username and password from the form and Javsscript on register.html
         username = request.form.get("username")
         password = request.form.get("password")
-        # query users table to see if the username already exists
+        # turn the registration away if this client has made too many, before the username lookup and password hashing
+        retry_after = rate_limiter.check("register_ip", request.remote_addr)
+        if retry_after:
+            username_error = f"Too many registrations - try again in {retry_after} seconds"
+            return render_template("register.html", username_error=username_error), 429, {"Retry-After": str(retry_after)}
+        # query users table to see if the username already exists, through the unique username index
         user = db.session.query(User).filter_by(username=username).first()
         # if the username already exists, set the username_error erorr message, to be returned
         if user:
             username_error = "Username already exists - try another"
         else:
-            # if the username does not exist, hash the input password to be inserted into the database
-            hashed_password = database.hash_password(password)
+            try:
+                # if the username does not exist, hash the input password to be inserted into the database, in the password worker pool
+                hashed_password = password_pool.hash_password(password)
+            except PasswordPoolBusy as e:
+                # turn the registration away while too many passwords are being hashed or checked, rather than wait for a worker
+                return render_template("register.html", username_error=str(e)), 503, {"Retry-After": "1"}
             # create new User instance with the username and hashed password a new User instance
             new_user = User(username=username, password=hashed_password)
             # add the new_user instance to the database session and commit changes
+            # if another registration for the same username committed first, the unique index rejects this one
             db.session.add(new_user)
-            db.session.commit()
+            try:
+                db.session.commit()
+            except IntegrityError:
+                db.session.rollback()
+                return render_template("register.html", username_error="Username already exists - try another")
             # set user_id and username values in the session from the new_user instance
             user_id = new_user.user_id
             session["user_id"] = user_id
@@ -120,10 +290,24 @@ def login_handler():
             # obtain username and password from the form on login.html
             username = request.form.get("username")
             password = request.form.get("password")
-            # query users table to see if any usernames match the input user value
+            # turn the login away if this client has made too many attempts, or the username has had too many failed attempts, before any bcrypt work
+            retry_after = rate_limiter.check("login_ip", request.remote_addr) or rate_limiter.check("login_username", username)
+            if retry_after:
+                error_message = f"Too many login attempts - try again in {retry_after} seconds"
+                return render_template("login.html", error_message=error_message), 429, {"Retry-After": str(retry_after)}
+            # query users table to see if any usernames match the input user value, through the unique username index
             user = User.query.filter_by(username=username).first()
-            # check if username is valid (not None) if the input password matches the password stored in the database
-            if user and database.verify_password(password, user.password):
+            # check if username is valid (not None) if the input password matches the password stored in the database, checked in the password worker pool
+            if user and password_pool.verify_password(password, user.password):
+                # rehash the password if it was stored with a different bcrypt cost than settings.BCRYPT_ROUNDS, leaving it for a later login if the pool is busy
+                if database.password_needs_rehash(user.password):
+                    try:
+                        user.password = password_pool.hash_password(password)
+                        db.session.commit()
+                    except PasswordPoolBusy:
+                        pass
+                # only failed attempts count towards the username's limit, so refill it after a successful login
+                rate_limiter.reset("login_username", username)
                 # set session user_id and username to values stored for that specific user in the database
                 session["user_id"] = user.user_id
                 session["username"] = user.username
@@ -133,6 +317,9 @@ def login_handler():
                 # render and return login.html with an error message if the username or password does not match any records in the database
                 error_message = "Invalid username or password"
                 return render_template("login.html", error_message=error_message)
+        except PasswordPoolBusy as e:
+            # turn the login away while too many passwords are being hashed or checked, rather than wait for a worker
+            return render_template("login.html", error_message=str(e)), 503, {"Retry-After": "1"}
         except Exception as e:
             # render login.html in cases of unknown errors
             return render_template("login.html", error_message=str(e))
@@ -180,14 +367,50 @@ def delete_account():
         return render_template("account.html", error_message="Failed to delete account")
 
 
+# hash of the page templates, so the ETags of history pages change when the templates they are rendered from do
+template_version = hashlib.sha256(b"".join(path.read_bytes() for path in sorted(Path(app.root_path, "templates").glob("*.html")))).hexdigest()[:16]
+
+
+# function to serve a history page for a logged in user, revalidated against the user's history version from database.py
+# page_key identifies the page (the route and its arguments), and render is only called if the browser's copy is out of date and the page is not in page_cache,
+# with the session to read the history from (the read-only session, unless it has not caught up with the user's latest search)
+# dated pages (such as windowed rankings) also change from day to day, so the date is added to their key and they are sent without a Last-Modified time
+def history_page(user_id, page_key, render, dated=False):
+    version = database.get_history_version(db.session, user_id)
+    if version is None:
+        # without an account there is no history version to revalidate against, so the page is rendered from the primary without caching
+        return render(db.session)
+    history_version, history_modified = version
+    key = (user_id, history_version, page_key, datetime.utcnow().date().isoformat() if dated else None)
+    etag = hashlib.sha256(f"{template_version}:{key}".encode("utf-8")).hexdigest()[:32]
+    last_modified = None if dated else history_modified
+
+    # answer 304 Not Modified to a conditional GET for a current copy, before any history query runs
+    if request.method in ("GET", "HEAD") and not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = Response(status=304)
+    else:
+        body = page_cache.get(key)
+        if body is None:
+            body = render(database.history_reader(db.session, user_id, history_version))
+            page_cache.set(key, body)
+        response = Response(body, mimetype="text/html")
+
+    # browsers may keep the page, but must revalidate it before showing it again
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
 # route for search_keyword URL Flask app path, with GET and POST methods
+# the keyword is taken from the form on results.html, or from ?keyword so a search can be revalidated with a conditional GET
 @app.route("/search_keyword", methods=["GET", "POST"])
 def search_keyword():
-    # if the request.method is POST, handle the form on results.html
-    if request.method == "POST":
+    # handle the form on results.html, or a keyword in the URL query string
+    keyword = request.form.get("keyword") if request.method == "POST" else request.args.get("keyword")
+    if keyword is not None:
         try:
-            # obtain keyword value from input box in a form on results.html
-            keyword = request.form["keyword"]
             # check if the keyword is two characters or more, creating an error message if it is less than two characters
             if len(keyword) < 2:
                 error_message = "Keyword must be at least 2 characters."
@@ -195,10 +418,12 @@ def search_keyword():
                 return render_template("results.html", show_search_form=True, error_message=error_message)
             # obtain user_id value from session with get method
             user_id = session.get("user_id")
-            # obtain search results for the keyword with search_history function from database.py
-            search_results = database.search_history(db.session, user_id, keyword)
-            # render results.html with the search form visible, search results and the keyword
-            return render_template("results.html", show_search_form=True, search_results=search_results, keyword=keyword)
+
+            # obtain search results for the keyword with search_history function from database.py, rendering results.html with the search form visible, search results and the keyword
+            def render(reader):
+                search_results = database.search_history(reader, user_id, keyword)
+                return render_template("results.html", show_search_form=True, search_results=search_results, keyword=keyword)
+            return history_page(user_id, ("search_keyword", keyword), render)
         except Exception as e:
             # render results.html with the search form visible and an error message in cases of unknown error
             return render_template("results.html", show_search_form=True, error_message=str(e))
@@ -207,40 +432,166 @@ def search_keyword():
         return render_template("results.html", show_search_form=True)
 
 
-# route for /search_history Flask app path
+# route for /search_history Flask app path, showing one page of history at a time
+# ?page gives the page number shown, and ?cursor (set on links to the next page) continues from the last entry of the previous page
 @app.route("/search_history")
 def show_search_history():
     # check if the user is logged in by seeing if a user_id is in session
     if "user_id" in session:
         # obtain user_id value from the session with get method
         user_id = session["user_id"]
-        # obtain all location history for the user from get_history function in database.py
-        search_history = database.get_history(db.session, user_id)
-        # render results.html with search_history to show all search history, and all_searches containing all searches
-        return render_template("results.html", search_history=search_history, all_searches=True)
+        # obtain the page number and cursor from the URL query string
+        page_size = settings.HISTORY_PAGE_SIZE
+        current_page = max(request.args.get("page", 1, type=int), 1)
+        cursor = request.args.get("cursor")
+        offset = (current_page - 1) * page_size
+
+        def render(reader):
+            try:
+                # obtain one page of location history for the user from get_history function in database.py
+                search_history = database.get_history(reader, user_id, page_size, cursor, offset)
+            except ValueError:
+                # ignore a malformed cursor, using the page number instead
+                search_history = database.get_history(reader, user_id, page_size, None, offset)
+            # obtain the number of pages from the cached entry count, and the cursor for the next page link
+            total_pages = (database.count_history(reader, user_id) + page_size - 1) // page_size
+            next_cursor = database.encode_cursor(search_history[-1]) if search_history and current_page < total_pages else None
+            # render results.html with one page of search_history, all_searches to show the all locations section, and page details for the pagination links
+            return render_template("results.html", search_history=search_history, all_searches=True, current_page=current_page, total_pages=total_pages, next_cursor=next_cursor)
+        return history_page(user_id, ("search_history", current_page, cursor), render)
     else:
         # redirect user to login page in the case they are not logged in
         return redirect(url_for("login_handler"))
 
 
-# route for /popular_searches Flask app path
+# route for /popular_searches Flask app path, with an optional ?mode to rank by a time window or by time-decayed counts
 @app.route("/popular_searches")
 def show_popular_searches():
     # check if the user is logged in by seeing if a user_id is in session
     if "user_id" in session:
         # obtain user_id value from the session with get method
         user_id = session["user_id"]
-        # obtain the top ten locations for the user from get_top_searches function in database.py
-        popular_searches = database.get_top_searches(db.session, user_id)
-        # render results.html with the top ten locations
-        return render_template("results.html", popular_searches=popular_searches)
+        # obtain the ranking mode from the URL query string (all, today, 7d, 30d or decay), using all-time counts for unknown modes
+        mode = request.args.get("mode", "all")
+        if mode not in database.POPULARITY_MODES:
+            mode = "all"
+
+        # obtain the top ten locations for the user from get_top_searches function in database.py, rendering results.html with the top ten locations and the ranking mode
+        # rankings other than all-time counts depend on the date as well as the history
+        def render(reader):
+            popular_searches = database.get_top_searches(reader, user_id, mode)
+            return render_template("results.html", popular_searches=popular_searches, mode=mode)
+        return history_page(user_id, ("popular_searches", mode), render, dated=mode != "all")
     else:
         # redirect user to login page in the case they are not logged in
         return redirect(url_for("login_handler"))
 
 
+# route for /export/history Flask app path, downloading the user's full search history for reporting, oldest first
+# ?format is csv (the default) or ndjson, and ?from and ?to (YYYY-MM-DD, inclusive) limit the export to a date range
+# entries are streamed from the database as the response is written, so memory use stays flat however long the history is
+@app.route("/export/history")
+def export_history():
+    # check if the user is logged in by seeing if a user_id is in session
+    if "user_id" not in session:
+        return redirect(url_for("login_handler"))
+    user_id = session["user_id"]
+
+    # return an error for an unknown format or malformed dates before any rows are read
+    export_format = request.args.get("format", "csv")
+    if export_format not in export.EXPORT_FORMATS:
+        return jsonify({"error": "Error: format must be csv or ndjson"}), 400
+    try:
+        start, end = export.parse_date_range(request.args.get("from"), request.args.get("to"))
+    except ValueError:
+        return jsonify({"error": "Error: from and to must be dates (YYYY-MM-DD), with to on or after from"}), 400
+
+    # stream the rows from the read-only session, once it has the user's latest searches
+    version = database.get_history_version(db.session, user_id)
+    reader = database.history_reader(db.session, user_id, version.history_version) if version else db.session
+    rows = database.iter_history(reader, user_id, start, end, settings.EXPORT_BATCH_SIZE)
+    writer = export.export_csv if export_format == "csv" else export.export_ndjson
+    mimetype, extension = export.EXPORT_FORMATS[export_format]
+    response = Response(stream_with_context(writer(rows, settings.EXPORT_BATCH_SIZE)), mimetype=mimetype)
+    response.headers["Content-Disposition"] = f"attachment; filename=search_history.{extension}"
+    response.cache_control.private = True
+    response.cache_control.no_store = True
+    return response
+
+
+# route for /api/upstream/quota URL Flask app path, reporting the remaining OpenCage and FourSquare budget of each API key (by fingerprint) in this process,
+# and how many upstream calls concurrent searches have shared
+@app.route("/api/upstream/quota", methods=["GET"])
+def upstream_quota():
+    response = jsonify({"quotas": upstream.quotas.stats(), "coalescing": upstream.calls.stats()})
+    response.cache_control.no_store = True
+    return response
+
+
+# route for /api/popular/nearby URL Flask app path, returning the places saved most often by all users within a radius of a point
+# takes lat and lng query parameters, with optional radius in metres and limit, and refreshes the cross-property rollup first if it is stale
+@app.route("/api/popular/nearby")
+def popular_nearby():
+    # the rollup combines every user's history, so it is only available to logged in users
+    if "user_id" not in session:
+        return jsonify({"error": "Error: log in to view popular places"}), 401
+    try:
+        latitude = float(request.args["lat"])
+        longitude = float(request.args["lng"])
+        radius = float(request.args.get("radius", settings.ROLLUP_DEFAULT_RADIUS))
+        limit = int(request.args.get("limit", 10))
+    except (KeyError, ValueError):
+        return jsonify({"error": "Error: lat and lng are required, and radius and limit must be numbers"}), 400
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180) or not 0 < radius <= settings.ROLLUP_MAX_RADIUS or not 0 < limit <= 100:
+        return jsonify({"error": f"Error: coordinates must be valid, radius between 0 and {settings.ROLLUP_MAX_RADIUS} metres, and limit between 1 and 100"}), 400
+
+    rollup.refresh_rollup_if_stale(db.session)
+    return jsonify({"results": rollup.nearby_popular_places(db.session, latitude, longitude, radius, limit)})
+
+
+# command to refresh the cross-property rollup from search_history, for running on a schedule, with --full to rebuild it from scratch
+# run with: flask --app app refresh-rollup
+@app.cli.command("refresh-rollup")
+@click.option("--full", is_flag=True, help="Rebuild the rollup from every search history entry.")
+def refresh_rollup_command(full):
+    added = rollup.refresh_rollup(db.session, full=full)
+    print(f"Added {added} search history entries to the popular places rollup")
+
+
+# command to bulk import a JSON or CSV dump of places into the local place store, with --covers to record the area the dump fully covers
+# run with: flask --app app import-places places.json --covers 51.5,-0.12,5000
+@app.cli.command("import-places")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--covers", help="Latitude, longitude and radius in metres of the area the dump holds every place for.")
+def import_places_command(path, covers):
+    if covers:
+        try:
+            latitude, longitude, radius = (float(value) for value in covers.split(","))
+        except ValueError:
+            raise click.BadParameter("expected latitude,longitude,radius", param_hint="--covers")
+        covers = (latitude, longitude, radius)
+    stored = places.load_places(db.session, path, covers)
+    print(f"Imported {stored} places into the local place store")
+
+
+# command to rebuild the place_popularity counts from search_history, run with: flask --app app rebuild-popularity
+@app.cli.command("rebuild-popularity")
+def rebuild_popularity_command():
+    database.rebuild_popularity(db.session)
+    db.session.commit()
+    print("Rebuilt place popularity counts from search history")
+
+
+# command to compare the place_popularity counts with search_history, exiting with an error if they differ, run with: flask --app app check-popularity
+@app.cli.command("check-popularity")
+def check_popularity_command():
+    mismatches = database.check_popularity(db.session)
+    for user_id, place_name, address, expected, stored in mismatches:
+        print(f"user {user_id}: {place_name}, {address} - expected {expected}, stored {stored}")
+    if mismatches:
+        raise SystemExit(1)
+    print("Place popularity counts match search history")
+
+
 if __name__ == "__main__":
-    with app.app_context():
-        # create all database tables
-        db.create_all()
     app.run(debug=True)
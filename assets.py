@@ -0,0 +1,33 @@
+import hashlib  # content hashes of static files
+import os
+import threading  # lock guarding the hash cache across request threads
+
+# content hashes of static files, keyed by path and cached with the file's modification time so an edited file gets a new hash
+versions = {}
+lock = threading.Lock()
+
+
+# function to obtain a short content hash of a file in the static folder, or None if the file does not exist
+def static_version(static_folder, filename):
+    path = os.path.join(static_folder, filename)
+    try:
+        modified = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    with lock:
+        cached = versions.get(path)
+    if cached is not None and cached[0] == modified:
+        return cached[1]
+    with open(path, "rb") as file:
+        version = hashlib.sha256(file.read()).hexdigest()[:12]
+    with lock:
+        versions[path] = (modified, version)
+    return version
+
+
+# function to add the content hash of a static file to its URL as ?v=, for an app.url_defaults hook, so url_for("static", ...) links change whenever the file does
+def add_static_version(static_folder, endpoint, values):
+    if endpoint == "static" and "filename" in values and "v" not in values:
+        version = static_version(static_folder, values["filename"])
+        if version is not None:
+            values["v"] = version
@@ -0,0 +1,53 @@
+from async_utils import get_destinations_async, merge_destinations
+from cache import PlacesCache
+from unittest.mock import AsyncMock, Mock, patch
+from app import app
+import asyncio
+import unittest
+import httpx
+import async_utils
+
+
+class TestAsyncUtils(unittest.TestCase):
+    def test_merge_destinations(self):
+        merged = merge_destinations([[{"fsq_id": "a", "distance": 300}, {"fsq_id": "b", "distance": 100}], [{"fsq_id": "a", "distance": 300}, {"fsq_id": "c", "distance": 200}]])
+        self.assertEqual([result["fsq_id"] for result in merged], ["b", "c", "a"])
+
+    def test_get_destinations_async_fans_out_per_category(self):
+        requested = []
+
+        def handler(request):
+            category = request.url.params["categories"]
+            requested.append(category)
+            results = {"13000": [{"fsq_id": "cafe", "distance": 50, "location": {"formatted_address": "1 High St"}}],
+                       "16000": [{"fsq_id": "park", "distance": 20, "location": {"formatted_address": "The Park"}},
+                                 {"fsq_id": "cafe", "distance": 50, "location": {"formatted_address": "1 High St"}}]}
+            return httpx.Response(200, json={"results": results[category]})
+
+        async def search():
+            async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+                return await get_destinations_async(client, 51.5, -0.1, "13000,16000", 1000)
+
+        with patch.object(async_utils, "places_cache", PlacesCache()):
+            results = asyncio.run(search())
+
+        self.assertEqual(sorted(requested), ["13000", "16000"])
+        self.assertEqual([result["fsq_id"] for result in results], ["park", "cafe"])
+
+    def test_search_location_async(self):
+        results = [{"fsq_id": "park", "name": "The Park", "location": {"formatted_address": "The Park"}}]
+        save_later = Mock()
+        with patch.object(async_utils, "get_coordinates_async", AsyncMock(return_value=(51.5, -0.1, None))), \
+                patch.object(async_utils, "get_destinations_async", AsyncMock(return_value=results)), \
+                patch.object(async_utils, "save_history_later", save_later):
+            client = app.test_client()
+            with client.session_transaction() as session:
+                session["user_id"] = 1
+            response = client.post("/search/async", data={"search": "SW1A 0AA", "categories": ["16000"], "radius": 1000})
+
+        self.assertEqual([result["name"] for result in response.get_json()["results"]], ["The Park"])
+        self.assertEqual(save_later.call_args[0][1:], (1, results))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+from concurrent.futures import ThreadPoolExecutor  # background thread for saving history off the response path
+from database import db, save_history  # database session and function from database.py
+from cache import geocode_cache, places_cache  # caches shared with the synchronous search path
+import asyncio  # for running FourSquare requests concurrently
+import httpx  # non-blocking HTTP client
+import config  # contains API keys
+import upstream  # async requests with retries and circuit breakers
+import utils  # response parsing shared with the synchronous search path
+
+# single background thread saving search history, so history writes happen after the JSON response is returned
+history_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history")
+
+
+# non-blocking version of utils.get_coordinates, returning latitude, longitude and an error message
+async def get_coordinates_async(client, search):
+    # return the cached result if this location was geocoded recently, avoiding a call to OpenCage
+    cached = geocode_cache.get(search)
+    if cached is not None:
+        return cached
+
+    # request the location within the API key's quota, sharing the request with concurrent searches for the same location on either search path
+    async def request_coordinates():
+        url = "https://api.opencagedata.com/geocode/v1/json"
+        param_dict = {"q": search, "key": config.key1}
+        response = await upstream.get_async(client, url, params=param_dict, quota=("opencage", config.key1))
+        return utils.read_coordinates(search, response.json())
+
+    try:
+        return await upstream.calls.do_async(("opencage", geocode_cache.normalise(search)), request_coordinates)
+
+    # except block error messages for a used up quota, an unavailable or slow API, and unknown cases of error
+    except upstream.QuotaExhaustedError:
+        return None, None, "Error: location search limit reached - please try again later"
+    except upstream.CircuitOpenError:
+        return None, None, "Error: location service temporarily unavailable - please try again shortly"
+    except httpx.TimeoutException:
+        return None, None, "Error: location service timed out - please try again"
+    except httpx.TransportError:
+        return None, None, "Error: connection failure - check your internet connection"
+    except Exception:
+        return None, None, "Error: failed to retrieve destinations"
+
+
+# requests places for a single category from FourSquare, returning a tuple of filtered results and an error message (one of which is None)
+# the request is counted against the API key's quota, and shared with concurrent async searches for the same category in the same grid cell
+async def fetch_category_async(client, latitude, longitude, category, radius):
+    url = "https://api.foursquare.com/v3/places/search"
+    header = {"accept": "application/json", "Authorization": config.key2}
+    param_dict = {"ll": f"{latitude},{longitude}",
+                  "sort": "DISTANCE",
+                  "radius": radius,
+                  "categories": category}
+
+    async def request_category():
+        response = await upstream.get_async(client, url, params=param_dict, headers=header, quota=("foursquare", config.key2))
+        data = response.json()
+        if response.status_code == 200:
+            return utils.filter_destinations(data), None
+        else:
+            return None, f"Error: {data['message']}"
+    return await upstream.calls.do_async(("foursquare-category", places_cache.key(latitude, longitude, category, radius)), request_category)
+
+
+# function to merge results from several categories, removing places returned for more than one category (by FourSquare ID) and sorting by distance
+def merge_destinations(result_lists):
+    merged = {}
+    for results in result_lists:
+        for result in results:
+            merged.setdefault(result.get("fsq_id") or id(result), result)
+    return sorted(merged.values(), key=lambda result: result.get("distance", 0))
+
+
+# non-blocking version of utils.get_destinations without the history write, sending one FourSquare request per selected category concurrently
+# returns the list of results, or a string message if there are no results or every request failed
+async def get_destinations_async(client, latitude, longitude, categories, radius):
+    try:
+        # reuse results cached by any earlier search in the same grid cell, with stale results refreshed in the background
+        key = places_cache.key(latitude, longitude, categories, radius)
+        filtered_results = places_cache.get(key, lambda: utils.fetch_destinations(latitude, longitude, categories, radius, background=True)[0])
+
+        if filtered_results is None:
+            # one request per category, or a single request when no categories are selected
+            category_list = [category for category in categories.split(",") if category] or [""]
+            responses = await asyncio.gather(*(fetch_category_async(client, latitude, longitude, category, radius) for category in category_list), return_exceptions=True)
+
+            result_lists = [response[0] for response in responses if not isinstance(response, BaseException) and response[1] is None]
+            if not result_lists:
+                # report the API error message if one was returned, otherwise re-raise the first failure for the except blocks below
+                for response in responses:
+                    if not isinstance(response, BaseException):
+                        return response[1]
+                raise responses[0]
+
+            filtered_results = merge_destinations(result_lists)
+            # only complete responses are cached, so a failed category is retried on the next search
+            if len(result_lists) == len(category_list):
+                places_cache.set(key, filtered_results)
+
+        if len(filtered_results) > 0:
+            return list(filtered_results)
+        else:
+            return "No valid locations found for this area"
+
+    # except block error messages for a used up quota, an unavailable or slow API, and unknown cases of error
+    except upstream.QuotaExhaustedError:
+        return "Error: place search limit reached - please try again later"
+    except upstream.CircuitOpenError:
+        return "Error: place service temporarily unavailable - please try again shortly"
+    except httpx.TimeoutException:
+        return "Error: place service timed out - please try again"
+    except httpx.TransportError:
+        return "Error: connection failure - check your internet connection"
+    except Exception:
+        return "Error: failed to retrieve destinations"
+
+
+# function run on the history thread, saving results to a user's search history inside an app context
+def save_history_in_background(app, user_id, results):
+    with app.app_context():
+        save_history(db.session, user_id, results)
+
+
+# function to queue a search history write for a logged in user, returning without waiting for the database commit
+def save_history_later(app, user_id, results):
+    return history_executor.submit(save_history_in_background, app, user_id, results)
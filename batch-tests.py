@@ -0,0 +1,47 @@
+from batch import parse_batch_item, search_batch
+from unittest.mock import Mock, patch
+from app import app
+import unittest
+import json
+import settings
+import utils
+
+
+class TestBatch(unittest.TestCase):
+    def test_parse_batch_item(self):
+        self.assertEqual(parse_batch_item({"search": "London", "categories": [13000, 16000], "radius": "500"}), ("London", "13000,16000", 500, None))
+        self.assertEqual(parse_batch_item({"search": "L"})[3], "Error: query is too short (2+ characters needed)")
+        self.assertIsNotNone(parse_batch_item({"search": "London", "radius": "far"})[3])
+        self.assertIsNotNone(parse_batch_item("London")[3])
+
+    def test_search_batch_deduplicates_geocodes(self):
+        get_coordinates = Mock(return_value=(51.5, -0.12, None))
+        get_destinations = Mock(return_value=[{"name": "Big Ben"}])
+        items = [{"search": "London"}, {"search": " london "}, {"search": "Paris", "radius": 500}, {"search": "x"}]
+
+        with patch.object(utils, "get_coordinates", get_coordinates), patch.object(utils, "get_destinations", get_destinations):
+            results = sorted(search_batch(app, items, None), key=lambda result: result["index"])
+
+        self.assertEqual(get_coordinates.call_count, 2)
+        self.assertEqual(get_destinations.call_count, 3)
+        self.assertEqual([result["index"] for result in results], [0, 1, 2, 3])
+        self.assertEqual(results[0]["results"], [{"name": "Big Ben"}])
+        self.assertIn("error", results[3])
+
+    def test_search_batch_endpoint(self):
+        with patch.object(utils, "get_coordinates", Mock(return_value=(None, None, "Error: location not found - please use a valid location"))):
+            response = app.test_client().post("/api/search/batch", json={"queries": [{"search": "Atlantis"}, {"search": "El Dorado"}]})
+            lines = [json.loads(line) for line in response.data.decode().splitlines()]
+
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(all("location not found" in line["error"] for line in lines))
+
+    def test_search_batch_endpoint_limits(self):
+        client = app.test_client()
+        self.assertEqual(client.post("/api/search/batch", json=[]).status_code, 400)
+        self.assertEqual(client.post("/api/search/batch", json=[{"search": "London"}] * (settings.BATCH_MAX_ITEMS + 1)).status_code, 400)
+
+
+if __name__ == "__main__":
+    unittest.main()
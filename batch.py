@@ -0,0 +1,82 @@
+from concurrent.futures import ThreadPoolExecutor  # bounded pool of threads running the upstream calls
+from cache import GeocodeCache  # for normalising queries so identical locations are geocoded once
+from database import db  # database session for saving history from the pool threads
+import queue  # completed items are passed from the pool threads back to the streaming response
+import settings  # batch size and concurrency limits
+import utils  # validation, geocoding and place search shared with /search
+
+
+# function to validate one batch item, returning a tuple of the query, comma separated categories, radius and an error message (None if the item is valid)
+# items are dictionaries with a "search" query, and optionally "categories" (a list or comma separated string of FourSquare category IDs) and "radius" in metres
+def parse_batch_item(item):
+    if not isinstance(item, dict):
+        return None, None, None, "Error: each item must be an object with a search query"
+
+    # check validity of the query with enter_query, in the same way as /search
+    query, error_message = utils.enter_query(str(item.get("search", "")))
+    if not query:
+        return None, None, None, error_message
+
+    categories = item.get("categories", [])
+    if isinstance(categories, list):
+        categories = ",".join(str(category) for category in categories)
+
+    try:
+        radius = int(item.get("radius", settings.BATCH_DEFAULT_RADIUS))
+    except (TypeError, ValueError):
+        return None, None, None, "Error: radius must be a whole number of metres"
+
+    return query, str(categories), radius, None
+
+
+# generator running a batch of searches on a bounded thread pool, yielding a result dictionary for each item as soon as it completes (not in request order)
+# identical locations are geocoded once and shared by every item that uses them, and results are saved to the history of a logged in user
+def search_batch(app, items, user_id):
+    completed = queue.Queue()
+    pending = 0
+    groups = {}
+
+    # report invalid items straight away and group valid items by their normalised query
+    for index, item in enumerate(items):
+        query, categories, radius, error_message = parse_batch_item(item)
+        if error_message:
+            yield {"index": index, "error": error_message}
+            continue
+        groups.setdefault(GeocodeCache.normalise(query), []).append((index, query, categories, radius))
+        pending += 1
+
+    executor = ThreadPoolExecutor(max_workers=settings.BATCH_CONCURRENCY, thread_name_prefix="batch")
+
+    # function run on the pool to search for places around an already geocoded location for one item
+    def search_item(index, latitude, longitude, categories, radius):
+        try:
+            with app.app_context():
+                results = utils.get_destinations(latitude, longitude, categories, radius, user_id, db.session)
+            if isinstance(results, list):
+                completed.put({"index": index, "latitude": latitude, "longitude": longitude, "results": results})
+            else:
+                completed.put({"index": index, "error": results})
+        except Exception as e:
+            completed.put({"index": index, "error": str(e)})
+
+    # function run on the pool to geocode a location once, then queue a place search for every item sharing it
+    def geocode_group(group):
+        try:
+            latitude, longitude, error_message = utils.get_coordinates(group[0][1])
+        except Exception as e:
+            latitude, longitude, error_message = None, None, str(e)
+        for index, query, categories, radius in group:
+            if not latitude or not longitude:
+                completed.put({"index": index, "error": error_message})
+            else:
+                executor.submit(search_item, index, latitude, longitude, categories, radius)
+
+    try:
+        for group in groups.values():
+            executor.submit(geocode_group, group)
+        # yield each item as it completes
+        for _ in range(pending):
+            yield completed.get()
+    finally:
+        # cancel outstanding work if the client disconnects before the batch finishes
+        executor.shutdown(wait=False, cancel_futures=True)
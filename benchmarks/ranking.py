@@ -0,0 +1,75 @@
+# benchmark of result ranking around two origins, comparing rank_places on FourSquare style result dictionaries (as searches run it) with scoring each place in a Python loop
+# with one geo.haversine call per place and origin, for a page of results and for 5,000 candidate places; the vectorised scoring alone is shown to separate it from reading the dictionaries
+# run from the project folder with: python benchmarks/ranking.py
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+import geo  # noqa: E402
+import ranking  # noqa: E402
+import settings  # noqa: E402
+from database import in_categories  # noqa: E402
+
+SIZES = [settings.PLACES_PAGE_SIZE, 5000]
+REPEATS = 20
+ORIGINS = [(51.5007, -0.1246), (51.5136, -0.0984)]
+RADIUS = 3000
+
+
+# function to time a function over REPEATS runs, returning the best time in milliseconds
+def measure(function):
+    best = float("inf")
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        function()
+        best = min(best, (time.perf_counter() - start) * 1000)
+    return best
+
+
+# function to rank result dictionaries with the same score as rank_places, one place at a time
+def rank_per_place(results, popularity):
+    weights = settings.RANKING_WEIGHTS
+    most_popular = max(popularity.values(), default=0)
+    ranked = []
+    for result in results:
+        main = result["geocodes"]["main"]
+        distances = [geo.haversine(latitude, longitude, main["latitude"], main["longitude"]) for latitude, longitude in ORIGINS]
+        count = popularity.get((result["name"], result["location"]["formatted_address"]), 0)
+        distance_score = min(1, max(0, 1 - max(distances) / RADIUS))
+        category_score = in_categories([str(category["id"]) for category in result["categories"]], {"13000"})
+        popularity_score = math.log1p(count) / math.log1p(most_popular) if most_popular else 0
+        score = weights["distance"] * distance_score + weights["category"] * category_score + weights["popularity"] * popularity_score
+        ranked.append(dict(result, score=round(score, 4), distances=[round(distance) for distance in distances]))
+    return sorted(ranked, key=lambda result: -result["score"])
+
+
+def main():
+    random.seed(1)
+    for size in SIZES:
+        results = [{"name": f"Place {number}", "location": {"formatted_address": f"{number} Strand, London"},
+                    "geocodes": {"main": {"latitude": 51.5 + random.uniform(-0.02, 0.02), "longitude": -0.12 + random.uniform(-0.03, 0.03)}},
+                    "categories": [{"id": random.choice([13065, 10027, 16020])}]} for number in range(size)]
+        popularity = {(result["name"], result["location"]["formatted_address"]): random.randint(0, 50) for result in results}
+        latitudes = np.array([result["geocodes"]["main"]["latitude"] for result in results])
+        longitudes = np.array([result["geocodes"]["main"]["longitude"] for result in results])
+        category_match = np.array([float(result["categories"][0]["id"] == 13065) for result in results])
+        counts = np.array([float(count) for count in popularity.values()])
+
+        # scoring and ordering alone, from coordinate arrays that have already been read from the dictionaries
+        def scoring_only():
+            distances = ranking.haversine_matrix(ORIGINS, latitudes, longitudes)
+            np.argsort(-ranking.score(distances, category_match, counts, RADIUS, settings.RANKING_WEIGHTS), kind="stable")
+
+        print(f"{size} places:")
+        print(f"  rank_places from result dictionaries: {measure(lambda: ranking.rank_places(results, ORIGINS, '13000', RADIUS, popularity)):.3f} ms")
+        print(f"  per-place ranking from result dictionaries: {measure(lambda: rank_per_place(results, popularity)):.3f} ms")
+        print(f"  vectorised scoring alone, from arrays: {measure(scoring_only):.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
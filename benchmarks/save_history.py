@@ -0,0 +1,61 @@
+# benchmark comparing the previous per-row ORM save_history with the bulk INSERT path, writing 10,000 rows to a temporary SQLite database
+# run from the project folder with: python benchmarks/save_history.py
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+from database import db, User, SearchHistory, save_history  # noqa: E402
+
+ROWS = 10000
+REPEATS = 3
+
+
+# previous implementation of save_history, adding one SearchHistory ORM object per result before committing
+def save_history_per_row(db_session, user_id, results):
+    user = db_session.get(User, user_id)
+    if user:
+        for result in results:
+            db_session.add(SearchHistory(user_id=user_id, place_name=result["name"], address=result["location"]["formatted_address"]))
+        db_session.commit()
+
+
+# function to time a save function over REPEATS runs of ROWS rows each, returning the best rows per second
+def measure(save, user_id, results):
+    best = 0
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        save(db.session, user_id, results)
+        best = max(best, ROWS / (time.perf_counter() - start))
+        db.session.query(SearchHistory).delete()
+        db.session.commit()
+    return best
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        app = Flask(__name__)
+        app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + os.path.join(directory, "benchmark.db")
+        db.init_app(app)
+
+        with app.app_context():
+            db.create_all()
+            user = User(username="benchmark", password="x")
+            db.session.add(user)
+            db.session.commit()
+
+            results = [{"name": f"Place {i}", "location": {"formatted_address": f"{i} High Street"}} for i in range(ROWS)]
+            before = measure(save_history_per_row, user.user_id, results)
+            after = measure(save_history, user.user_id, results)
+            db.session.remove()
+            db.engine.dispose()
+
+    print(f"per-row ORM save_history: {before:,.0f} rows/s")
+    print(f"bulk INSERT save_history: {after:,.0f} rows/s ({after / before:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
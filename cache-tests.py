@@ -0,0 +1,122 @@
+from cache import GeocodeCache, PlacesCache
+from unittest.mock import Mock, patch
+import tempfile
+import threading
+import time
+import unittest
+import os
+import settings
+import utils
+
+
+class TestGeocodeCache(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.cache = GeocodeCache(ttl=100, negative_ttl=10, max_size=2, clock=lambda: self.now)
+
+    def test_get_missing(self):
+        self.assertIsNone(self.cache.get("SW1A 0AA"))
+        self.assertEqual(self.cache.stats()["misses"], 1)
+
+    def test_normalised_hit(self):
+        self.cache.set("SW1A 0AA", 51.5, -0.14)
+        self.assertEqual(self.cache.get("  sw1a   0aa "), (51.5, -0.14, None))
+        self.assertEqual(self.cache.stats()["hits"], 1)
+
+    def test_ttl_expiry(self):
+        self.cache.set("London", 51.5, -0.12)
+        self.cache.set("Atlantis", None, None, "Error: location not found - please use a valid location")
+        self.now += 50
+        self.assertIsNotNone(self.cache.get("London"))
+        self.assertIsNone(self.cache.get("Atlantis"))
+        self.now += 100
+        self.assertIsNone(self.cache.get("London"))
+
+    def test_lru_eviction(self):
+        self.cache.set("London", 51.5, -0.12)
+        self.cache.set("Paris", 48.8, 2.35)
+        self.cache.get("London")
+        self.cache.set("Rome", 41.9, 12.5)
+        self.assertIsNotNone(self.cache.get("London"))
+        self.assertIsNone(self.cache.get("Paris"))
+
+    def test_persistence(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "cache.db")
+            GeocodeCache(path).set("London", 51.5, -0.12)
+            cache = GeocodeCache(path)
+            self.assertEqual(cache.get("london"), (51.5, -0.12, None))
+            cache.connection.close()
+
+    def test_cache_path_follows_database(self):
+        self.assertEqual(settings.sqlite_path("sqlite:///hotelhelper.db"), os.path.join(settings.BASE_DIR, "instance", "hotelhelper.db"))
+        self.assertEqual(settings.sqlite_path("sqlite:////var/lib/hotelhelper.db"), "/var/lib/hotelhelper.db")
+        # in-memory SQLite and PostgreSQL have no file for the cache to share, so it is kept in memory
+        self.assertIsNone(settings.sqlite_path("sqlite://"))
+        self.assertIsNone(settings.sqlite_path("sqlite:///:memory:"))
+        self.assertIsNone(settings.sqlite_path("postgresql://postgres@localhost/hotelhelper"))
+
+    def test_get_coordinates_uses_cache(self):
+        mock_response = Mock()
+        mock_response.json.return_value = {"status": {"code": 200}, "total_results": 0, "results": []}
+        mock_get = Mock(return_value=mock_response)
+
+        with patch.object(utils, "geocode_cache", GeocodeCache()), patch.object(utils.upstream, "get", mock_get):
+            first = utils.get_coordinates("Atlantis")
+            second = utils.get_coordinates("atlantis")
+
+        self.assertEqual(first, second)
+        self.assertIsNone(second[0])
+        self.assertEqual(mock_get.call_count, 1)
+
+
+class TestPlacesCache(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.cache = PlacesCache(max_age=100, stale_ttl=50, cell_size=0.01, clock=lambda: self.now)
+
+    def test_key_shared_by_nearby_searches(self):
+        self.assertEqual(self.cache.key(51.501, -0.141, "13000,10000", 1000), self.cache.key(51.502, -0.142, "10000,13000", "1000"))
+        self.assertNotEqual(self.cache.key(51.501, -0.141, "13000", 1000), self.cache.key(51.521, -0.141, "13000", 1000))
+        self.assertNotEqual(self.cache.key(51.501, -0.141, "13000", 1000), self.cache.key(51.501, -0.141, "13000", 500))
+
+    def test_fresh_stale_and_expired(self):
+        key = self.cache.key(51.5, -0.14, "", 1000)
+        self.cache.set(key, ["old"])
+        refreshed = threading.Event()
+
+        def refresh():
+            refreshed.set()
+            return ["new"]
+
+        self.assertEqual(self.cache.get(key, refresh), ["old"])
+        self.assertFalse(refreshed.is_set())
+        self.now += 120
+        self.assertEqual(self.cache.get(key, refresh), ["old"])
+        self.assertTrue(refreshed.wait(5))
+        for _ in range(100):
+            if not self.cache.refreshing:
+                break
+            time.sleep(0.01)
+        self.assertEqual(self.cache.get(key), ["new"])
+        self.now += 200
+        self.assertIsNone(self.cache.get(key))
+
+    def test_get_destinations_cache_hit_saves_history(self):
+        mock_response = Mock(status_code=200)
+        mock_response.json.return_value = {"results": [{"name": "Big Ben", "location": {"formatted_address": "London SW1A 0AA"}}]}
+        mock_get = Mock(return_value=mock_response)
+        mock_save = Mock()
+
+        with patch.object(utils, "places_cache", PlacesCache()), patch.object(utils.upstream, "get", mock_get), patch.object(utils, "save_history", mock_save):
+            first = utils.get_destinations(51.5007, -0.1246, "16000", 1000, 1, None)
+            second = utils.get_destinations(51.5008, -0.1245, "16000", 1000, 2, None)
+
+        self.assertEqual(first, second)
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertEqual(mock_save.call_count, 2)
+        self.assertEqual(mock_save.call_args[0][1], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
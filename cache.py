@@ -0,0 +1,232 @@
+from collections import OrderedDict  # ordered dictionary used as the in-memory LRU store
+import os  # for creating the folder containing the cache database
+import sqlite3  # SQLite table backing the cache, so entries survive restarts and are shared between workers
+import threading  # lock guarding the cache across request threads
+import time  # timestamps for entry expiry
+import settings  # cache sizes and time-to-live values
+
+
+# geocode cache placed in front of the OpenCage API, mapping a normalised query to a (latitude, longitude, error_message) result
+# entries are held in an in-memory LRU dictionary and written through to a SQLite table, with found locations and "not found" results expiring separately
+class GeocodeCache:
+    def __init__(self, path=None, ttl=settings.GEOCODE_CACHE_TTL, negative_ttl=settings.GEOCODE_CACHE_NEGATIVE_TTL, max_size=settings.GEOCODE_CACHE_SIZE, clock=time.time):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.connection = None
+
+        # open the backing SQLite table if a path is provided, creating it on first use
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.connection = sqlite3.connect(path, timeout=5, check_same_thread=False)
+            self.connection.execute("CREATE TABLE IF NOT EXISTS geocode_cache (query TEXT PRIMARY KEY, latitude REAL, longitude REAL, error TEXT, expires_at REAL NOT NULL, stored_at REAL NOT NULL)")
+            self.connection.commit()
+
+    # function to normalise a query so that "SW1A 0AA", "sw1a 0aa" and " SW1A  0AA " share one cache entry
+    @staticmethod
+    def normalise(query):
+        return " ".join(query.lower().split())
+
+    # function to return the cached (latitude, longitude, error_message) result for a query, or None if it is missing or expired
+    def get(self, query):
+        key = self.normalise(query)
+        now = self.clock()
+        with self.lock:
+            entry = self.entries.get(key)
+
+            # fall back to the SQLite table if the entry is not held in memory, such as after a restart or when another worker stored it
+            if entry is None and self.connection is not None:
+                row = self.connection.execute("SELECT latitude, longitude, error, expires_at FROM geocode_cache WHERE query = ?", (key,)).fetchone()
+                if row:
+                    entry = ((row[0], row[1], row[2]), row[3])
+                    self._remember(key, entry)
+
+            # expired entries are discarded and counted as a miss
+            if entry is not None and entry[1] <= now:
+                self._forget(key)
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            # mark the entry as most recently used and count the hit
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    # function to store a result for a query, using the shorter negative time-to-live for "location not found" results
+    def set(self, query, latitude, longitude, error_message=None):
+        key = self.normalise(query)
+        now = self.clock()
+        expires_at = now + (self.negative_ttl if error_message else self.ttl)
+        entry = ((latitude, longitude, error_message), expires_at)
+        with self.lock:
+            self._remember(key, entry)
+            if self.connection is not None:
+                self.connection.execute("INSERT OR REPLACE INTO geocode_cache (query, latitude, longitude, error, expires_at, stored_at) VALUES (?, ?, ?, ?, ?, ?)", (key, latitude, longitude, error_message, expires_at, now))
+                # prune expired rows and keep the table within the size limit, removing the oldest stored rows first
+                self.connection.execute("DELETE FROM geocode_cache WHERE expires_at <= ?", (now,))
+                self.connection.execute("DELETE FROM geocode_cache WHERE query NOT IN (SELECT query FROM geocode_cache ORDER BY stored_at DESC LIMIT ?)", (self.max_size,))
+                self.connection.commit()
+
+    # function to remove every cached entry, in memory and in the SQLite table
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+            if self.connection is not None:
+                self.connection.execute("DELETE FROM geocode_cache")
+                self.connection.commit()
+
+    # function to report cache counters, useful for checking how many OpenCage calls the cache is saving
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self.entries)}
+
+    # function to add an entry to the in-memory store, evicting the least recently used entry once the size limit is reached
+    def _remember(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    # function to remove an expired entry from memory and from the SQLite table
+    def _forget(self, key):
+        self.entries.pop(key, None)
+        if self.connection is not None:
+            self.connection.execute("DELETE FROM geocode_cache WHERE query = ?", (key,))
+            self.connection.commit()
+
+
+# FourSquare results cache keyed on a grid cell of the search coordinates, the sorted categories and the radius, so nearby searches by different staff share one response
+# results younger than max_age are fresh; results up to stale_ttl older are still served, while a single background refresh replaces them
+class PlacesCache:
+    def __init__(self, max_age=settings.PLACES_CACHE_MAX_AGE, stale_ttl=settings.PLACES_CACHE_STALE_TTL, cell_size=settings.PLACES_CACHE_CELL_SIZE, max_size=settings.PLACES_CACHE_SIZE, clock=time.time):
+        self.max_age = max_age
+        self.stale_ttl = stale_ttl
+        self.cell_size = cell_size
+        self.max_size = max_size
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.refreshing = set()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    # function to build the cache key for a search, snapping the coordinates to a grid cell and sorting the comma separated categories
+    def key(self, latitude, longitude, categories, radius):
+        cell = (int(float(latitude) // self.cell_size), int(float(longitude) // self.cell_size))
+        category_set = ",".join(sorted(category for category in str(categories or "").split(",") if category))
+        return cell, category_set, int(radius)
+
+    # function to return cached results for a key, or None if there are none or they are too old to serve
+    # if the results are stale and a refresh function is provided, it is called on a background thread to replace them
+    def get(self, key, refresh=None):
+        now = self.clock()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or now - entry[1] >= self.max_age + self.stale_ttl:
+                self.entries.pop(key, None)
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            if now - entry[1] < self.max_age:
+                self.hits += 1
+                return entry[0]
+
+            # stale results are served, starting one background refresh per key
+            self.stale_hits += 1
+            if refresh is not None and key not in self.refreshing:
+                self.refreshing.add(key)
+                threading.Thread(target=self._refresh, args=(key, refresh), daemon=True).start()
+            return entry[0]
+
+    # function to store results for a key, evicting the least recently used search once the size limit is reached
+    def set(self, key, results):
+        with self.lock:
+            self.entries[key] = (results, self.clock())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    # function to remove every cached search
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.stale_hits = 0
+            self.misses = 0
+
+    # function to report cache counters
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "stale_hits": self.stale_hits, "misses": self.misses, "size": len(self.entries)}
+
+    # function run on a background thread to refresh stale results, keeping the stale results if the refresh fails
+    def _refresh(self, key, refresh):
+        try:
+            results = refresh()
+            if results is not None:
+                self.set(key, results)
+        except Exception:
+            pass
+        finally:
+            with self.lock:
+                self.refreshing.discard(key)
+
+
+# rendered page cache, an in-memory LRU of page bodies and their ETags
+# keys include everything the page depends on (such as the user's history version), so entries never need invalidating and old ones are evicted as new ones are added
+class PageCache:
+    def __init__(self, max_size=settings.PAGE_CACHE_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    # function to obtain the cached page for a key, or None if it is not cached
+    def get(self, key):
+        with self.lock:
+            page = self.entries.get(key)
+            if page is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return page
+
+    # function to cache a page for a key, evicting the least recently used pages beyond max_size
+    def set(self, key, page):
+        with self.lock:
+            self.entries[key] = page
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    # function to remove every cached page
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    # function to report cache counters
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self.entries)}
+
+
+# shared caches used by utils.get_coordinates and utils.get_destinations, and by the history pages in app.py
+geocode_cache = GeocodeCache(settings.GEOCODE_CACHE_PATH)
+places_cache = PlacesCache()
+page_cache = PageCache()
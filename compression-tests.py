@@ -0,0 +1,63 @@
+from flask import Flask, Response, jsonify, request
+from unittest.mock import patch
+import compression
+import unittest
+import gzip
+
+app = Flask(__name__)
+
+
+@app.route("/large")
+def large():
+    response = jsonify({"results": [{"name": f"Place {number}", "location": {"formatted_address": f"{number} Strand, London"}} for number in range(100)]})
+    response.set_etag("results")
+    return response
+
+
+@app.route("/small")
+def small():
+    return jsonify({"results": []})
+
+
+@app.route("/text")
+def text():
+    return Response("x" * 1000, mimetype="text/plain")
+
+
+@app.after_request
+def compress(response):
+    return compression.compress_response(response, request)
+
+
+class TestCompression(unittest.TestCase):
+    def setUp(self):
+        self.client = app.test_client()
+
+    def test_gzip_json(self):
+        response = self.client.get("/large", headers={"Accept-Encoding": "gzip, deflate"})
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", response.headers["Vary"])
+        self.assertIn(b"Place 99", gzip.decompress(response.data))
+        self.assertTrue(response.headers["ETag"].startswith("W/"))
+
+    def test_uncompressed_without_accept_encoding(self):
+        response = self.client.get("/large")
+        self.assertNotIn("Content-Encoding", response.headers)
+        self.assertEqual(response.headers["ETag"], '"results"')
+
+    def test_small_and_other_types_are_not_compressed(self):
+        self.assertNotIn("Content-Encoding", self.client.get("/small", headers={"Accept-Encoding": "gzip"}).headers)
+        self.assertNotIn("Content-Encoding", self.client.get("/text", headers={"Accept-Encoding": "gzip"}).headers)
+
+    def test_brotli_preferred_when_installed(self):
+        fake_brotli = type("brotli", (), {"compress": staticmethod(lambda data, quality: b"br:" + data)})
+        with patch.object(compression, "brotli", fake_brotli):
+            response = self.client.get("/large", headers={"Accept-Encoding": "gzip, br"})
+        self.assertEqual(response.headers["Content-Encoding"], "br")
+        self.assertTrue(response.data.startswith(b"br:"))
+        with patch.object(compression, "brotli", None):
+            self.assertEqual(self.client.get("/large", headers={"Accept-Encoding": "br"}).headers.get("Content-Encoding"), None)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+import gzip  # gzip compression, always available
+import settings  # compression level, minimum size and compressed content types
+
+# brotli is optional: responses are only brotli compressed when the package is installed
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# function to choose the content encoding for a request from its Accept-Encoding header, brotli first when available, or None to send the response uncompressed
+def choose_encoding(accept_encodings):
+    if brotli is not None and accept_encodings["br"]:
+        return "br"
+    if accept_encodings["gzip"]:
+        return "gzip"
+    return None
+
+
+# function to compress a JSON or HTML response for a request that accepts gzip or brotli, returning the response
+# streamed responses, responses that are already encoded or smaller than settings.COMPRESSION_MIN_SIZE, and other content types are left as they are
+# a strong ETag is made weak, since the compressed body differs byte for byte from the one it was calculated for, and weak ETags still match conditional requests
+def compress_response(response, request):
+    response.vary.add("Accept-Encoding")
+    if response.direct_passthrough or response.is_streamed or response.status_code != 200 or "Content-Encoding" in response.headers:
+        return response
+    if response.mimetype not in settings.COMPRESSION_MIMETYPES:
+        return response
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+    data = response.get_data()
+    if len(data) < settings.COMPRESSION_MIN_SIZE:
+        return response
+
+    if encoding == "br":
+        response.set_data(brotli.compress(data, quality=settings.COMPRESSION_LEVEL))
+    else:
+        response.set_data(gzip.compress(data, compresslevel=settings.COMPRESSION_LEVEL, mtime=0))
+    response.headers["Content-Encoding"] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
@@ -1,7 +1,68 @@
-from database import db, User, SearchHistory, hash_password, save_history, get_history, get_top_searches, delete_account
+from database import db, User, SearchHistory, hash_password, save_history, get_history, get_top_searches, search_history, delete_account
+from unittest.mock import patch
+from migrations import run_migrations
+from flask import Flask
+from sqlalchemy import text
+import database
+import rollup
+import tempfile
 import unittest
+import os
 from app import app
 
+# URI of a PostgreSQL database to compare with SQLite, such as postgresql://postgres@localhost/hotelhelper_test; the comparison is skipped without one
+POSTGRES_URI = os.environ.get("TEST_DATABASE_URL")
+
+
+# function to create a Flask app using the database at a URI, configured in the same way as app.py
+def create_backend_app(uri):
+    backend_app = Flask(__name__)
+    backend_app.config["SQLALCHEMY_DATABASE_URI"] = uri
+    backend_app.config["SQLALCHEMY_ENGINE_OPTIONS"] = database.engine_options(uri)
+    db.init_app(backend_app)
+    return backend_app
+
+
+# function to run the same history, popularity, keyword and spatial queries against the database of an app, returning their results for comparison between backends
+def run_queries(backend_app):
+    results = [{"name": "Eiffel Tower", "location": {"formatted_address": "Champ de Mars, 75007 Paris, France"}, "geocodes": {"main": {"latitude": 48.8584, "longitude": 2.2945}}},
+               {"name": "Louvre Museum", "location": {"formatted_address": "Rue de Rivoli, 75001 Paris, France"}, "geocodes": {"main": {"latitude": 48.8606, "longitude": 2.3376}}},
+               {"name": "Big Ben", "location": {"formatted_address": "London SW1A 0AA, United Kingdom"}}]
+    with backend_app.app_context():
+        db.drop_all()
+        db.create_all()
+        run_migrations(db.engine)
+        try:
+            user = User(username="testuser", password=hash_password("password123"))
+            db.session.add(user)
+            db.session.commit()
+            user_id = user.user_id
+            save_history(db.session, user_id, results)
+            save_history(db.session, user_id, results[:2])
+            save_history(db.session, user_id, results[:1])
+
+            first_page = get_history(db.session, user_id, page_size=2)
+            queries = {
+                "history": [(row.place_name, row.address) for row in get_history(db.session, user_id)],
+                "pages": [row.place_name for row in first_page + get_history(db.session, user_id, page_size=2, cursor=database.encode_cursor(first_page[-1]))],
+                "count": database.count_history(db.session, user_id),
+                "top": {mode: [(row.place_name, round(float(row.search_count), 6)) for row in get_top_searches(db.session, user_id, mode)] for mode in database.POPULARITY_MODES},
+                "keyword": {keyword: sorted(row.place_name for row in search_history(db.session, user_id, keyword)) for keyword in ["eiffel", "PARIS", "ou", "rivoli", "zz"]},
+                "check": database.check_popularity(db.session),
+                "saved": [place["name"] for place in database.find_saved_places(db.session, 48.8584, 2.2945, 5000)],
+                "rollup": (rollup.refresh_rollup(db.session), [(place["place_name"], place["search_count"]) for place in rollup.nearby_popular_places(db.session, 48.8584, 2.2945, 5000)]),
+                "export": [row.place_name for row in database.iter_history(db.session, user_id)],
+            }
+            delete_account(db.session, user_id)
+            queries["deleted"] = (SearchHistory.query.count(), database.PlacePopularity.query.count())
+            return queries
+        finally:
+            db.session.remove()
+            db.drop_all()
+            with db.engine.begin() as connection:
+                connection.execute(text("DROP TABLE IF EXISTS schema_migrations"))
+            db.engine.dispose()
+
 
 class TestDatabase(unittest.TestCase):
     def setUp(self):
@@ -29,6 +90,22 @@ class TestDatabase(unittest.TestCase):
             search_history = SearchHistory.query.filter_by(user_id=user_id).first()
             self.assertEqual(search_history.place_name, "Eiffel Tower")
             self.assertEqual(search_history.address, "Champ de Mars, 5 Avenue Anatole France, 75007 Paris, France")
+            self.assertEqual(database.get_history_version(db.session, user_id).history_version, 1)
+            save_history(db.session, user_id, [])
+            self.assertEqual(database.get_history_version(db.session, user_id).history_version, 1)
+
+    def test_save_history_dedupe_window(self):
+        with app.app_context():
+            user = User(username="testuser", password=hash_password("password123"))
+            db.session.add(user)
+            db.session.commit()
+            user_id = user.user_id
+            results = [{"name": "Eiffel Tower", "location": {"formatted_address": "Champ de Mars, 5 Avenue Anatole France, 75007 Paris, France"}}, {"name": "Eiffel Tower", "location": {"formatted_address": "Champ de Mars, 5 Avenue Anatole France, 75007 Paris, France"}}, {"name": "Louvre Museum", "location": {"formatted_address": "Rue de Rivoli, 75001 Paris, France"}}]
+            save_history(db.session, user_id, results, dedupe_window=3600)
+            save_history(db.session, user_id, results, dedupe_window=3600)
+            self.assertEqual(SearchHistory.query.filter_by(user_id=user_id).count(), 2)
+            save_history(db.session, user_id, results)
+            self.assertEqual(SearchHistory.query.filter_by(user_id=user_id).count(), 5)
 
     def test_get_history(self):
         with app.app_context():
@@ -43,6 +120,26 @@ class TestDatabase(unittest.TestCase):
             self.assertEqual(search_history[0].place_name, "Eiffel Tower")
             self.assertEqual(search_history[0].address, "Champ de Mars, 5 Avenue Anatole France, 75007 Paris, France")
 
+    def test_get_history_pages(self):
+        with app.app_context():
+            user = User(username="testuser", password=hash_password("password123"))
+            db.session.add(user)
+            db.session.commit()
+            user_id = user.user_id
+            save_history(db.session, user_id, [{"name": f"Place {i}", "location": {"formatted_address": f"{i} High Street"}} for i in range(25)])
+            save_history(db.session, user_id, [{"name": "Eiffel Tower", "location": {"formatted_address": "Champ de Mars, 5 Avenue Anatole France, 75007 Paris, France"}}])
+
+            first_page = database.get_history(db.session, user_id, 10)
+            self.assertEqual(len(first_page), 10)
+            self.assertEqual(first_page[0].place_name, "Eiffel Tower")
+            second_page = database.get_history(db.session, user_id, 10, database.encode_cursor(first_page[-1]))
+            self.assertEqual(second_page, database.get_history(db.session, user_id, 10, offset=10))
+            third_page = database.get_history(db.session, user_id, 10, database.encode_cursor(second_page[-1]))
+            self.assertEqual(len(third_page), 6)
+            seen = {row.search_id for row in first_page + second_page + third_page}
+            self.assertEqual(len(seen), 26)
+            self.assertEqual(database.count_history(db.session, user_id), 26)
+
     def test_get_top_searches(self):
         with app.app_context():
             user = User(username="testuser", password=hash_password("password123"))
@@ -56,6 +153,53 @@ class TestDatabase(unittest.TestCase):
             self.assertEqual(most_popular_searches[0].place_name, "Eiffel Tower")
             self.assertEqual(most_popular_searches[0].search_count, 2)
 
+    def test_popularity_counts(self):
+        with app.app_context():
+            user = User(username="testuser", password=hash_password("password123"))
+            db.session.add(user)
+            db.session.commit()
+            user_id = user.user_id
+            results = [{"name": "Eiffel Tower", "location": {"formatted_address": "Champ de Mars, 5 Avenue Anatole France, 75007 Paris, France"}}, {"name": "Louvre Museum", "location": {"formatted_address": "Rue de Rivoli, 75001 Paris, France"}}]
+            save_history(db.session, user_id, results)
+            save_history(db.session, user_id, results[:1])
+            self.assertEqual(database.check_popularity(db.session), [])
+            self.assertEqual([(row.place_name, row.search_count) for row in get_top_searches(db.session, user_id)], [("Eiffel Tower", 2), ("Louvre Museum", 1)])
+
+            database.PlacePopularity.query.delete()
+            db.session.commit()
+            self.assertEqual(len(database.check_popularity(db.session)), 2)
+            result = app.test_cli_runner().invoke(args=["check-popularity"])
+            self.assertEqual(result.exit_code, 1)
+            result = app.test_cli_runner().invoke(args=["rebuild-popularity"])
+            self.assertEqual(result.exit_code, 0)
+            self.assertEqual(database.check_popularity(db.session), [])
+
+            delete_account(db.session, user_id)
+            self.assertEqual(database.PlacePopularity.query.count(), 0)
+
+    def test_get_top_searches_modes(self):
+        with app.app_context():
+            user = User(username="testuser", password=hash_password("password123"))
+            db.session.add(user)
+            db.session.commit()
+            user_id = user.user_id
+            today = database.datetime.utcnow().date()
+            buckets = [("Eiffel Tower", 0, 1), ("Louvre Museum", 3, 2), ("Arc de Triomphe", 20, 10), ("Notre-Dame", 1, 3), ("Sacre-Coeur", 7, 4), ("Pantheon", 29, 5)]
+            for place_name, age, count in buckets:
+                db.session.add(database.PlacePopularityDaily(user_id=user_id, place_name=place_name, address="Paris", day=today - database.timedelta(days=age), search_count=count))
+            db.session.commit()
+
+            # a window of N days reads N daily buckets, so buckets aged N days or more are left out
+            self.assertEqual([row.place_name for row in get_top_searches(db.session, user_id, "today")], ["Eiffel Tower"])
+            self.assertEqual([row.place_name for row in get_top_searches(db.session, user_id, "7d")], ["Notre-Dame", "Louvre Museum", "Eiffel Tower"])
+            self.assertEqual([row.place_name for row in get_top_searches(db.session, user_id, "30d")], ["Arc de Triomphe", "Pantheon", "Sacre-Coeur", "Notre-Dame", "Louvre Museum", "Eiffel Tower"])
+            decayed = get_top_searches(db.session, user_id, "decay")
+            self.assertEqual(decayed[0].place_name, "Notre-Dame")
+            self.assertAlmostEqual({row.place_name: row.search_count for row in decayed}["Eiffel Tower"], 1.0)
+
+            save_history(db.session, user_id, [{"name": "Eiffel Tower", "location": {"formatted_address": "Paris"}}])
+            self.assertEqual(get_top_searches(db.session, user_id, "today")[0].search_count, 2)
+
     def test_search_history(self):
         with app.app_context():
             user = User(username="testuser", password=hash_password("password123"))
@@ -64,6 +208,54 @@ class TestDatabase(unittest.TestCase):
             user_id = user.user_id
             results = [{"name": "Eiffel Tower", "location": {"formatted_address": "Champ de Mars, 5 Avenue Anatole France, 75007 Paris, France"}}, {"name": "Louvre Museum", "location": {"formatted_address": "Rue de Rivoli, 75001 Paris, France"}}]
 
+    def test_search_history_full_text(self):
+        with app.app_context():
+            user = User(username="testuser", password=hash_password("password123"))
+            db.session.add(user)
+            db.session.commit()
+            user_id = user.user_id
+            results = [{"name": "Eiffel Tower", "location": {"formatted_address": "Champ de Mars, 5 Avenue Anatole France, 75007 Paris, France"}}, {"name": "Louvre Museum", "location": {"formatted_address": "Rue de Rivoli, 75001 Paris, France"}}]
+            save_history(db.session, user_id, results)
+            self.assertTrue(database.has_search_index(db.session))
+            self.assertEqual([row.place_name for row in search_history(db.session, user_id, "EIFFEL")], ["Eiffel Tower"])
+            self.assertEqual([row.place_name for row in search_history(db.session, user_id, "rivoli")], ["Louvre Museum"])
+            self.assertEqual(len(search_history(db.session, user_id, "Paris")), 2)
+            self.assertEqual(len(search_history(db.session, user_id, "ou")), 1)
+            self.assertEqual(len(search_history(db.session, user_id + 1, "Paris")), 0)
+            with patch.object(database, "has_search_index", return_value=False):
+                self.assertEqual([row.place_name for row in search_history(db.session, user_id, "rivoli")], ["Louvre Museum"])
+            delete_account(db.session, user_id)
+            self.assertEqual(db.session.execute(database.text("SELECT count(*) FROM search_history_fts WHERE search_history_fts MATCH '\"Paris\"'")).scalar(), 0)
+
+    def test_find_saved_places(self):
+        with app.app_context():
+            user = User(username="testuser", password=hash_password("password123"))
+            db.session.add(user)
+            db.session.commit()
+            user_id = user.user_id
+            results = [{"fsq_id": "4ac518cef964a520f6a520e3", "name": "Eiffel Tower", "location": {"formatted_address": "Champ de Mars, 75007 Paris, France"},
+                        "geocodes": {"main": {"latitude": 48.8584, "longitude": 2.2945}}, "categories": [{"id": 16020, "name": "Historic Site"}]},
+                       {"fsq_id": "4adcda10f964a520af3521e3", "name": "Cafe de l'Homme", "location": {"formatted_address": "17 Place du Trocadero, 75016 Paris, France"},
+                        "geocodes": {"main": {"latitude": 48.8626, "longitude": 2.2884}}, "categories": [{"id": 13065, "name": "Restaurant"}]},
+                       {"fsq_id": "4adcda10f964a520e13521e3", "name": "Louvre Museum", "location": {"formatted_address": "Rue de Rivoli, 75001 Paris, France"},
+                        "geocodes": {"main": {"latitude": 48.8606, "longitude": 2.3376}}, "categories": [{"id": 10027, "name": "Museum"}]}]
+            save_history(db.session, user_id, results)
+            save_history(db.session, user_id, results[:1])
+            saved = SearchHistory.query.filter_by(place_name="Cafe de l'Homme").first()
+            self.assertEqual((saved.fsq_id, saved.category_ids), ("4adcda10f964a520af3521e3", "13065"))
+
+            self.assertTrue(database.has_spatial_index(db.session))
+            nearby = database.find_saved_places(db.session, 48.8584, 2.2945, 1000)
+            self.assertEqual([place["name"] for place in nearby], ["Eiffel Tower", "Cafe de l'Homme"])
+            self.assertEqual(nearby[0]["geocodes"]["main"], {"latitude": 48.8584, "longitude": 2.2945})
+            self.assertEqual([place["name"] for place in database.find_saved_places(db.session, 48.8584, 2.2945, 1000, "13000,14000")], ["Cafe de l'Homme"])
+            self.assertEqual(len(database.find_saved_places(db.session, 48.8584, 2.2945, 5000)), 3)
+            with patch.object(database, "has_spatial_index", return_value=False):
+                self.assertEqual([place["name"] for place in database.find_saved_places(db.session, 48.8584, 2.2945, 1000)], ["Eiffel Tower", "Cafe de l'Homme"])
+            delete_account(db.session, user_id)
+            self.assertEqual(database.find_saved_places(db.session, 48.8584, 2.2945, 5000), [])
+            self.assertEqual(db.session.execute(database.text("SELECT count(*) FROM search_history_rtree")).scalar(), 0)
+
     def test_delete_account(self):
         with app.app_context():
             user = User(username="testuser", password=hash_password("password123"))
@@ -86,5 +278,73 @@ class TestDatabase(unittest.TestCase):
             self.assertIsNone(user)
 
 
+class TestBackends(unittest.TestCase):
+    def test_sqlite_pragmas(self):
+        with tempfile.TemporaryDirectory() as directory:
+            backend_app = create_backend_app("sqlite:///" + os.path.join(directory, "hotelhelper.db"))
+            with backend_app.app_context():
+                self.assertEqual(db.session.execute(text("PRAGMA journal_mode")).scalar(), "wal")
+                self.assertEqual(db.session.execute(text("PRAGMA busy_timeout")).scalar(), 5000)
+                self.assertEqual(db.session.execute(text("PRAGMA synchronous")).scalar(), 1)
+                db.session.remove()
+                db.engine.dispose()
+        self.assertEqual(database.engine_options("sqlite://"), {"pool_pre_ping": True, "pool_recycle": database.settings.DATABASE_POOL_RECYCLE})
+        self.assertEqual(database.engine_options("postgresql://localhost/hotelhelper")["connect_args"], {"options": "-c timezone=utc"})
+
+    def test_sqlite_queries(self):
+        with tempfile.TemporaryDirectory() as directory:
+            queries = run_queries(create_backend_app("sqlite:///" + os.path.join(directory, "hotelhelper.db")))
+        self.assertEqual(queries["history"][0], ("Eiffel Tower", "Champ de Mars, 75007 Paris, France"))
+        self.assertEqual(queries["top"]["all"][0], ("Eiffel Tower", 3))
+        self.assertEqual(queries["keyword"]["PARIS"], ["Eiffel Tower", "Eiffel Tower", "Eiffel Tower", "Louvre Museum", "Louvre Museum"])
+        self.assertEqual(queries["check"], [])
+        self.assertEqual(queries["deleted"], (0, 0))
+
+    def test_read_engine_routing(self):
+        results = [{"name": "Eiffel Tower", "location": {"formatted_address": "Champ de Mars, 75007 Paris, France"}}]
+        with tempfile.TemporaryDirectory() as directory, patch.object(database, "read_sessions", None):
+            backend_app = create_backend_app("sqlite:///" + os.path.join(directory, "hotel helper.db"))
+            with backend_app.app_context():
+                db.create_all()
+                read_engine = database.use_read_engine(db.engine)
+                try:
+                    user = User(username="testuser", password=hash_password("password123"))
+                    db.session.add(user)
+                    db.session.commit()
+                    user_id = user.user_id
+                    save_history(db.session, user_id, results)
+                    version = database.get_history_version(db.session, user_id).history_version
+                    reader = database.history_reader(db.session, user_id, version)
+                    self.assertIs(reader, database.read_sessions)
+                    self.assertEqual([row.place_name for row in get_history(reader, user_id)], ["Eiffel Tower"])
+
+                    # hold a read transaction open on the read session, so its snapshot predates the next search as a lagging replica would, and the user's history is read from the primary
+                    reader.connection().exec_driver_sql("BEGIN")
+                    reader.execute(text("SELECT COUNT(*) FROM search_history"))
+                    save_history(db.session, user_id, [{"name": "Louvre Museum", "location": {"formatted_address": "Rue de Rivoli, 75001 Paris, France"}}])
+                    version = database.get_history_version(db.session, user_id).history_version
+                    self.assertIs(database.history_reader(db.session, user_id, version), db.session)
+                    with patch.object(database.settings, "DATABASE_READ_YOUR_WRITES", False):
+                        self.assertEqual(len(get_history(database.history_reader(db.session, user_id, version), user_id)), 1)
+                    database.read_sessions.remove()
+                    self.assertIs(database.history_reader(db.session, user_id, version), database.read_sessions)
+                    with self.assertRaises(database.OperationalError):
+                        database.read_sessions.execute(text("DELETE FROM search_history"))
+                finally:
+                    database.read_sessions.remove()
+                    read_engine.dispose()
+                    db.session.remove()
+                    db.engine.dispose()
+        self.assertIsNone(database.read_engine_uri(database.make_url("sqlite://")))
+        with patch.object(database.settings, "DATABASE_READ_URI", "postgresql://replica/hotelhelper"):
+            self.assertEqual(database.read_engine_uri(database.make_url("postgresql://primary/hotelhelper")), "postgresql://replica/hotelhelper")
+
+    @unittest.skipUnless(POSTGRES_URI, "set TEST_DATABASE_URL to a PostgreSQL database to compare it with SQLite")
+    def test_postgresql_matches_sqlite(self):
+        with tempfile.TemporaryDirectory() as directory:
+            expected = run_queries(create_backend_app("sqlite:///" + os.path.join(directory, "hotelhelper.db")))
+        self.assertEqual(run_queries(create_backend_app(POSTGRES_URI)), expected)
+
+
 if __name__ == '__main__':
     unittest.main()
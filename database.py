@@ -1,7 +1,22 @@
 # imports for SQLAlchemy database integration and operation
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import func, or_, desc
+from sqlalchemy import func, or_, and_, desc, insert, update, literal, event, text, MetaData, Table, Column, Integer, String
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.engine import Engine, make_url, create_engine
+from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.dialects import sqlite, postgresql
 from flask_sqlalchemy import SQLAlchemy
+from datetime import datetime, timedelta
+from collections import namedtuple
+from urllib.parse import quote
+import geo
+import heapq
+import math
+import os
+import settings
+import sqlite3
+import threading
+import time
 
 # importing bcrypt for password hashing
 import bcrypt
@@ -9,90 +24,591 @@ import bcrypt
 # initialise SQLAlchemy database instance
 db = SQLAlchemy()
 
+# write-behind queue for search history, installed by the app when settings.HISTORY_WRITE_BEHIND is enabled (None writes history during the request)
+history_writer = None
+
 # base class for declarative models
 Base = declarative_base()
 
 
+# function to obtain the SQLAlchemy engine options for a database URI, with the connection pool sized from settings
+# PostgreSQL sessions use UTC, so db.func.now() stores the same times as SQLite's CURRENT_TIMESTAMP; in-memory SQLite databases keep SQLAlchemy's single connection pool
+def engine_options(uri):
+    url = make_url(uri)
+    options = {"pool_pre_ping": True, "pool_recycle": settings.DATABASE_POOL_RECYCLE}
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        return options
+    options.update(pool_size=settings.DATABASE_POOL_SIZE, max_overflow=settings.DATABASE_MAX_OVERFLOW, pool_timeout=settings.DATABASE_POOL_TIMEOUT)
+    if url.get_backend_name() == "postgresql":
+        options["connect_args"] = {"options": "-c timezone=utc"}
+    return options
+
+
+# function to set settings.SQLITE_PRAGMAS on every new SQLite connection made by any engine, leaving connections to other databases unchanged
+@event.listens_for(Engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    for name, value in settings.SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name} = {value}")
+    cursor.close()
+
+
+# sessions on the read-only engine, installed by the app with use_read_engine when settings.DATABASE_READ_ROUTING is enabled (None reads history through the primary session)
+read_sessions = None
+
+
+# function to obtain the URI of the read-only engine for a primary engine URL: settings.DATABASE_READ_URI if set, otherwise the same SQLite file opened with mode=ro,
+# or None for in-memory SQLite and other databases without a configured replica
+def read_engine_uri(url):
+    if settings.DATABASE_READ_URI:
+        return settings.DATABASE_READ_URI
+    if url.get_backend_name() == "sqlite" and url.database not in (None, "", ":memory:"):
+        return f"sqlite:///file:{quote(os.path.abspath(url.database))}?mode=ro&uri=true"
+    return None
+
+
+# function to create the read-only engine for a primary engine and install sessions on it as read_sessions, returning the engine, or None if there is no read-only URI
+# a read-only SQLite connection in WAL mode reads the last committed snapshot without taking locks that would block the primary's writes
+def use_read_engine(engine):
+    global read_sessions
+    uri = read_engine_uri(engine.url)
+    if uri is None:
+        read_sessions = None
+        return None
+    read_engine = create_engine(uri, **engine_options(uri))
+    read_sessions = scoped_session(sessionmaker(bind=read_engine))
+    return read_engine
+
+
+# function to choose the session to read a user's history from, given the primary session and the user's history version read from it
+# reads use the read-only session if one is installed; with settings.DATABASE_READ_YOUR_WRITES, a read engine that does not yet have this version of the user's history
+# (a lagging replica, just after a search) is passed over for the primary, so users always see their own latest searches
+def history_reader(db_session, user_id, history_version):
+    if read_sessions is None:
+        return db_session
+    if settings.DATABASE_READ_YOUR_WRITES:
+        replica_version = read_sessions.query(User.history_version).filter(User.user_id == user_id).scalar()
+        if replica_version is None or replica_version < history_version:
+            return db_session
+    return read_sessions
+
+
 # creating the users table, with an integer ID as the primary key and non-null username and password columns
+# usernames are unique, through an index that login and registration look users up by, so two registrations for the same name cannot both succeed
+# history_version is increased every time the user's search history changes, at history_modified, so history pages can be revalidated without reading the history
 class User(db.Model):
     __tablename__ = "users"
     user_id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String, nullable=False)
+    username = db.Column(db.String, nullable=False, unique=True, index=True)
     password = db.Column(db.String, nullable=False)
+    history_version = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    history_modified = db.Column(db.DateTime)
 
 
-# creating the search_history table, with an search ID as the primary key and all other columns not null
+# creating the search_history table, with an search ID as the primary key and all other columns not null except the place coordinates and FourSquare IDs
 # user_id is a foreign key from the users table, and the timestamp column contains the date and time at the time of SQL query execution
+# latitude and longitude are the place's coordinates from FourSquare at the time it was saved, and are empty for entries saved before they were recorded
+# fsq_id is the FourSquare place ID and category_ids a comma-separated list of its FourSquare category IDs, also empty for older entries
+# indexes cover the per-user lookups: (user_id, timestamp) for listing history, and (user_id, place_name, address) for grouping and keyword searches
 class SearchHistory(db.Model):
     __tablename__ = "search_history"
+    __table_args__ = (db.Index("ix_search_history_user_timestamp", "user_id", "timestamp"),
+                      db.Index("ix_search_history_user_place", "user_id", "place_name", "address"))
     search_id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.user_id', ondelete="CASCADE"), nullable=False)
     place_name = db.Column(db.String, nullable=False)
     address = db.Column(db.String, nullable=False)
     timestamp = db.Column(db.DateTime, default=db.func.now())
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    fsq_id = db.Column(db.String)
+    category_ids = db.Column(db.String)
+
+
+# creating the place_rollup table, counts of how many times each place has been saved across all users, grouped into grid cells of settings.ROLLUP_CELL_SIZE degrees
+# it is refreshed incrementally from search_history by rollup.refresh_rollup, and read by the nearby popular places API
+class PlaceRollup(db.Model):
+    __tablename__ = "place_rollup"
+    __table_args__ = (db.Index("ix_place_rollup_cell", "cell_row", "cell_column"),)
+    cell_row = db.Column(db.Integer, primary_key=True)
+    cell_column = db.Column(db.Integer, primary_key=True)
+    place_name = db.Column(db.String, primary_key=True)
+    address = db.Column(db.String, primary_key=True)
+    latitude = db.Column(db.Float, nullable=False)
+    longitude = db.Column(db.Float, nullable=False)
+    search_count = db.Column(db.Integer, nullable=False, default=0)
+
+
+# creating the rollup_state table, recording for each rollup the last search_id it has processed and when it was refreshed
+class RollupState(db.Model):
+    __tablename__ = "rollup_state"
+    name = db.Column(db.String, primary_key=True)
+    last_search_id = db.Column(db.Integer, nullable=False, default=0)
+    refreshed_at = db.Column(db.DateTime)
+
+
+# creating the place_popularity table, a running count of how many times each place has been saved to a user's history, with the time it was last saved
+# it is updated on every history write so the most popular places are read through the (user_id, search_count, last_seen) index rather than grouped from search_history
+class PlacePopularity(db.Model):
+    __tablename__ = "place_popularity"
+    __table_args__ = (db.Index("ix_place_popularity_user_count", "user_id", "search_count", "last_seen"),)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.user_id', ondelete="CASCADE"), primary_key=True)
+    place_name = db.Column(db.String, primary_key=True)
+    address = db.Column(db.String, primary_key=True)
+    search_count = db.Column(db.Integer, nullable=False, default=0)
+    last_seen = db.Column(db.DateTime, default=db.func.now())
+
+
+# creating the place_popularity_daily table, counts of each place saved to a user's history per UTC day, kept for settings.POPULARITY_DAILY_RETENTION days
+# windowed and time-decayed rankings read these buckets (at most one row per place per day) rather than the raw search history
+class PlacePopularityDaily(db.Model):
+    __tablename__ = "place_popularity_daily"
+    __table_args__ = (db.Index("ix_place_popularity_daily_user_day", "user_id", "day"),)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.user_id', ondelete="CASCADE"), primary_key=True)
+    place_name = db.Column(db.String, primary_key=True)
+    address = db.Column(db.String, primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    search_count = db.Column(db.Integer, nullable=False, default=0)
+
+
+# creating the places table, a local store of every place FourSquare has returned (or that was imported), one row per FourSquare ID
+# places are grouped into grid cells of settings.PLACES_CELL_SIZE degrees, so searches read the (cell_row, cell_column) index rather than every place
+# category_ids is a comma-separated list of the place's FourSquare category IDs, and updated_at the time the place was last returned or imported
+class Place(db.Model):
+    __tablename__ = "places"
+    __table_args__ = (db.Index("ix_places_cell", "cell_row", "cell_column"),)
+    fsq_id = db.Column(db.String, primary_key=True)
+    name = db.Column(db.String, nullable=False)
+    address = db.Column(db.String, nullable=False)
+    latitude = db.Column(db.Float, nullable=False)
+    longitude = db.Column(db.Float, nullable=False)
+    category_ids = db.Column(db.String)
+    cell_row = db.Column(db.Integer, nullable=False)
+    cell_column = db.Column(db.Integer, nullable=False)
+    updated_at = db.Column(db.DateTime, default=db.func.now())
+
+
+# creating the place_coverage table, circles around past FourSquare searches (or declared for imports) within which the places table holds every place FourSquare would return
+# categories is the comma-separated category IDs searched for, empty for every category
+class PlaceCoverage(db.Model):
+    __tablename__ = "place_coverage"
+    __table_args__ = (db.Index("ix_place_coverage_latitude", "latitude"),)
+    coverage_id = db.Column(db.Integer, primary_key=True)
+    latitude = db.Column(db.Float, nullable=False)
+    longitude = db.Column(db.Float, nullable=False)
+    radius = db.Column(db.Float, nullable=False)
+    categories = db.Column(db.String, nullable=False, default="")
+    covered_at = db.Column(db.DateTime, default=db.func.now())
+
+
+# ranking modes accepted by get_top_searches, with the number of UTC days of buckets each window reads: today's bucket and the days before it,
+# so "7d" reads 7 buckets, and "today" reads only today's (daily buckets cannot cover a rolling 24 hours)
+POPULARITY_WINDOWS = {"today": 1, "7d": 7, "30d": 30}
+POPULARITY_MODES = ["all"] + list(POPULARITY_WINDOWS) + ["decay"]
+
+# row returned for time-decayed rankings, matching the columns of the other ranking queries
+TopSearch = namedtuple("TopSearch", ["place_name", "address", "search_count"])
+
+
+# full-text index over search_history place names and addresses, an SQLite FTS5 table using the trigram tokenizer so any 3+ character substring matches
+# it is kept in sync with search_history by triggers, and declared on its own metadata so db.create_all() does not try to create it as a normal table
+search_index = Table("search_history_fts", MetaData(), Column("rowid", Integer), Column("place_name", String), Column("address", String), Column("rank"))
+
+
+# function to create the full-text index and its triggers on a database connection, returning False if the database is not SQLite or SQLite lacks FTS5
+def create_search_index(connection):
+    if connection.dialect.name != "sqlite":
+        return False
+    try:
+        connection.exec_driver_sql("CREATE VIRTUAL TABLE IF NOT EXISTS search_history_fts USING fts5(place_name, address, content='search_history', content_rowid='search_id', tokenize='trigram')")
+    except OperationalError:
+        return False
+    connection.exec_driver_sql("CREATE TRIGGER IF NOT EXISTS search_history_fts_insert AFTER INSERT ON search_history BEGIN "
+                               "INSERT INTO search_history_fts (rowid, place_name, address) VALUES (new.search_id, new.place_name, new.address); END")
+    connection.exec_driver_sql("CREATE TRIGGER IF NOT EXISTS search_history_fts_delete AFTER DELETE ON search_history BEGIN "
+                               "INSERT INTO search_history_fts (search_history_fts, rowid, place_name, address) VALUES ('delete', old.search_id, old.place_name, old.address); END")
+    connection.exec_driver_sql("CREATE TRIGGER IF NOT EXISTS search_history_fts_update AFTER UPDATE ON search_history BEGIN "
+                               "INSERT INTO search_history_fts (search_history_fts, rowid, place_name, address) VALUES ('delete', old.search_id, old.place_name, old.address); "
+                               "INSERT INTO search_history_fts (rowid, place_name, address) VALUES (new.search_id, new.place_name, new.address); END")
+    # index any rows already in search_history
+    connection.exec_driver_sql("INSERT INTO search_history_fts (search_history_fts) VALUES ('rebuild')")
+    return True
+
+
+# create the full-text index alongside search_history in db.create_all(), and remove it in db.drop_all()
+@event.listens_for(SearchHistory.__table__, "after_create")
+def create_search_index_after_create(target, connection, **kw):
+    create_search_index(connection)
+
+
+@event.listens_for(SearchHistory.__table__, "before_drop")
+def drop_search_index_before_drop(target, connection, **kw):
+    if connection.dialect.name == "sqlite":
+        connection.exec_driver_sql("DROP TABLE IF EXISTS search_history_fts")
+
+
+# function to check whether the full-text index exists in the database used by a session
+def has_search_index(db_session):
+    if db_session.get_bind().dialect.name != "sqlite":
+        return False
+    return db_session.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'search_history_fts'")).first() is not None
+
+
+# spatial index over search_history coordinates, an SQLite R*Tree table holding a zero-size bounding box for each entry with coordinates, keyed by search_id
+# like the full-text index it is kept in sync by triggers and declared on its own metadata so db.create_all() does not create it as a normal table
+spatial_index = Table("search_history_rtree", MetaData(), Column("search_id", Integer), Column("min_latitude"), Column("max_latitude"), Column("min_longitude"), Column("max_longitude"))
+
+
+# function to create the spatial index and its triggers on a database connection, returning False if the database is not SQLite or SQLite lacks the R*Tree module
+def create_spatial_index(connection):
+    if connection.dialect.name != "sqlite":
+        return False
+    try:
+        connection.exec_driver_sql("CREATE VIRTUAL TABLE IF NOT EXISTS search_history_rtree USING rtree(search_id, min_latitude, max_latitude, min_longitude, max_longitude)")
+    except OperationalError:
+        return False
+    connection.exec_driver_sql("CREATE TRIGGER IF NOT EXISTS search_history_rtree_insert AFTER INSERT ON search_history WHEN new.latitude IS NOT NULL AND new.longitude IS NOT NULL BEGIN "
+                               "INSERT INTO search_history_rtree VALUES (new.search_id, new.latitude, new.latitude, new.longitude, new.longitude); END")
+    connection.exec_driver_sql("CREATE TRIGGER IF NOT EXISTS search_history_rtree_delete AFTER DELETE ON search_history BEGIN "
+                               "DELETE FROM search_history_rtree WHERE search_id = old.search_id; END")
+    connection.exec_driver_sql("CREATE TRIGGER IF NOT EXISTS search_history_rtree_update AFTER UPDATE OF latitude, longitude ON search_history BEGIN "
+                               "DELETE FROM search_history_rtree WHERE search_id = old.search_id; "
+                               "INSERT INTO search_history_rtree SELECT new.search_id, new.latitude, new.latitude, new.longitude, new.longitude WHERE new.latitude IS NOT NULL AND new.longitude IS NOT NULL; END")
+    # index any rows already in search_history
+    connection.exec_driver_sql("INSERT OR REPLACE INTO search_history_rtree SELECT search_id, latitude, latitude, longitude, longitude FROM search_history WHERE latitude IS NOT NULL AND longitude IS NOT NULL")
+    return True
+
+
+# create the spatial index alongside search_history in db.create_all(), and remove it in db.drop_all()
+@event.listens_for(SearchHistory.__table__, "after_create")
+def create_spatial_index_after_create(target, connection, **kw):
+    create_spatial_index(connection)
+
+
+@event.listens_for(SearchHistory.__table__, "before_drop")
+def drop_spatial_index_before_drop(target, connection, **kw):
+    if connection.dialect.name == "sqlite":
+        connection.exec_driver_sql("DROP TABLE IF EXISTS search_history_rtree")
+
+
+# function to check whether the spatial index exists in the database used by a session
+def has_spatial_index(db_session):
+    if db_session.get_bind().dialect.name != "sqlite":
+        return False
+    return db_session.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'search_history_rtree'")).first() is not None
 
 
 # function to hash a password with bycrypt import, utilising a salt and returning the password as a UTF-8 encoded string
-def hash_password(password):
-    salt = bcrypt.gensalt()  # Generate a salt for password hashing
+# rounds is the bcrypt cost (log2 of the number of iterations), settings.BCRYPT_ROUNDS by default
+def hash_password(password, rounds=None):
+    salt = bcrypt.gensalt(rounds or settings.BCRYPT_ROUNDS)  # Generate a salt for password hashing
     hashed_password = bcrypt.hashpw(password.encode("utf-8"), salt)
     return hashed_password.decode("utf-8")
 
 
 # function to save generated locations to the database for a user
-def save_history(db_session, user_id, results):
+# if a write-behind queue is installed the results are queued and written on its background thread, otherwise they are written straight away
+def save_history(db_session, user_id, results, dedupe_window=settings.HISTORY_DEDUPE_WINDOW):
+    if history_writer is not None and history_writer.enqueue(user_id, results, dedupe_window):
+        return
+    write_history(db_session, user_id, results, dedupe_window)
+
+
+# function to write generated locations to the database for a user
+# rows are written with a single bulk INSERT; if dedupe_window is given (in seconds), places the user already saved within that window, or that repeat within the results, are skipped
+# commit can be set to False so the write-behind queue can commit several writes together
+def write_history(db_session, user_id, results, dedupe_window=settings.HISTORY_DEDUPE_WINDOW, commit=True):
     # obtain the user_id from the users table
     user = db_session.get(User, user_id)
     if user:
-        for result in results:
-            # obtain the place name and address for each result
-            place_name = result["name"]
-            address = result["location"]["formatted_address"]
-
-            # add a SearchHistory object with the user ID and place details, commiting to the database
-            search_history = SearchHistory(user_id=user_id, place_name=place_name, address=address)
-            db_session.add(search_history)
-        db_session.commit()
+        # obtain the place name, address, and coordinates, FourSquare ID and category IDs (if FourSquare returned them) for each result
+        rows = [{"user_id": user_id, "place_name": result["name"], "address": result["location"]["formatted_address"],
+                 "latitude": result.get("geocodes", {}).get("main", {}).get("latitude"), "longitude": result.get("geocodes", {}).get("main", {}).get("longitude"),
+                 "fsq_id": result.get("fsq_id"), "category_ids": ",".join(str(category["id"]) for category in result.get("categories", []) if "id" in category) or None} for result in results]
+
+        if dedupe_window:
+            # obtain the places already saved for the user within the window, then keep the first occurrence of each remaining place
+            cutoff = datetime.utcnow() - timedelta(seconds=dedupe_window)
+            seen = set(db_session.query(SearchHistory.place_name, SearchHistory.address).
+                       filter(SearchHistory.user_id == user_id, SearchHistory.timestamp >= cutoff).all())
+            unique_rows = []
+            for row in rows:
+                if (row["place_name"], row["address"]) not in seen:
+                    seen.add((row["place_name"], row["address"]))
+                    unique_rows.append(row)
+            rows = unique_rows
+
+        # insert all rows in one executemany statement, add them to the popularity counts and move the user's history version on, commiting to the database
+        if rows:
+            db_session.execute(insert(SearchHistory), rows)
+            update_popularity(db_session, user_id, rows)
+            db_session.execute(update(User).where(User.user_id == user_id).values(history_version=User.history_version + 1, history_modified=datetime.utcnow()))
+        if commit:
+            db_session.commit()
+        forget_history_count(user_id)
+
+
+# function to create an INSERT statement for a table that supports ON CONFLICT upserts on SQLite and PostgreSQL
+def upsert(db_session, table):
+    if db_session.get_bind().dialect.name == "postgresql":
+        return postgresql.insert(table)
+    return sqlite.insert(table)
+
+
+# function to add newly saved history rows to a user's popularity counts, with one upsert per distinct place
+def update_popularity(db_session, user_id, rows):
+    counts = {}
+    for row in rows:
+        key = (row["place_name"], row["address"])
+        counts[key] = counts.get(key, 0) + 1
+    statement = upsert(db_session, PlacePopularity.__table__)
+    statement = statement.on_conflict_do_update(index_elements=["user_id", "place_name", "address"],
+                                                set_={"search_count": PlacePopularity.search_count + statement.excluded.search_count, "last_seen": statement.excluded.last_seen})
+    db_session.execute(statement, [{"user_id": user_id, "place_name": place_name, "address": address, "search_count": count, "last_seen": datetime.utcnow()}
+                                   for (place_name, address), count in counts.items()])
+
+    # add the same counts to today's buckets, and remove the user's buckets that have passed the retention period
+    today = datetime.utcnow().date()
+    statement = upsert(db_session, PlacePopularityDaily.__table__)
+    statement = statement.on_conflict_do_update(index_elements=["user_id", "place_name", "address", "day"],
+                                                set_={"search_count": PlacePopularityDaily.search_count + statement.excluded.search_count})
+    db_session.execute(statement, [{"user_id": user_id, "place_name": place_name, "address": address, "day": today, "search_count": count}
+                                   for (place_name, address), count in counts.items()])
+    db_session.execute(PlacePopularityDaily.__table__.delete().where(PlacePopularityDaily.user_id == user_id, PlacePopularityDaily.day < retention_cutoff()))
+
+
+# function to obtain the earliest day kept in the daily popularity buckets
+def retention_cutoff():
+    return datetime.utcnow().date() - timedelta(days=settings.POPULARITY_DAILY_RETENTION)
 
 
-# function to retrieve all locations for a specific user
-def get_history(db_session, user_id):
+# function to obtain a SQL expression for the UTC day of a timestamp column, on a session or connection
+def day_of(executor, column):
+    bind = executor.get_bind() if hasattr(executor, "get_bind") else executor
+    if bind.dialect.name == "sqlite":
+        return func.date(column)
+    return db.cast(column, db.Date)
+
+
+# function to rebuild popularity counts and daily buckets from search_history, for every user or for one user_id, used to backfill existing databases or repair drift
+# takes a session or connection, and leaves committing to the caller
+def rebuild_popularity(executor, user_id=None):
+    delete_statement = PlacePopularity.__table__.delete()
+    grouped = db.select(SearchHistory.user_id, SearchHistory.place_name, SearchHistory.address, func.count(SearchHistory.search_id), func.max(SearchHistory.timestamp)).\
+        group_by(SearchHistory.user_id, SearchHistory.place_name, SearchHistory.address)
+    if user_id is not None:
+        delete_statement = delete_statement.where(PlacePopularity.user_id == user_id)
+        grouped = grouped.where(SearchHistory.user_id == user_id)
+    executor.execute(delete_statement)
+    executor.execute(PlacePopularity.__table__.insert().from_select(["user_id", "place_name", "address", "search_count", "last_seen"], grouped))
+
+    # rebuild the daily buckets for the retention period in the same way
+    day = day_of(executor, SearchHistory.timestamp)
+    delete_statement = PlacePopularityDaily.__table__.delete()
+    grouped = db.select(SearchHistory.user_id, SearchHistory.place_name, SearchHistory.address, day, func.count(SearchHistory.search_id)).\
+        where(day >= retention_cutoff()).\
+        group_by(SearchHistory.user_id, SearchHistory.place_name, SearchHistory.address, day)
+    if user_id is not None:
+        delete_statement = delete_statement.where(PlacePopularityDaily.user_id == user_id)
+        grouped = grouped.where(SearchHistory.user_id == user_id)
+    executor.execute(delete_statement)
+    executor.execute(PlacePopularityDaily.__table__.insert().from_select(["user_id", "place_name", "address", "day", "search_count"], grouped))
+
+
+# function to compare popularity counts with a GROUP BY over search_history, returning a list of (user_id, place_name, address, expected count, stored count) for every mismatch
+def check_popularity(db_session):
+    expected = {(row[0], row[1], row[2]): row[3] for row in db_session.query(SearchHistory.user_id, SearchHistory.place_name, SearchHistory.address, func.count(SearchHistory.search_id)).
+                group_by(SearchHistory.user_id, SearchHistory.place_name, SearchHistory.address)}
+    stored = {(row[0], row[1], row[2]): row[3] for row in db_session.query(PlacePopularity.user_id, PlacePopularity.place_name, PlacePopularity.address, PlacePopularity.search_count)}
+    return [key + (expected.get(key, 0), stored.get(key, 0)) for key in sorted(expected.keys() | stored.keys()) if expected.get(key, 0) != stored.get(key, 0)]
+
+
+# function to retrieve locations for a specific user, newest first
+# without a page_size every entry is returned; with a page_size one page is returned, starting after the cursor (the encoded timestamp and search ID of the
+# last row on the previous page, see encode_cursor) or, without a cursor, after skipping offset rows
+def get_history(db_session, user_id, page_size=None, cursor=None, offset=0):
     # execute query to the search_history table for place name, address, and timestamp of all entries for a specific  user_id
-    return db_session.query(SearchHistory.place_name, SearchHistory.address, SearchHistory.timestamp).\
-        filter(SearchHistory.user_id == user_id).all()
+    query = db_session.query(SearchHistory.place_name, SearchHistory.address, SearchHistory.timestamp, SearchHistory.search_id).\
+        filter(SearchHistory.user_id == user_id).\
+        order_by(desc(SearchHistory.timestamp), desc(SearchHistory.search_id))
+    if page_size is None:
+        return query.all()
+
+    # keyset condition: rows older than the cursor, or with the same timestamp and a lower search ID, read through the (user_id, timestamp) index
+    if cursor:
+        timestamp, search_id = decode_cursor(cursor)
+        bound = timestamp_bound(db_session, timestamp)
+        query = query.filter(or_(SearchHistory.timestamp < bound, and_(SearchHistory.timestamp == bound, SearchHistory.search_id < search_id)))
+    elif offset:
+        query = query.offset(offset)
+    return query.limit(page_size).all()
+
+
+# function to iterate over every history entry for a user, oldest first, optionally only those saved from start and before end (datetimes)
+# rows are fetched batch_size at a time with yield_per, so memory use does not grow with the number of entries; used to export history
+def iter_history(db_session, user_id, start=None, end=None, batch_size=1000):
+    query = db_session.query(SearchHistory.timestamp, SearchHistory.place_name, SearchHistory.address, SearchHistory.latitude, SearchHistory.longitude,
+                             SearchHistory.fsq_id, SearchHistory.category_ids).\
+        filter(SearchHistory.user_id == user_id)
+    if start is not None:
+        query = query.filter(SearchHistory.timestamp >= timestamp_bound(db_session, start))
+    if end is not None:
+        query = query.filter(SearchHistory.timestamp < timestamp_bound(db_session, end))
+    return query.order_by(SearchHistory.timestamp, SearchHistory.search_id).execution_options(stream_results=True).yield_per(batch_size)
+
+
+# function to encode the position of a history row as a cursor string for the next page
+def encode_cursor(row):
+    return f"{row.timestamp.strftime('%Y-%m-%dT%H:%M:%S.%f')}_{row.search_id}"
+
+
+# function to decode a cursor string into its timestamp and search ID, raising ValueError for a malformed cursor
+def decode_cursor(cursor):
+    timestamp, search_id = cursor.rsplit("_", 1)
+    return datetime.strptime(timestamp, "%Y-%m-%dT%H:%M:%S.%f"), int(search_id)
+
+
+# function to bind a timestamp for comparison with stored timestamps
+# SQLite stores db.func.now() as text without fractional seconds, so the bound value is passed through datetime() to use the same format
+def timestamp_bound(db_session, timestamp):
+    if db_session.get_bind().dialect.name == "sqlite":
+        return func.datetime(literal(timestamp.strftime("%Y-%m-%d %H:%M:%S.%f")))
+    return timestamp
+
+
+# function to obtain the version and last modified time of a user's search history with a single primary key lookup, or None if the user does not exist
+# a deleted account has no version, so pages cached for it can no longer be served
+def get_history_version(db_session, user_id):
+    return db_session.query(User.history_version, User.history_modified).filter(User.user_id == user_id).first()
+
+
+# cache of history row counts per user, as (count, time stored), so page numbers do not need a count query on every page view
+history_counts = {}
+history_counts_lock = threading.Lock()
+
+
+# function to count the history entries for a user, cached for settings.HISTORY_COUNT_TTL seconds and cleared when this process writes or deletes the user's history
+def count_history(db_session, user_id):
+    with history_counts_lock:
+        cached = history_counts.get(user_id)
+    if cached and time.monotonic() - cached[1] < settings.HISTORY_COUNT_TTL:
+        return cached[0]
+    count = db_session.query(func.count(SearchHistory.search_id)).filter(SearchHistory.user_id == user_id).scalar()
+    with history_counts_lock:
+        history_counts[user_id] = (count, time.monotonic())
+    return count
+
+
+# function to clear the cached history count for a user
+def forget_history_count(user_id):
+    with history_counts_lock:
+        history_counts.pop(user_id, None)
 
 
 # function to get the top 10 top search queries for a specific user, obtaining the place name and address
-def get_top_searches(db_session, user_id):
-    # obtain the top 10 results through ordering the search count in descending order for all unique entries for a specific user
-    return db_session.query(SearchHistory.place_name, SearchHistory.address, func.count(SearchHistory.place_name).label("search_count")).\
-        filter(SearchHistory.user_id == user_id).\
-        group_by(SearchHistory.place_name, SearchHistory.address).\
-        order_by(desc("search_count")).\
+# mode is "all" for all-time counts, "today", "7d" or "30d" for counts within a window, or "decay" for counts weighted by age with a half-life of settings.POPULARITY_HALF_LIFE days
+def get_top_searches(db_session, user_id, mode="all"):
+    if mode in POPULARITY_WINDOWS:
+        # sum the daily buckets within the window, read through the (user_id, day) index
+        cutoff = datetime.utcnow().date() - timedelta(days=POPULARITY_WINDOWS[mode] - 1)
+        return db_session.query(PlacePopularityDaily.place_name, PlacePopularityDaily.address, func.sum(PlacePopularityDaily.search_count).label("search_count")).\
+            filter(PlacePopularityDaily.user_id == user_id, PlacePopularityDaily.day >= cutoff).\
+            group_by(PlacePopularityDaily.place_name, PlacePopularityDaily.address).\
+            order_by(desc("search_count")).\
+            limit(10).all()
+
+    if mode == "decay":
+        # weight each daily bucket by 0.5 ** (age in days / half-life), keeping the 10 highest scoring places
+        today = datetime.utcnow().date()
+        scores = {}
+        for place_name, address, day, count in db_session.query(PlacePopularityDaily.place_name, PlacePopularityDaily.address, PlacePopularityDaily.day, PlacePopularityDaily.search_count).\
+                filter(PlacePopularityDaily.user_id == user_id, PlacePopularityDaily.day >= retention_cutoff()):
+            scores[(place_name, address)] = scores.get((place_name, address), 0) + count * math.pow(0.5, (today - day).days / settings.POPULARITY_HALF_LIFE)
+        return [TopSearch(place_name, address, score) for (place_name, address), score in heapq.nlargest(10, scores.items(), key=lambda item: item[1])]
+
+    # obtain the top 10 results from the popularity counts, ordering the search count in descending order, most recently seen first for equal counts
+    return db_session.query(PlacePopularity.place_name, PlacePopularity.address, PlacePopularity.search_count).\
+        filter(PlacePopularity.user_id == user_id).\
+        order_by(desc(PlacePopularity.search_count), desc(PlacePopularity.last_seen)).\
         limit(10).all()
 
 
 # function to search for results across the user history based on a keyword
+# uses the full-text index when it exists and the keyword is long enough to form a trigram, ordering matches by relevance and then by most recent
 def search_history(db_session, user_id, keyword):
-    # obtain place name, addresse and timestamp of entries for the specified user_id where the place name or the address contains the specified keyword, case-insensitive
+    if len(keyword) >= 3 and has_search_index(db_session):
+        # quote the keyword as an FTS5 phrase so punctuation in it is matched literally
+        phrase = '"' + keyword.replace('"', '""') + '"'
+        return db_session.query(SearchHistory.place_name, SearchHistory.address, SearchHistory.timestamp).\
+            join(search_index, search_index.c.rowid == SearchHistory.search_id).\
+            filter(text("search_history_fts MATCH :phrase")).\
+            filter(SearchHistory.user_id == user_id).\
+            order_by(search_index.c.rank, desc(SearchHistory.timestamp)).\
+            params(phrase=phrase).all()
+
+    # otherwise obtain place name, addresse and timestamp of entries for the specified user_id where the place name or the address contains the specified keyword, case-insensitive
     return db_session.query(SearchHistory.place_name, SearchHistory.address, SearchHistory.timestamp).\
         filter(SearchHistory.user_id == user_id).\
         filter(or_(SearchHistory.place_name.ilike(f"%{keyword}%"), SearchHistory.address.ilike(f"%{keyword}%"))).\
         all()
 
 
+# function to find places already saved to any user's history within radius metres of a point, optionally only those in one of a comma-separated list of category IDs
+# candidates are read through the spatial index when it exists (otherwise by comparing coordinates), then each place is kept once, as most recently saved, nearest first
+# returns a list of dictionaries in the shape of FourSquare results, so they can be shown in place of a FourSquare response
+def find_saved_places(db_session, latitude, longitude, radius, categories="", limit=50):
+    min_latitude, max_latitude, min_longitude, max_longitude = geo.bounding_box(latitude, longitude, radius)
+    query = db_session.query(SearchHistory.fsq_id, SearchHistory.place_name, SearchHistory.address, SearchHistory.latitude, SearchHistory.longitude, SearchHistory.category_ids)
+    if has_spatial_index(db_session):
+        query = query.join(spatial_index, spatial_index.c.search_id == SearchHistory.search_id).\
+            filter(spatial_index.c.max_latitude >= min_latitude, spatial_index.c.min_latitude <= max_latitude,
+                   spatial_index.c.max_longitude >= min_longitude, spatial_index.c.min_longitude <= max_longitude)
+    else:
+        query = query.filter(SearchHistory.latitude.between(min_latitude, max_latitude), SearchHistory.longitude.between(min_longitude, max_longitude))
+
+    wanted = {category.strip() for category in categories.split(",") if category.strip()} if categories else set()
+    places = {}
+    for fsq_id, place_name, address, place_latitude, place_longitude, category_ids in query.order_by(desc(SearchHistory.search_id)):
+        # identify places by FourSquare ID, or by name and address for entries saved without one
+        key = fsq_id or (place_name, address)
+        if key in places:
+            continue
+        place_categories = category_ids.split(",") if category_ids else []
+        if wanted and not in_categories(place_categories, wanted):
+            continue
+        distance = geo.haversine(latitude, longitude, place_latitude, place_longitude)
+        if distance <= radius:
+            places[key] = {"fsq_id": fsq_id, "name": place_name, "location": {"formatted_address": address}, "geocodes": {"main": {"latitude": place_latitude, "longitude": place_longitude}},
+                           "categories": [{"id": category} for category in place_categories], "distance": round(distance)}
+    return sorted(places.values(), key=lambda place: place["distance"])[:limit]
+
+
+# function to check whether any of a place's FourSquare category IDs is one of the wanted IDs or, for a top-level wanted ID such as 13000, one of its sub-categories
+# FourSquare category IDs share the first two digits of their top-level category, so 13065 is a sub-category of 13000
+def in_categories(place_categories, wanted):
+    for category in place_categories:
+        if category in wanted or (len(category) == 5 and category[:2] + "000" in wanted):
+            return True
+    return False
+
+
 # function to delete a user account and its associated search history
 def delete_account(db_session, user_id):
     # obtain the user through user_id
     user = db_session.get(User, user_id)
 
     if user:
-        # delete the user's search history in search_history table
+        # delete the user's search history in search_history table, and their popularity counts
         SearchHistory.query.filter_by(user_id=user_id).delete()
+        PlacePopularity.query.filter_by(user_id=user_id).delete()
+        PlacePopularityDaily.query.filter_by(user_id=user_id).delete()
 
         # delete the user from users table and commit to the database
         db_session.delete(user)
         db_session.commit()
+        forget_history_count(user_id)
 
         return True
     else:
@@ -103,3 +619,12 @@ def delete_account(db_session, user_id):
 # function to verify password input on a login page against the password stored in the database
 def verify_password(input_password, hashed_password):
     return bcrypt.checkpw(input_password.encode("utf-8"), hashed_password.encode("utf-8"))
+
+
+# function to check whether a stored password hash was made with a different bcrypt cost than settings.BCRYPT_ROUNDS, so it can be rehashed at the next login
+# bcrypt hashes are stored as $2b$<cost>$<salt and hash>
+def password_needs_rehash(hashed_password, rounds=None):
+    try:
+        return int(hashed_password.split("$")[2]) != (rounds or settings.BCRYPT_ROUNDS)
+    except (IndexError, ValueError):
+        return True
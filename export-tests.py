@@ -0,0 +1,101 @@
+from database import db, User, SearchHistory, hash_password, save_history, iter_history
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+from app import app
+import export
+import tempfile
+import unittest
+import json
+import csv
+import io
+import os
+
+# number of synthetic history entries exported by the memory test, and the most the process's resident memory may grow by while exporting them
+EXPORT_ROWS = 1000000
+RSS_CEILING = 50 * 1024 * 1024
+
+
+# function to obtain the resident memory of this process in bytes from /proc
+def resident_memory():
+    with open("/proc/self/statm") as file:
+        return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+class TestExport(unittest.TestCase):
+    def setUp(self):
+        with app.app_context():
+            db.create_all()
+            user = User(username="testuser", password=hash_password("password123"))
+            db.session.add(user)
+            db.session.commit()
+            self.user_id = user.user_id
+            save_history(db.session, self.user_id, [{"name": "Eiffel Tower", "location": {"formatted_address": "Champ de Mars, 75007 Paris, France"},
+                                                     "geocodes": {"main": {"latitude": 48.8584, "longitude": 2.2945}}},
+                                                    {"name": "Louvre Museum", "location": {"formatted_address": "Rue de Rivoli, 75001 Paris, France"}}])
+            db.session.execute(text("UPDATE search_history SET timestamp = '2024-03-01 09:30:00' WHERE place_name = 'Eiffel Tower'"))
+            db.session.execute(text("UPDATE search_history SET timestamp = '2024-03-02 00:00:00' WHERE place_name = 'Louvre Museum'"))
+            db.session.commit()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def test_export_csv(self):
+        self.assertEqual(self.client.get("/export/history").status_code, 302)
+        with self.client.session_transaction() as session:
+            session["user_id"] = self.user_id
+        response = self.client.get("/export/history?format=csv")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("attachment", response.headers["Content-Disposition"])
+        rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+        self.assertEqual([row["place_name"] for row in rows], ["Eiffel Tower", "Louvre Museum"])
+        self.assertEqual(rows[0]["timestamp"], "2024-03-01 09:30:00")
+        self.assertEqual(rows[0]["latitude"], "48.8584")
+
+    def test_export_ndjson_date_range(self):
+        with self.client.session_transaction() as session:
+            session["user_id"] = self.user_id
+        response = self.client.get("/export/history?format=ndjson&from=2024-03-02&to=2024-03-02")
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        self.assertEqual([json.loads(line)["place_name"] for line in response.get_data(as_text=True).splitlines()], ["Louvre Museum"])
+        response = self.client.get("/export/history?format=ndjson&to=2024-03-01")
+        self.assertEqual([json.loads(line)["place_name"] for line in response.get_data(as_text=True).splitlines()], ["Eiffel Tower"])
+
+        self.assertEqual(self.client.get("/export/history?format=xml").status_code, 400)
+        self.assertEqual(self.client.get("/export/history?from=March").status_code, 400)
+        self.assertEqual(self.client.get("/export/history?from=2024-03-02&to=2024-03-01").status_code, 400)
+
+
+class TestExportMemory(unittest.TestCase):
+    @unittest.skipUnless(os.path.exists("/proc/self/statm"), "resident memory is read from /proc")
+    def test_export_memory_is_flat(self):
+        with tempfile.TemporaryDirectory() as directory:
+            # a database with only the history table, filled with synthetic entries in one statement
+            engine = create_engine("sqlite:///" + os.path.join(directory, "export.db"))
+            with engine.begin() as connection:
+                connection.execute(text("CREATE TABLE search_history (search_id INTEGER NOT NULL PRIMARY KEY, user_id INTEGER NOT NULL, place_name VARCHAR NOT NULL, address VARCHAR NOT NULL, "
+                                        "timestamp DATETIME, latitude FLOAT, longitude FLOAT, fsq_id VARCHAR, category_ids VARCHAR)"))
+                connection.execute(text("WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < :rows) "
+                                        "INSERT INTO search_history (user_id, place_name, address, timestamp, latitude, longitude) "
+                                        "SELECT 1, 'Place ' || i, i || ' Strand, London', datetime('2024-01-01', '+' || i || ' seconds'), 51.5, -0.12 FROM n"), {"rows": EXPORT_ROWS})
+                connection.execute(text("CREATE INDEX ix_search_history_user_timestamp ON search_history (user_id, timestamp)"))
+
+            with Session(engine) as db_session:
+                baseline = resident_memory()
+                peak = baseline
+                rows = 0
+                for count, chunk in enumerate(export.export_csv(iter_history(db_session, 1), 1000)):
+                    rows += chunk.count("\n")
+                    if count % 100 == 0:
+                        peak = max(peak, resident_memory())
+            engine.dispose()
+
+        # the header row and every entry were written
+        self.assertEqual(rows, EXPORT_ROWS + 1)
+        self.assertLess(peak - baseline, RSS_CEILING)
+
+
+if __name__ == "__main__":
+    unittest.main()
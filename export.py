@@ -0,0 +1,50 @@
+from datetime import date, datetime, timedelta
+import csv
+import io
+import json
+
+# columns of an exported history entry, in the order database.iter_history returns them
+EXPORT_COLUMNS = ["timestamp", "place_name", "address", "latitude", "longitude", "fsq_id", "category_ids"]
+
+# export formats with their content types and file extensions
+EXPORT_FORMATS = {"csv": ("text/csv", "csv"), "ndjson": ("application/x-ndjson", "ndjson")}
+
+
+# function to parse the from and to dates (YYYY-MM-DD, either may be missing) of an export into the start and end datetimes of the range,
+# the end being midnight after the to date so the whole day is included; raises ValueError for a malformed date or a range ending before it starts
+def parse_date_range(start, end):
+    start = datetime.combine(date.fromisoformat(start), datetime.min.time()) if start else None
+    end = datetime.combine(date.fromisoformat(end), datetime.min.time()) + timedelta(days=1) if end else None
+    if start is not None and end is not None and end <= start:
+        raise ValueError("the to date is before the from date")
+    return start, end
+
+
+# function to format a history entry's timestamp for export, as ISO 8601
+def format_timestamp(timestamp):
+    return timestamp.isoformat(sep=" ") if timestamp is not None else None
+
+
+# function to write history entries as CSV with a header row, yielding the text in chunks of chunk_size rows
+def export_csv(rows, chunk_size=1000):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for count, row in enumerate(rows, 1):
+        writer.writerow((format_timestamp(row[0]),) + tuple(row[1:]))
+        if count % chunk_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+# function to write history entries as NDJSON, one JSON object per line, yielding the text in chunks of chunk_size rows
+def export_ndjson(rows, chunk_size=1000):
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(EXPORT_COLUMNS, (format_timestamp(row[0]),) + tuple(row[1:])))) + "\n")
+        if len(lines) >= chunk_size:
+            yield "".join(lines)
+            lines = []
+    yield "".join(lines)
@@ -0,0 +1,37 @@
+import math  # trigonometry for distances
+
+# mean radius of the Earth in metres
+EARTH_RADIUS = 6371008.8
+
+# metres per degree of latitude
+METRES_PER_DEGREE = 111320
+
+
+# function to calculate the great-circle distance in metres between two latitude and longitude points
+def haversine(latitude1, longitude1, latitude2, longitude2):
+    phi1 = math.radians(latitude1)
+    phi2 = math.radians(latitude2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(longitude2 - longitude1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(min(1.0, a)))
+
+
+# function to obtain the (row, column) grid cell containing a point, for cells cell_size degrees square
+def cell_of(latitude, longitude, cell_size):
+    return int(math.floor(latitude / cell_size)), int(math.floor(longitude / cell_size))
+
+
+# function to obtain the bounding box (minimum latitude, maximum latitude, minimum longitude, maximum longitude) of a circle of radius metres around a point
+def bounding_box(latitude, longitude, radius):
+    d_latitude = radius / METRES_PER_DEGREE
+    d_longitude = radius / (METRES_PER_DEGREE * max(math.cos(math.radians(latitude)), 0.01))
+    return latitude - d_latitude, latitude + d_latitude, longitude - d_longitude, longitude + d_longitude
+
+
+# function to obtain the range of grid cells (first row, last row, first column, last column) covering a circle of radius metres around a point
+def cell_range(latitude, longitude, radius, cell_size):
+    min_latitude, max_latitude, min_longitude, max_longitude = bounding_box(latitude, longitude, radius)
+    first_row, first_column = cell_of(min_latitude, min_longitude, cell_size)
+    last_row, last_column = cell_of(max_latitude, max_longitude, cell_size)
+    return first_row, last_row, first_column, last_column
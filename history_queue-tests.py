@@ -0,0 +1,56 @@
+from database import db, User, SearchHistory, hash_password, save_history
+from history_queue import HistoryWriter
+from unittest.mock import Mock, patch
+from app import app
+import unittest
+import database
+
+
+class TestHistoryWriter(unittest.TestCase):
+    def setUp(self):
+        with app.app_context():
+            db.create_all()
+            user = User(username="testuser", password=hash_password("password123"))
+            db.session.add(user)
+            db.session.commit()
+            self.user_id = user.user_id
+        self.results = [{"name": "Eiffel Tower", "location": {"formatted_address": "Champ de Mars, 5 Avenue Anatole France, 75007 Paris, France"}}]
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def test_save_history_is_written_behind(self):
+        writer = HistoryWriter(app, batch_size=10, flush_interval=0.05).start()
+        with patch.object(database, "history_writer", writer), app.app_context():
+            for _ in range(3):
+                save_history(db.session, self.user_id, self.results)
+            writer.flush()
+            self.assertEqual(SearchHistory.query.filter_by(user_id=self.user_id).count(), 3)
+        writer.stop()
+        stats = writer.stats()
+        self.assertEqual(stats["enqueued"], 3)
+        self.assertEqual(stats["written"], 3)
+        self.assertEqual(stats["depth"], 0)
+        self.assertGreaterEqual(stats["flushes"], 1)
+        self.assertFalse(writer.enqueue(self.user_id, self.results))
+
+    def test_backpressure_modes(self):
+        dropping = HistoryWriter(app, max_size=1, backpressure="drop")
+        dropping.thread = Mock()
+        self.assertTrue(dropping.enqueue(self.user_id, self.results))
+        self.assertTrue(dropping.enqueue(self.user_id, self.results))
+        self.assertEqual(dropping.stats()["dropped"], 1)
+
+        falling_back = HistoryWriter(app, max_size=1, backpressure="sync")
+        falling_back.thread = Mock()
+        self.assertTrue(falling_back.enqueue(self.user_id, self.results))
+        with patch.object(database, "history_writer", falling_back), app.app_context():
+            save_history(db.session, self.user_id, self.results)
+            self.assertEqual(SearchHistory.query.filter_by(user_id=self.user_id).count(), 1)
+        self.assertEqual(falling_back.stats()["sync_fallbacks"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,126 @@
+import atexit  # for flushing queued history when the process exits
+import queue  # bounded queue of pending history writes
+import threading  # background writer thread
+import time  # for batching by time and measuring flush latency
+import database  # history writes and database session
+import settings  # queue size, batching and backpressure settings
+
+
+# write-behind queue for search history: save_history enqueues results and returns, while a background thread writes
+# queued searches in batches of up to batch_size, committing once per batch or once flush_interval seconds have passed
+# when the queue is full, backpressure decides whether save_history waits ("block"), discards the results ("drop") or writes them during the request ("sync")
+class HistoryWriter:
+    def __init__(self, app, max_size=settings.HISTORY_QUEUE_SIZE, batch_size=settings.HISTORY_BATCH_SIZE, flush_interval=settings.HISTORY_FLUSH_INTERVAL, backpressure=settings.HISTORY_BACKPRESSURE):
+        if backpressure not in ("block", "drop", "sync"):
+            raise ValueError(f"unknown history backpressure mode: {backpressure}")
+        self.app = app
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.backpressure = backpressure
+        self.queue = queue.Queue(maxsize=max_size)
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stopping = threading.Event()
+        self.counters = {"enqueued": 0, "written": 0, "dropped": 0, "sync_fallbacks": 0, "errors": 0, "flushes": 0,
+                         "last_flush_seconds": 0.0, "max_flush_seconds": 0.0, "total_flush_seconds": 0.0}
+
+    # function to start the background writer thread, flushing the queue when the process exits
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+            self.thread.start()
+            atexit.register(self.stop)
+        return self
+
+    # function to queue results for a user, returning False if the caller should write them itself (the queue is full in "sync" mode, or the writer is stopped)
+    def enqueue(self, user_id, results, dedupe_window=settings.HISTORY_DEDUPE_WINDOW):
+        if self.thread is None or self.stopping.is_set():
+            return False
+        item = (user_id, list(results), dedupe_window)
+        try:
+            if self.backpressure == "block":
+                self.queue.put(item)
+            else:
+                self.queue.put_nowait(item)
+        except queue.Full:
+            with self.lock:
+                if self.backpressure == "drop":
+                    self.counters["dropped"] += 1
+                    return True
+                self.counters["sync_fallbacks"] += 1
+            return False
+        with self.lock:
+            self.counters["enqueued"] += 1
+        return True
+
+    # function to wait until every queued search has been written
+    def flush(self):
+        self.queue.join()
+
+    # function to write the remaining queued searches and stop the writer thread
+    def stop(self):
+        if self.thread is not None and not self.stopping.is_set():
+            self.stopping.set()
+            self.thread.join()
+
+    # function to report queue depth and flush counters
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+        stats["depth"] = self.queue.qsize()
+        stats["average_flush_seconds"] = stats["total_flush_seconds"] / stats["flushes"] if stats["flushes"] else 0.0
+        return stats
+
+    # function run on the writer thread, collecting queued searches into batches until stopped and the queue is empty
+    def _run(self):
+        while not (self.stopping.is_set() and self.queue.empty()):
+            try:
+                batch = [self.queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+
+            # keep collecting until the batch is full or the flush interval has passed
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            self._write(batch)
+            for _ in batch:
+                self.queue.task_done()
+
+    # function to write a batch of searches inside an app context with a single commit
+    # if the batch fails, each search is retried with its own commit so one bad search does not lose the rest
+    def _write(self, batch):
+        start = time.perf_counter()
+        written = 0
+        errors = 0
+        with self.app.app_context():
+            session = database.db.session
+            try:
+                for user_id, results, dedupe_window in batch:
+                    database.write_history(session, user_id, results, dedupe_window, commit=False)
+                session.commit()
+                written = len(batch)
+            except Exception:
+                session.rollback()
+                for user_id, results, dedupe_window in batch:
+                    try:
+                        database.write_history(session, user_id, results, dedupe_window)
+                        written += 1
+                    except Exception:
+                        session.rollback()
+                        errors += 1
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.counters["written"] += written
+            self.counters["errors"] += errors
+            self.counters["flushes"] += 1
+            self.counters["last_flush_seconds"] = elapsed
+            self.counters["max_flush_seconds"] = max(self.counters["max_flush_seconds"], elapsed)
+            self.counters["total_flush_seconds"] += elapsed
@@ -0,0 +1,84 @@
+from database import db, User, PlacePopularity, hash_password, save_history, get_history, get_top_searches, search_history
+from migrations import run_migrations
+from sqlalchemy import create_engine, event, inspect, text
+from app import app
+import tempfile
+import unittest
+import os
+
+
+class TestMigrations(unittest.TestCase):
+    def test_run_migrations_on_existing_database(self):
+        with tempfile.TemporaryDirectory() as directory:
+            engine = create_engine("sqlite:///" + os.path.join(directory, "hotelhelper.db"))
+            with engine.begin() as connection:
+                connection.execute(text("CREATE TABLE users (user_id INTEGER NOT NULL, username VARCHAR NOT NULL, password VARCHAR NOT NULL, PRIMARY KEY (user_id))"))
+                connection.execute(text("CREATE TABLE search_history (search_id INTEGER NOT NULL, user_id INTEGER NOT NULL, place_name VARCHAR NOT NULL, address VARCHAR NOT NULL, timestamp DATETIME, PRIMARY KEY (search_id))"))
+                connection.execute(text("INSERT INTO search_history (user_id, place_name, address, timestamp) VALUES (1, 'Eiffel Tower', 'Paris', CURRENT_TIMESTAMP), (1, 'Eiffel Tower', 'Paris', CURRENT_TIMESTAMP)"))
+                connection.execute(text("INSERT INTO users (user_id, username, password) VALUES (1, 'testuser', 'x'), (2, 'testuser', 'y'), (3, 'otheruser', 'z')"))
+            # the app creates any missing tables before running migrations
+            db.metadata.create_all(engine)
+
+            self.assertIn(1, run_migrations(engine))
+            self.assertEqual(run_migrations(engine), [])
+            with engine.connect() as connection:
+                indexes = {row[0] for row in connection.execute(text("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'search_history'"))}
+            self.assertIn("ix_search_history_user_timestamp", indexes)
+            self.assertIn("ix_search_history_user_place", indexes)
+            with engine.connect() as connection:
+                columns = {column["name"] for column in inspect(connection).get_columns("search_history")}
+                self.assertTrue({"latitude", "longitude", "fsq_id", "category_ids"} <= columns)
+                self.assertIsNotNone(connection.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'search_history_rtree'")).first())
+                self.assertTrue({"history_version", "history_modified"} <= {column["name"] for column in inspect(connection).get_columns("users")})
+                self.assertEqual(connection.execute(db.select(PlacePopularity.search_count)).scalar(), 2)
+                self.assertEqual(connection.execute(text("SELECT username FROM users ORDER BY user_id")).scalars().all(), ["testuser", "testuser-2", "otheruser"])
+                self.assertIsNotNone(connection.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'ix_users_username'")).first())
+                self.assertEqual(connection.execute(text("SELECT count(*) FROM search_history_fts WHERE search_history_fts MATCH 'eiffel'")).scalar(), 2)
+            engine.dispose()
+
+
+class TestQueryPlans(unittest.TestCase):
+    def setUp(self):
+        with app.app_context():
+            db.create_all()
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def test_history_queries_use_an_index(self):
+        with app.app_context():
+            user = User(username="testuser", password=hash_password("password123"))
+            db.session.add(user)
+            db.session.commit()
+            user_id = user.user_id
+            save_history(db.session, user_id, [{"name": "Eiffel Tower", "location": {"formatted_address": "Champ de Mars, 5 Avenue Anatole France, 75007 Paris, France"}}])
+
+            # record the SELECT statements run against search_history by each database.py query function
+            statements = []
+
+            def record(conn, cursor, statement, parameters, context, executemany):
+                if statement.lstrip().upper().startswith("SELECT") and ("search_history" in statement or "place_popularity" in statement) and "sqlite_master" not in statement:
+                    statements.append((statement, parameters))
+
+            event.listen(db.engine, "before_cursor_execute", record)
+            try:
+                get_history(db.session, user_id)
+                get_top_searches(db.session, user_id)
+                search_history(db.session, user_id, "eiffel")
+            finally:
+                event.remove(db.engine, "before_cursor_execute", record)
+
+            self.assertGreaterEqual(len(statements), 3)
+            connection = db.session.connection().connection.driver_connection
+            for statement, parameters in statements:
+                plan = [row[3] for row in connection.execute("EXPLAIN QUERY PLAN " + statement, parameters)]
+                table_steps = [step for step in plan if "search_history" in step or "place_popularity" in step]
+                self.assertTrue(table_steps, plan)
+                for step in table_steps:
+                    self.assertTrue("INDEX" in step or "PRIMARY KEY" in step, step)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+from sqlalchemy import text, inspect  # for running raw SQL migration statements and inspecting existing tables
+from datetime import datetime
+import database
+
+
+# function to create a migration step adding a column to an existing table, skipped if the table already has it (such as when db.create_all() created the table)
+def add_column(table, column, column_type):
+    def step(connection):
+        if column not in {existing["name"] for existing in inspect(connection).get_columns(table)}:
+            connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}"))
+    return step
+
+
+# function to rename users sharing a username before the unique index is created, keeping the name for the earliest account and adding the user ID to the others
+# logins only ever matched the first user with a name, so the later accounts could not be logged in to under it anyway
+def rename_duplicate_usernames(connection):
+    duplicates = connection.execute(text("SELECT user_id, username FROM users WHERE user_id NOT IN (SELECT MIN(user_id) FROM users GROUP BY username)")).all()
+    for user_id, username in duplicates:
+        connection.execute(text("UPDATE users SET username = :username WHERE user_id = :user_id"), {"username": f"{username}-{user_id}", "user_id": user_id})
+
+
+# ordered list of schema migrations for existing database files, each a tuple of version number, description and a list of steps
+# a step is either an SQL statement or a function taking the database connection; new databases get the same schema from the models through db.create_all()
+MIGRATIONS = [
+    (1, "index search_history by user and timestamp, and by user and place", [
+        "CREATE INDEX IF NOT EXISTS ix_search_history_user_timestamp ON search_history (user_id, timestamp)",
+        "CREATE INDEX IF NOT EXISTS ix_search_history_user_place ON search_history (user_id, place_name, address)",
+    ]),
+    (2, "full-text index over search_history place names and addresses", [
+        database.create_search_index,
+    ]),
+    (3, "backfill place_popularity counts from search_history", [
+        database.rebuild_popularity,
+    ]),
+    (4, "backfill place_popularity_daily buckets from search_history", [
+        database.rebuild_popularity,
+    ]),
+    (5, "record place coordinates in search_history", [
+        add_column("search_history", "latitude", "FLOAT"),
+        add_column("search_history", "longitude", "FLOAT"),
+    ]),
+    (6, "record FourSquare IDs and category IDs in search_history, and index coordinates in an R*Tree", [
+        add_column("search_history", "fsq_id", "VARCHAR"),
+        add_column("search_history", "category_ids", "VARCHAR"),
+        database.create_spatial_index,
+    ]),
+    (7, "record a search history version for each user", [
+        add_column("users", "history_version", "INTEGER NOT NULL DEFAULT 0"),
+        add_column("users", "history_modified", "TIMESTAMP"),
+    ]),
+    (8, "make usernames unique, renaming any duplicates", [
+        rename_duplicate_usernames,
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_users_username ON users (username)",
+    ]),
+]
+
+
+# function to apply every migration that has not yet been recorded in the schema_migrations table, returning the versions applied
+# each migration runs in its own transaction, so a failed migration leaves earlier ones applied and is retried on the next run
+def run_migrations(engine, migrations=MIGRATIONS):
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE IF NOT EXISTS schema_migrations (version INTEGER PRIMARY KEY, description VARCHAR NOT NULL, applied_at TIMESTAMP NOT NULL)"))
+        applied = {row[0] for row in connection.execute(text("SELECT version FROM schema_migrations"))}
+
+    newly_applied = []
+    for version, description, steps in sorted(migrations, key=lambda migration: migration[0]):
+        if version in applied:
+            continue
+        with engine.begin() as connection:
+            for step in steps:
+                if callable(step):
+                    step(connection)
+                else:
+                    connection.execute(text(step))
+            connection.execute(text("INSERT INTO schema_migrations (version, description, applied_at) VALUES (:version, :description, :applied_at)"),
+                               {"version": version, "description": description, "applied_at": datetime.utcnow()})
+        newly_applied.append(version)
+    return newly_applied
@@ -0,0 +1,38 @@
+from passwords import PasswordPool, PasswordPoolBusy
+import database
+import unittest
+
+
+class TestPasswordPool(unittest.TestCase):
+    def test_hash_and_verify_in_worker_processes(self):
+        pool = PasswordPool(workers=2, max_pending=4)
+        try:
+            hashed_password = pool.hash_password("password123")
+            self.assertTrue(pool.verify_password("password123", hashed_password))
+            self.assertFalse(pool.verify_password("wrongpassword", hashed_password))
+            self.assertIsNotNone(pool.executor)
+            self.assertEqual(pool.stats(), {"completed": 3, "rejected": 0, "workers": 2})
+        finally:
+            pool.stop()
+
+    def test_busy_pool_rejects_work(self):
+        pool = PasswordPool(workers=0, max_pending=1)
+        hashed_password = database.hash_password("password123", 4)
+        # take the only slot, as a long-running check would
+        pool.slots.acquire()
+        with self.assertRaises(PasswordPoolBusy):
+            pool.verify_password("password123", hashed_password)
+        pool.slots.release()
+        self.assertTrue(pool.verify_password("password123", hashed_password))
+        self.assertIsNone(pool.executor)
+        self.assertEqual(pool.stats()["rejected"], 1)
+
+    def test_password_needs_rehash(self):
+        hashed_password = database.hash_password("password123", 4)
+        self.assertTrue(database.password_needs_rehash(hashed_password))
+        self.assertFalse(database.password_needs_rehash(hashed_password, 4))
+        self.assertTrue(database.password_needs_rehash("not a bcrypt hash"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+from concurrent.futures import ProcessPoolExecutor  # worker processes running bcrypt outside the request threads and the GIL
+import atexit  # for shutting the worker processes down when the process exits
+import threading  # slots limiting the password work queued at once
+import database  # bcrypt hashing and checking
+import settings  # worker and queue depth settings
+
+
+# exception raised when settings.PASSWORD_MAX_PENDING hashes or checks are already queued or running, so the caller can answer 503 rather than wait
+class PasswordPoolBusy(Exception):
+    pass
+
+
+# bounded pool of worker processes for bcrypt: every hash or check takes a slot for as long as it is queued or running, and is refused once all max_pending slots
+# are taken, so a flood of logins waits on at most workers processes' worth of CPU and is turned away beyond that instead of starving searches
+# the worker processes are started on first use; with no workers, hashes and checks run on the calling thread but are still limited by the slots
+class PasswordPool:
+    def __init__(self, workers=settings.PASSWORD_WORKERS, max_pending=settings.PASSWORD_MAX_PENDING):
+        self.workers = workers
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.lock = threading.Lock()
+        self.executor = None
+        self.counters = {"completed": 0, "rejected": 0}
+
+    # function to run a function in a worker process, returning its result, or raising PasswordPoolBusy if every slot is taken
+    def run(self, function, *args):
+        if not self.slots.acquire(blocking=False):
+            with self.lock:
+                self.counters["rejected"] += 1
+            raise PasswordPoolBusy("Too many logins at once - try again in a moment")
+        try:
+            executor = self._executor()
+            result = executor.submit(function, *args).result() if executor is not None else function(*args)
+        finally:
+            self.slots.release()
+        with self.lock:
+            self.counters["completed"] += 1
+        return result
+
+    # function to hash a password with the configured bcrypt cost in a worker process
+    def hash_password(self, password):
+        return self.run(database.hash_password, password, settings.BCRYPT_ROUNDS)
+
+    # function to check a password against a stored hash in a worker process
+    def verify_password(self, input_password, hashed_password):
+        return self.run(database.verify_password, input_password, hashed_password)
+
+    # function to shut the worker processes down, waiting for running work to finish
+    def stop(self):
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown()
+
+    # function to report the number of workers and the completed and rejected counters
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+        stats["workers"] = self.workers
+        return stats
+
+    # function to obtain the worker process pool, starting it on first use, or None to run on the calling thread
+    def _executor(self):
+        if not self.workers:
+            return None
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.workers)
+                atexit.register(self.stop)
+            return self.executor
@@ -0,0 +1,110 @@
+from database import db, Place, User, SearchHistory, hash_password
+from cache import places_cache
+from unittest.mock import Mock, patch
+from app import app
+import places
+import tempfile
+import unittest
+import json
+import os
+import utils
+
+
+# function to build a FourSquare style result for a place near Trafalgar Square, offset by a number of metres north
+def place(number, north=0, category=13065):
+    return {"fsq_id": f"fsq{number}", "name": f"Place {number}", "location": {"formatted_address": f"{number} Strand, London"},
+            "geocodes": {"main": {"latitude": 51.5080 + north / 111320, "longitude": -0.1281}}, "categories": [{"id": category}], "distance": north}
+
+
+class TestPlaces(unittest.TestCase):
+    def setUp(self):
+        places_cache.clear()
+        with app.app_context():
+            db.create_all()
+
+    def tearDown(self):
+        places_cache.clear()
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def test_store_places_dedupes_by_fsq_id(self):
+        with app.app_context():
+            self.assertEqual(places.store_places(db.session, [place(1), place(2), place(1, north=10), {"name": "No ID", "location": {"formatted_address": "Somewhere"}}]), 2)
+            places.store_places(db.session, [place(2, north=20)])
+            db.session.commit()
+            self.assertEqual(Place.query.count(), 2)
+            self.assertAlmostEqual(db.session.get(Place, "fsq2").latitude, 51.5080 + 20 / 111320)
+
+    def test_search_local_needs_coverage(self):
+        with app.app_context():
+            results = [place(number, north=number * 50) for number in range(3)]
+            places.store_places(db.session, results)
+            self.assertIsNone(places.search_local(db.session, 51.5080, -0.1281, "13000", 500))
+
+            places.record_coverage(db.session, 51.5080, -0.1281, 1000, "13000", results)
+            db.session.commit()
+            self.assertEqual([result["fsq_id"] for result in places.search_local(db.session, 51.5080, -0.1281, "13000", 500)], ["fsq0", "fsq1", "fsq2"])
+            # a circle reaching outside the covered area, and categories that were not searched for, are not covered
+            self.assertIsNone(places.search_local(db.session, 51.5080, -0.1281, "13000", 2000))
+            self.assertIsNone(places.search_local(db.session, 51.5080, -0.1281, "10000", 500))
+            self.assertIsNone(places.search_local(db.session, 51.5080, -0.1281, "", 500))
+
+    def test_full_page_only_covers_to_farthest_result(self):
+        with app.app_context():
+            results = [place(number, north=number * 10) for number in range(10)]
+            places.store_places(db.session, results)
+            places.record_coverage(db.session, 51.5080, -0.1281, 1000, "", results)
+            db.session.commit()
+            self.assertEqual(db.session.query(places.PlaceCoverage.radius).scalar(), 90)
+            self.assertEqual(len(places.search_local(db.session, 51.5080, -0.1281, "", 1000)), 10)
+            self.assertIsNone(places.search_local(db.session, 51.5080 + 500 / 111320, -0.1281, "", 1000))
+
+    def test_full_page_with_results_without_address(self):
+        with app.app_context():
+            page = [place(number, north=number * 10) for number in range(10)]
+            for result in page[7:]:
+                del result["location"]["formatted_address"]
+            response = Mock(status_code=200)
+            response.json.return_value = {"results": page}
+            with patch.object(utils.upstream, "get", return_value=response):
+                self.assertEqual(len(utils.get_destinations(51.5080, -0.1281, "", 1000, None, db.session)), 7)
+            # the page was full, so only the circle up to its farthest result is covered, although three results were not stored
+            self.assertEqual(Place.query.count(), 7)
+            self.assertEqual(db.session.query(places.PlaceCoverage.radius).scalar(), 90)
+
+    def test_get_destinations_local_first(self):
+        with app.app_context():
+            user = User(username="testuser", password=hash_password("password123"))
+            db.session.add(user)
+            db.session.commit()
+            response = Mock(status_code=200)
+            response.json.return_value = {"results": [place(1, north=100), place(2, north=200)]}
+            with patch.object(utils.upstream, "get", return_value=response) as get:
+                self.assertEqual(len(utils.get_destinations(51.5080, -0.1281, "13000", 1000, user.user_id, db.session)), 2)
+                # a search in another grid cell within the covered area is answered locally, and still saved to history
+                nearby = utils.get_destinations(51.5080 + 100 / 111320, -0.1271, "13000", 100, user.user_id, db.session)
+            self.assertEqual(get.call_count, 1)
+            self.assertEqual([result["fsq_id"] for result in nearby], ["fsq1"])
+            self.assertEqual(SearchHistory.query.count(), 3)
+
+    def test_load_places(self):
+        with tempfile.TemporaryDirectory() as directory, app.app_context():
+            json_path = os.path.join(directory, "places.json")
+            with open(json_path, "w") as file:
+                json.dump({"results": [place(1), place(2)]}, file)
+            csv_path = os.path.join(directory, "places.csv")
+            with open(csv_path, "w") as file:
+                file.write('fsq_id,name,address,latitude,longitude,category_ids\nfsq3,Place 3,3 Strand,51.5081,-0.1281,"13065,13003"\n,No ID,Somewhere,51.5,-0.12,\n')
+
+            self.assertEqual(places.load_places(db.session, json_path, batch_size=1), 2)
+            self.assertEqual(places.load_places(db.session, csv_path, covers=(51.5080, -0.1281, 1000)), 1)
+            self.assertEqual(db.session.get(Place, "fsq3").category_ids, "13065,13003")
+            self.assertEqual(len(places.search_local(db.session, 51.5080, -0.1281, "13000", 500)), 3)
+
+            result = app.test_cli_runner().invoke(args=["import-places", json_path, "--covers", "north"])
+            self.assertNotEqual(result.exit_code, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
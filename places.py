@@ -0,0 +1,135 @@
+from database import Place, PlaceCoverage, in_categories, upsert  # models and helpers from database.py
+from sqlalchemy import desc
+from datetime import datetime, timedelta
+import json
+import csv
+import os
+import geo  # grid cells and distances
+import settings  # cell size, coverage age and page size
+
+# largest search radius in metres FourSquare accepts, so no coverage circle is larger
+MAX_COVERAGE_RADIUS = 100000
+
+
+# function to obtain a place row for the places table from a FourSquare result, or None if the result has no FourSquare ID or coordinates
+def place_row(result):
+    main = result.get("geocodes", {}).get("main", {})
+    latitude, longitude = main.get("latitude"), main.get("longitude")
+    if not result.get("fsq_id") or latitude is None or longitude is None:
+        return None
+    cell_row, cell_column = geo.cell_of(latitude, longitude, settings.PLACES_CELL_SIZE)
+    return {"fsq_id": result["fsq_id"], "name": result["name"], "address": result["location"]["formatted_address"], "latitude": latitude, "longitude": longitude,
+            "category_ids": ",".join(str(category["id"]) for category in result.get("categories", []) if "id" in category) or None,
+            "cell_row": cell_row, "cell_column": cell_column, "updated_at": datetime.utcnow()}
+
+
+# function to add or update places in the places table from a list of FourSquare results, returning the number of places stored
+# each FourSquare ID is stored once, with the details from its last occurrence; commiting is left to the caller
+def store_places(db_session, results):
+    rows = {}
+    for result in results:
+        row = place_row(result)
+        if row is not None:
+            rows[row["fsq_id"]] = row
+    if rows:
+        statement = upsert(db_session, Place.__table__)
+        statement = statement.on_conflict_do_update(index_elements=["fsq_id"], set_={column: statement.excluded[column] for column in
+                                                                                     ["name", "address", "latitude", "longitude", "category_ids", "cell_row", "cell_column", "updated_at"]})
+        db_session.execute(statement, list(rows.values()))
+    return len(rows)
+
+
+# function to obtain a category string in a canonical form, with the IDs sorted and separated by commas
+def normalise_categories(categories):
+    return ",".join(sorted({category.strip() for category in (categories or "").split(",") if category.strip()}))
+
+
+# function to record that the places table holds everything a FourSquare search returned, removing coverage older than settings.PLACES_COVERAGE_MAX_AGE
+# FourSquare returns at most settings.PLACES_PAGE_SIZE places nearest first, so a full page only covers the circle up to its farthest place
+# page is every result in the response, including those without an address that are not stored, since they still fill the page
+def record_coverage(db_session, latitude, longitude, radius, categories, page):
+    if len(page) >= settings.PLACES_PAGE_SIZE:
+        radius = min(radius, max((result["distance"] if "distance" in result else geo.haversine(latitude, longitude, result["geocodes"]["main"]["latitude"], result["geocodes"]["main"]["longitude"])
+                                  for result in page if "distance" in result or "main" in result.get("geocodes", {})), default=0))
+    db_session.add(PlaceCoverage(latitude=latitude, longitude=longitude, radius=radius, categories=normalise_categories(categories), covered_at=datetime.utcnow()))
+    db_session.query(PlaceCoverage).filter(PlaceCoverage.covered_at < datetime.utcnow() - timedelta(seconds=settings.PLACES_COVERAGE_MAX_AGE)).delete()
+
+
+# function to check whether a recorded search covers a circle of radius metres around a point for the given categories
+# coverage of every category covers any categories, otherwise the covered categories must include all of those asked for
+def is_covered(db_session, latitude, longitude, radius, categories):
+    wanted = set(normalise_categories(categories).split(",")) - {""}
+    min_latitude, max_latitude = geo.bounding_box(latitude, longitude, MAX_COVERAGE_RADIUS)[:2]
+    candidates = db_session.query(PlaceCoverage.latitude, PlaceCoverage.longitude, PlaceCoverage.radius, PlaceCoverage.categories).\
+        filter(PlaceCoverage.latitude.between(min_latitude, max_latitude), PlaceCoverage.covered_at >= datetime.utcnow() - timedelta(seconds=settings.PLACES_COVERAGE_MAX_AGE)).\
+        order_by(desc(PlaceCoverage.radius))
+    for covered_latitude, covered_longitude, covered_radius, covered_categories in candidates:
+        if covered_categories and (not wanted or not wanted <= set(covered_categories.split(","))):
+            continue
+        if geo.haversine(latitude, longitude, covered_latitude, covered_longitude) + radius <= covered_radius:
+            return True
+    return False
+
+
+# function to find places in the places table within radius metres of a point, optionally only those in one of a comma-separated list of category IDs, nearest first
+# returns a list of dictionaries in the shape of FourSquare results, including the distance in metres
+def find_local_places(db_session, latitude, longitude, categories, radius, limit=None):
+    first_row, last_row, first_column, last_column = geo.cell_range(latitude, longitude, radius, settings.PLACES_CELL_SIZE)
+    candidates = db_session.query(Place.fsq_id, Place.name, Place.address, Place.latitude, Place.longitude, Place.category_ids).\
+        filter(Place.cell_row.between(first_row, last_row), Place.cell_column.between(first_column, last_column))
+
+    wanted = set(normalise_categories(categories).split(",")) - {""}
+    places = []
+    for fsq_id, name, address, place_latitude, place_longitude, category_ids in candidates:
+        place_categories = category_ids.split(",") if category_ids else []
+        if wanted and not in_categories(place_categories, wanted):
+            continue
+        distance = geo.haversine(latitude, longitude, place_latitude, place_longitude)
+        if distance <= radius:
+            places.append({"fsq_id": fsq_id, "name": name, "location": {"formatted_address": address}, "geocodes": {"main": {"latitude": place_latitude, "longitude": place_longitude}},
+                           "categories": [{"id": category} for category in place_categories], "distance": round(distance)})
+    places.sort(key=lambda place: place["distance"])
+    return places[:limit]
+
+
+# function to answer a search from the places table, returning the nearest settings.PLACES_PAGE_SIZE places like FourSquare would, or None if no recorded search covers the area
+# with a full page of local places only the circle up to the farthest of them needs to be covered, as nearer places are all known
+def search_local(db_session, latitude, longitude, categories, radius):
+    results = find_local_places(db_session, latitude, longitude, categories, radius, settings.PLACES_PAGE_SIZE)
+    needed = results[-1]["distance"] if len(results) >= settings.PLACES_PAGE_SIZE else radius
+    if is_covered(db_session, latitude, longitude, needed, categories):
+        return results
+    return None
+
+
+# function to read places from a JSON or CSV dump, yielding them as FourSquare results
+# JSON files hold a list of FourSquare results, or a FourSquare response with a "results" list; CSV files have a header row with fsq_id, name, address, latitude,
+# longitude and category_ids columns, the category IDs separated by commas
+def read_places(path):
+    with open(path, newline="", encoding="utf-8") as file:
+        if os.path.splitext(path)[1].lower() == ".csv":
+            for row in csv.DictReader(file):
+                yield {"fsq_id": row.get("fsq_id"), "name": row["name"], "location": {"formatted_address": row.get("address") or row.get("formatted_address", "")},
+                       "geocodes": {"main": {"latitude": float(row["latitude"]), "longitude": float(row["longitude"])}},
+                       "categories": [{"id": category.strip()} for category in (row.get("category_ids") or "").split(",") if category.strip()]}
+        else:
+            data = json.load(file)
+            yield from data["results"] if isinstance(data, dict) else data
+
+
+# function to bulk import a JSON or CSV dump of places into the places table, batch_size places per statement, returning the number of places stored
+# places without a FourSquare ID or coordinates are skipped; if covers is given as (latitude, longitude, radius), the dump is recorded as covering that circle for every category
+def load_places(db_session, path, covers=None, batch_size=1000):
+    stored = 0
+    batch = []
+    for result in read_places(path):
+        batch.append(result)
+        if len(batch) >= batch_size:
+            stored += store_places(db_session, batch)
+            batch = []
+    stored += store_places(db_session, batch)
+    if covers is not None:
+        latitude, longitude, radius = covers
+        db_session.add(PlaceCoverage(latitude=latitude, longitude=longitude, radius=radius, categories="", covered_at=datetime.utcnow()))
+    db_session.commit()
+    return stored
@@ -0,0 +1,61 @@
+from unittest.mock import Mock, patch
+from cache import places_cache
+import numpy as np
+import unittest
+import ranking
+import geo
+import utils
+
+
+# function to build a FourSquare style result with coordinates and a category ID
+def place(name, latitude, longitude, category=13065):
+    return {"name": name, "location": {"formatted_address": f"{name}, London"}, "geocodes": {"main": {"latitude": latitude, "longitude": longitude}}, "categories": [{"id": category}]}
+
+
+class TestRanking(unittest.TestCase):
+    def test_haversine_matrix_matches_haversine(self):
+        origins = [(51.5007, -0.1246), (51.5136, -0.0984)]
+        latitudes = np.array([51.5033, 51.5055, 48.8584])
+        longitudes = np.array([-0.1196, -0.0754, 2.2945])
+        distances = ranking.haversine_matrix(origins, latitudes, longitudes)
+        self.assertEqual(distances.shape, (2, 3))
+        for row, (latitude, longitude) in enumerate(origins):
+            for column in range(3):
+                self.assertAlmostEqual(distances[row, column], geo.haversine(latitude, longitude, latitudes[column], longitudes[column]), places=3)
+
+    def test_rank_by_distance_to_every_origin(self):
+        hotel, venue = (51.5007, -0.1246), (51.5136, -0.0984)
+        results = [place("Near Hotel", 51.5010, -0.1240), place("Between", 51.5070, -0.1115), place("Near Venue", 51.5130, -0.0990)]
+        ranked = ranking.rank_places(results, [hotel], radius=3000)
+        self.assertEqual([result["name"] for result in ranked], ["Near Hotel", "Between", "Near Venue"])
+        ranked = ranking.rank_places(results, [hotel, venue], radius=3000)
+        self.assertEqual(ranked[0]["name"], "Between")
+        self.assertEqual(len(ranked[0]["distances"]), 2)
+        self.assertNotIn("score", results[0])
+
+    def test_rank_by_category_and_popularity(self):
+        results = [place("Museum", 51.5010, -0.1240, 10027), place("Restaurant", 51.5020, -0.1240), place("Popular Restaurant", 51.5030, -0.1240), {"name": "No Coordinates", "location": {"formatted_address": "Somewhere"}}]
+        ranked = ranking.rank_places(results, [(51.5007, -0.1246)], "13000", 1000, {("Popular Restaurant", "Popular Restaurant, London"): 50, ("Restaurant", "Restaurant, London"): 1})
+        self.assertEqual([result["name"] for result in ranked], ["Popular Restaurant", "Restaurant", "Museum", "No Coordinates"])
+        self.assertEqual(ranked[-1]["distances"], [None])
+        self.assertEqual(ranking.rank_places([], [(51.5, -0.12)]), [])
+
+    def test_parse_origins(self):
+        self.assertEqual(ranking.parse_origins(["51.5136,-0.0984"]), [(51.5136, -0.0984)])
+        for values in [["north"], ["91,0"], ["51.5,-0.1"] * 6]:
+            with self.assertRaises(ValueError):
+                ranking.parse_origins(values)
+
+    def test_get_destinations_ranks_results(self):
+        places_cache.clear()
+        response = Mock(status_code=200)
+        response.json.return_value = {"results": [place("Far", 51.5100, -0.1246), place("Near", 51.5010, -0.1246)]}
+        with patch.object(utils.upstream, "get", return_value=response):
+            results = utils.get_destinations(51.5007, -0.1246, "", 2000, None, None, [(51.5150, -0.1246)])
+        places_cache.clear()
+        self.assertEqual([result["name"] for result in results], ["Far", "Near"])
+        self.assertIn("score", results[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+from database import in_categories  # FourSquare category matching from database.py
+import numpy as np  # vectorised distances and scores
+import geo  # radius of the Earth
+import settings  # default ranking weights
+
+
+# function to calculate the great-circle distances in metres from each origin to each place in one vectorised pass
+# origins is a sequence of (latitude, longitude) pairs, and latitudes and longitudes are arrays of place coordinates (NaN for places without coordinates)
+# returns an array with one row per origin and one column per place
+def haversine_matrix(origins, latitudes, longitudes):
+    origins = np.radians(np.asarray(origins, dtype=float).reshape(-1, 2))
+    phi1, lambda1 = origins[:, 0:1], origins[:, 1:2]
+    phi2, lambda2 = np.radians(latitudes)[np.newaxis, :], np.radians(longitudes)[np.newaxis, :]
+    a = np.sin((phi2 - phi1) / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin((lambda2 - lambda1) / 2) ** 2
+    return 2 * geo.EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+# function to score places from their distances to each origin, whether they match the categories searched for, and their popularity counts, higher scores first
+# each part is scaled to between 0 and 1 before weighting: distance by the distance to the farthest origin relative to scale metres, so places near every origin rank first,
+# and popularity on a log scale relative to the most popular place; places without coordinates score 0 for distance
+def score(distances, category_match, popularity, scale, weights):
+    distance_score = np.nan_to_num(np.clip(1 - distances.max(axis=0) / scale, 0, 1))
+    most_popular = popularity.max(initial=0)
+    popularity_score = np.log1p(popularity) / np.log1p(most_popular) if most_popular > 0 else np.zeros_like(popularity)
+    return weights["distance"] * distance_score + weights["category"] * category_match + weights["popularity"] * popularity_score
+
+
+# function to re-rank FourSquare style results by a weighted score of distance to one or more origins, category match and popularity
+# popularity is a dictionary of search counts keyed by (place name, address); distances are scaled by the search radius, or the farthest distance without one
+# weights default to settings.RANKING_WEIGHTS; returns new result dictionaries, best first, each with its score and a list of distances in metres to each origin
+def rank_places(results, origins, categories="", radius=None, popularity=None, weights=None):
+    if not results:
+        return []
+    count = len(results)
+    latitudes = np.fromiter((result.get("geocodes", {}).get("main", {}).get("latitude", np.nan) for result in results), dtype=float, count=count)
+    longitudes = np.fromiter((result.get("geocodes", {}).get("main", {}).get("longitude", np.nan) for result in results), dtype=float, count=count)
+    distances = haversine_matrix(origins, latitudes, longitudes)
+
+    # places match when no categories were searched for, or one of their categories (or its top-level category) was
+    wanted = {category.strip() for category in (categories or "").split(",") if category.strip()}
+    if wanted:
+        category_match = np.fromiter((in_categories([str(category.get("id")) for category in result.get("categories", [])], wanted) for result in results), dtype=float, count=count)
+    else:
+        category_match = np.ones(count)
+    popularity = popularity or {}
+    counts = np.fromiter((popularity.get((result.get("name"), result.get("location", {}).get("formatted_address")), 0) for result in results), dtype=float, count=count)
+
+    scale = radius or np.nanmax(distances, initial=0) or 1
+    scores = score(distances, category_match, counts, scale, weights or settings.RANKING_WEIGHTS)
+    # stable sort on the negated scores, so equally scored places keep FourSquare's order
+    order = np.argsort(-scores, kind="stable")
+
+    # convert scores and distances to Python lists in one pass each, rather than reading numpy values one at a time
+    rounded_scores = np.round(scores, 4).tolist()
+    rounded_distances = np.nan_to_num(np.rint(distances)).astype(np.int64).T.tolist()
+    missing = (np.isnan(latitudes) | np.isnan(longitudes)).tolist()
+    return [dict(results[index], score=rounded_scores[index], distances=[None] * len(origins) if missing[index] else rounded_distances[index]) for index in order.tolist()]
+
+
+# function to parse extra origins from a list of "latitude,longitude" strings, raising ValueError for malformed or out of range coordinates, or too many origins
+def parse_origins(values):
+    if len(values) > settings.RANKING_MAX_ORIGINS:
+        raise ValueError(f"Error: at most {settings.RANKING_MAX_ORIGINS} extra origins can be given")
+    origins = []
+    for value in values:
+        try:
+            latitude, longitude = (float(part) for part in value.split(","))
+        except ValueError:
+            raise ValueError("Error: origins must be given as latitude,longitude")
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+            raise ValueError("Error: origins must be valid coordinates")
+        origins.append((latitude, longitude))
+    return origins
@@ -0,0 +1,59 @@
+from ratelimit import MemoryBucketStore, RedisBucketStore, RateLimiter
+from unittest.mock import Mock
+import ratelimit
+import unittest
+
+# fakeredis is an optional in-process Redis stand-in with Lua scripting, used to test the shared store when it is installed
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+class TestRateLimit(unittest.TestCase):
+    def test_memory_bucket_refills(self):
+        store = MemoryBucketStore()
+        self.assertEqual([store.take("ip", 1, 3, now=0)[0] for _ in range(4)], [True, True, True, False])
+        self.assertEqual(store.take("ip", 1, 3, now=0), (False, 1))
+        self.assertTrue(store.take("ip", 1, 3, now=1)[0])
+        self.assertEqual(store.take("ip", 1, 3, 2, now=1.5), (False, 1.5))
+        self.assertTrue(store.take("other", 1, 3, now=0)[0])
+        store.reset("ip")
+        self.assertTrue(store.take("ip", 1, 3, 3, now=1.5)[0])
+
+    def test_memory_store_evicts_least_recently_used(self):
+        store = MemoryBucketStore(max_keys=2)
+        for key in ["a", "b", "a", "c"]:
+            store.take(key, 1, 1, now=0)
+        self.assertEqual(list(store.buckets), ["a", "c"])
+
+    def test_rate_limiter(self):
+        limiter = RateLimiter(MemoryBucketStore(), {"login_ip": (2, 60)})
+        self.assertEqual([limiter.check("login_ip", "10.0.0.1") for _ in range(3)], [0, 0, 30])
+        self.assertEqual(limiter.check("login_ip", "10.0.0.2"), 0)
+        self.assertEqual(limiter.check("login_ip", "10.0.0.2", 5), 120)
+        limiter.reset("login_ip", "10.0.0.1")
+        self.assertEqual(limiter.check("login_ip", "10.0.0.1"), 0)
+        self.assertEqual(RateLimiter(MemoryBucketStore(), {"login_ip": (0, 60)}, enabled=False).check("login_ip", "10.0.0.1"), 0)
+
+    @unittest.skipUnless(fakeredis, "fakeredis is not installed")
+    def test_redis_store_shares_buckets(self):
+        server = fakeredis.FakeServer()
+        first, second = RedisBucketStore(fakeredis.FakeRedis(server=server)), RedisBucketStore(fakeredis.FakeRedis(server=server))
+        self.assertEqual([store.take("ip", 1, 2, now=100)[0] for store in [first, second, first]], [True, True, False])
+        self.assertEqual(second.take("ip", 1, 2, now=100.25), (False, 0.75))
+        self.assertTrue(second.take("ip", 1, 2, now=101.25)[0])
+        self.assertGreater(first.client.pttl(first.prefix + "ip"), 0)
+        first.reset("ip")
+        self.assertEqual(second.take("ip", 1, 2, 2, now=101.25), (True, 0))
+
+    @unittest.skipUnless(ratelimit.redis, "redis is not installed")
+    def test_redis_store_falls_back_when_unavailable(self):
+        client = Mock()
+        client.register_script.return_value = Mock(side_effect=ratelimit.redis.ConnectionError)
+        store = RedisBucketStore(client)
+        self.assertEqual([store.take("ip", 1, 1, now=0)[0] for _ in range(2)], [True, False])
+
+
+if __name__ == "__main__":
+    unittest.main()
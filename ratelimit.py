@@ -0,0 +1,115 @@
+from collections import OrderedDict  # least recently used order of in-process buckets
+import math
+import threading  # lock guarding the in-process buckets across request threads
+import time
+import settings  # limits, store size and Redis URL
+
+# redis is optional: buckets are kept in process unless the package is installed and settings.RATE_LIMIT_REDIS_URL is set
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+# in-process token bucket store: each key holds (tokens, time last updated), refilled at rate tokens per second up to burst tokens
+# the least recently used keys are evicted beyond max_keys (an evicted bucket starts again full), so a flood of new IPs or usernames cannot grow memory without limit
+class MemoryBucketStore:
+    def __init__(self, max_keys=settings.RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    # function to take cost tokens from a key's bucket, returning whether they were available and the seconds until they would be
+    def take(self, key, rate, burst, cost=1, now=None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            tokens, updated = self.buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + max(0, now - updated) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self.buckets[key] = (tokens, now)
+            self.buckets.move_to_end(key)
+            while len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        return allowed, 0 if allowed else (cost - tokens) / rate
+
+    # function to refill a key's bucket by removing it
+    def reset(self, key):
+        with self.lock:
+            self.buckets.pop(key, None)
+
+
+# Lua script taking tokens from a bucket stored as a Redis hash in one atomic step, so every app process shares the same buckets
+# the hash expires once the bucket would have refilled, and the remaining tokens are returned as a string since Redis truncates Lua numbers to integers
+TAKE_SCRIPT = """
+local rate, burst, cost, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or burst
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local allowed = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil((burst - tokens) / rate * 1000) + 1000)
+return {allowed, tostring(tokens)}
+"""
+
+
+# token bucket store shared through Redis, for several app processes or servers; times are wall clock times, as they are compared across machines
+# if Redis cannot be reached, buckets are kept in process until it can, so an outage does not turn every login away
+class RedisBucketStore:
+    def __init__(self, client, prefix="hotelhelper:ratelimit:"):
+        self.client = client
+        self.prefix = prefix
+        self.script = client.register_script(TAKE_SCRIPT)
+        self.fallback = MemoryBucketStore()
+
+    # function to take cost tokens from a key's bucket, returning whether they were available and the seconds until they would be
+    def take(self, key, rate, burst, cost=1, now=None):
+        now = time.time() if now is None else now
+        try:
+            allowed, tokens = self.script(keys=[self.prefix + key], args=[rate, burst, cost, now])
+        except redis.RedisError:
+            return self.fallback.take(key, rate, burst, cost)
+        return bool(allowed), 0 if allowed else (cost - float(tokens)) / rate
+
+    # function to refill a key's bucket by removing it
+    def reset(self, key):
+        try:
+            self.client.delete(self.prefix + key)
+        except redis.RedisError:
+            pass
+        self.fallback.reset(key)
+
+
+# rate limiter applying the named limits in settings.RATE_LIMITS, each a number of requests allowed per period of seconds (and the burst allowed at once),
+# to a bucket per limit and identity (such as a client IP address or a username)
+class RateLimiter:
+    def __init__(self, store, limits=settings.RATE_LIMITS, enabled=settings.RATE_LIMIT_ENABLED):
+        self.store = store
+        self.limits = limits
+        self.enabled = enabled
+
+    # function to charge a request to a limit for an identity, returning 0 if it is allowed or the whole seconds to wait before retrying
+    # cost is the number of requests charged, such as the queries in a batch search
+    def check(self, name, identity, cost=1):
+        if not self.enabled:
+            return 0
+        requests, period = self.limits[name]
+        allowed, wait = self.store.take(f"{name}:{identity}", requests / period, requests, cost)
+        return 0 if allowed else max(1, math.ceil(wait))
+
+    # function to refill an identity's bucket for a limit, such as a username's failed login attempts after a successful login
+    def reset(self, name, identity):
+        self.store.reset(f"{name}:{identity}")
+
+
+# function to create the rate limiter for the app, sharing buckets through Redis if settings.RATE_LIMIT_REDIS_URL is set and the redis package is installed
+def create_rate_limiter():
+    if settings.RATE_LIMIT_REDIS_URL and redis is not None:
+        return RateLimiter(RedisBucketStore(redis.Redis.from_url(settings.RATE_LIMIT_REDIS_URL)))
+    return RateLimiter(MemoryBucketStore())
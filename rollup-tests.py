@@ -0,0 +1,96 @@
+from database import db, User, SearchHistory, hash_password, save_history
+from rollup import refresh_rollup, nearby_popular_places
+from app import app
+from datetime import datetime, timedelta
+import unittest
+import geo
+
+
+# function to build a FourSquare style result with coordinates
+def place(name, latitude, longitude):
+    return {"name": name, "location": {"formatted_address": f"{name}, London"}, "geocodes": {"main": {"latitude": latitude, "longitude": longitude}}}
+
+
+class TestGeo(unittest.TestCase):
+    def test_haversine(self):
+        # Big Ben to the London Eye is roughly 420 metres
+        self.assertAlmostEqual(geo.haversine(51.5007, -0.1246, 51.5033, -0.1196), 440, delta=30)
+        self.assertEqual(geo.haversine(51.5, -0.1, 51.5, -0.1), 0)
+
+    def test_cell_range_covers_point(self):
+        first_row, last_row, first_column, last_column = geo.cell_range(51.5, -0.12, 1000, 0.01)
+        row, column = geo.cell_of(51.5, -0.12, 0.01)
+        self.assertTrue(first_row <= row <= last_row and first_column <= column <= last_column)
+        self.assertGreater(last_row, first_row)
+
+
+class TestRollup(unittest.TestCase):
+    def setUp(self):
+        with app.app_context():
+            db.create_all()
+            self.user_ids = []
+            for username in ["hotel1", "hotel2"]:
+                user = User(username=username, password=hash_password("password123"))
+                db.session.add(user)
+                db.session.commit()
+                self.user_ids.append(user.user_id)
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def test_refresh_is_incremental(self):
+        with app.app_context():
+            save_history(db.session, self.user_ids[0], [place("Big Ben", 51.5007, -0.1246), place("London Eye", 51.5033, -0.1196), place("Tower Bridge", 51.5055, -0.0754)])
+            save_history(db.session, self.user_ids[1], [place("London Eye", 51.5033, -0.1196)])
+            save_history(db.session, self.user_ids[1], [{"name": "No Coordinates", "location": {"formatted_address": "Somewhere"}}])
+            self.assertEqual(refresh_rollup(db.session), 4)
+            self.assertEqual(refresh_rollup(db.session), 0)
+
+            nearby = nearby_popular_places(db.session, 51.5010, -0.1240, 1000)
+            self.assertEqual([(result["place_name"], result["search_count"]) for result in nearby], [("London Eye", 2), ("Big Ben", 1)])
+
+            save_history(db.session, self.user_ids[0], [place("Big Ben", 51.5007, -0.1246), place("Big Ben", 51.5007, -0.1246)])
+            self.assertEqual(refresh_rollup(db.session), 2)
+            incremental = nearby_popular_places(db.session, 51.5010, -0.1240, 1000)
+            self.assertEqual(incremental[0]["place_name"], "Big Ben")
+            self.assertEqual(incremental[0]["search_count"], 3)
+
+            self.assertEqual(refresh_rollup(db.session, full=True), 6)
+            self.assertEqual(nearby_popular_places(db.session, 51.5010, -0.1240, 1000), incremental)
+            self.assertEqual(SearchHistory.query.filter(SearchHistory.latitude.isnot(None)).count(), 6)
+
+    def test_refresh_lag_leaves_recent_entries(self):
+        with app.app_context():
+            save_history(db.session, self.user_ids[0], [place("Big Ben", 51.5007, -0.1246), place("London Eye", 51.5033, -0.1196)])
+            self.assertEqual(refresh_rollup(db.session, lag=60), 0)
+
+            # entries saved before the lag are counted, and the newer entry is left for a later refresh rather than skipped
+            first_id = SearchHistory.query.order_by(SearchHistory.search_id).first().search_id
+            SearchHistory.query.filter(SearchHistory.search_id == first_id).update({"timestamp": datetime.utcnow() - timedelta(minutes=5)})
+            db.session.commit()
+            self.assertEqual(refresh_rollup(db.session, lag=60), 1)
+            SearchHistory.query.update({"timestamp": datetime.utcnow() - timedelta(minutes=5)})
+            db.session.commit()
+            self.assertEqual(refresh_rollup(db.session, lag=60), 1)
+            self.assertEqual(refresh_rollup(db.session, lag=60), 0)
+            self.assertEqual(len(nearby_popular_places(db.session, 51.5010, -0.1240, 1000)), 2)
+
+    def test_popular_nearby_endpoint(self):
+        client = app.test_client()
+        self.assertEqual(client.get("/api/popular/nearby?lat=51.5&lng=-0.12").status_code, 401)
+        with client.session_transaction() as session:
+            session["user_id"] = self.user_ids[0]
+        self.assertEqual(client.get("/api/popular/nearby?lat=north&lng=-0.12").status_code, 400)
+        self.assertEqual(client.get("/api/popular/nearby?lat=51.5&lng=-0.12&radius=0").status_code, 400)
+
+        with app.app_context():
+            save_history(db.session, self.user_ids[1], [place("Big Ben", 51.5007, -0.1246)])
+        response = client.get("/api/popular/nearby?lat=51.5010&lng=-0.1240&radius=500")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result["place_name"] for result in response.get_json()["results"]], ["Big Ben"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+from database import db, SearchHistory, PlaceRollup, RollupState, upsert, timestamp_bound  # models and query helpers from database.py
+from sqlalchemy import func, update
+from datetime import datetime, timedelta
+import geo  # grid cells and distances
+import settings  # cell size and refresh interval
+
+# name of the cross-property places rollup in the rollup_state table
+ROLLUP_NAME = "places"
+
+
+# function to add search_history entries saved since the last refresh to the cross-property rollup, returning the number of entries added
+# the processed range is claimed by moving rollup_state.last_search_id forward only if it still holds the value read, so two workers refreshing at once cannot count the same entries twice
+# with full set to True the rollup is emptied and rebuilt from the first entry; entries without coordinates (saved before they were recorded) are skipped
+# on PostgreSQL an id is taken when a row is inserted but seen only once its transaction commits, so a lower id than the newest can still appear later: only entries saved
+# more than lag seconds (settings.ROLLUP_LAG) ago are claimed, assuming no transaction saving history stays open that long; SQLite has one writer at a time, so its ids commit in order
+def refresh_rollup(db_session, full=False, batch_size=10000, lag=None):
+    # make sure the state row exists, then read how far the rollup has got
+    statement = upsert(db_session, RollupState.__table__).on_conflict_do_nothing(index_elements=["name"])
+    db_session.execute(statement, {"name": ROLLUP_NAME, "last_search_id": 0})
+    last_search_id = db_session.query(RollupState.last_search_id).filter(RollupState.name == ROLLUP_NAME).scalar()
+    start = 0 if full else last_search_id
+    if lag is None:
+        lag = 0 if db_session.get_bind().dialect.name == "sqlite" else settings.ROLLUP_LAG
+    newest = db_session.query(func.max(SearchHistory.search_id)).filter(SearchHistory.search_id > start)
+    if lag:
+        newest = newest.filter(SearchHistory.timestamp < timestamp_bound(db_session, datetime.utcnow() - timedelta(seconds=lag)))
+    newest_search_id = newest.scalar() or start
+
+    claimed = db_session.execute(update(RollupState).
+                                 where(RollupState.name == ROLLUP_NAME, RollupState.last_search_id == last_search_id).
+                                 values(last_search_id=newest_search_id, refreshed_at=datetime.utcnow()))
+    if claimed.rowcount == 0:
+        # another worker refreshed the rollup first
+        db_session.rollback()
+        return 0
+    if full:
+        db_session.query(PlaceRollup).delete()
+
+    # count the new entries per cell and place, keeping the most recent coordinates seen for each place
+    counts = {}
+    entries = db_session.query(SearchHistory.place_name, SearchHistory.address, SearchHistory.latitude, SearchHistory.longitude).\
+        filter(SearchHistory.search_id > start, SearchHistory.search_id <= newest_search_id, SearchHistory.latitude.isnot(None), SearchHistory.longitude.isnot(None)).\
+        order_by(SearchHistory.search_id).\
+        yield_per(batch_size)
+    for place_name, address, latitude, longitude in entries:
+        key = geo.cell_of(latitude, longitude, settings.ROLLUP_CELL_SIZE) + (place_name, address)
+        count = counts.get(key, (0, None, None))[0]
+        counts[key] = (count + 1, latitude, longitude)
+
+    if counts:
+        statement = upsert(db_session, PlaceRollup.__table__)
+        statement = statement.on_conflict_do_update(index_elements=["cell_row", "cell_column", "place_name", "address"],
+                                                    set_={"search_count": PlaceRollup.search_count + statement.excluded.search_count,
+                                                          "latitude": statement.excluded.latitude, "longitude": statement.excluded.longitude})
+        db_session.execute(statement, [{"cell_row": row, "cell_column": column, "place_name": place_name, "address": address, "latitude": latitude, "longitude": longitude, "search_count": count}
+                                       for (row, column, place_name, address), (count, latitude, longitude) in counts.items()])
+    db_session.commit()
+    return sum(count for count, latitude, longitude in counts.values())
+
+
+# function to refresh the rollup if it has not been refreshed within settings.ROLLUP_REFRESH_INTERVAL seconds, so reads keep it up to date without a scheduler
+def refresh_rollup_if_stale(db_session):
+    refreshed_at = db_session.query(RollupState.refreshed_at).filter(RollupState.name == ROLLUP_NAME).scalar()
+    if refreshed_at is None or datetime.utcnow() - refreshed_at >= timedelta(seconds=settings.ROLLUP_REFRESH_INTERVAL):
+        refresh_rollup(db_session)
+
+
+# function to obtain the most saved places across all users within radius metres of a point, most saved first and nearest first for equal counts
+# returns a list of dictionaries with the place name, address, coordinates, search count and distance in metres
+def nearby_popular_places(db_session, latitude, longitude, radius, limit=10):
+    # read the cells covering the circle, then keep the places inside it
+    first_row, last_row, first_column, last_column = geo.cell_range(latitude, longitude, radius, settings.ROLLUP_CELL_SIZE)
+    candidates = db_session.query(PlaceRollup.place_name, PlaceRollup.address, PlaceRollup.latitude, PlaceRollup.longitude, PlaceRollup.search_count).\
+        filter(PlaceRollup.cell_row.between(first_row, last_row), PlaceRollup.cell_column.between(first_column, last_column))
+
+    places = []
+    for place_name, address, place_latitude, place_longitude, search_count in candidates:
+        distance = geo.haversine(latitude, longitude, place_latitude, place_longitude)
+        if distance <= radius:
+            places.append({"place_name": place_name, "address": address, "latitude": place_latitude, "longitude": place_longitude,
+                           "search_count": search_count, "distance": round(distance)})
+    places.sort(key=lambda place: (-place["search_count"], place["distance"]))
+    return places[:limit]
+
+
+# function to obtain the cross-property search counts of places within radius metres of a point, keyed by (place name, address), as of the last rollup refresh
+# used to rank search results by popularity without refreshing the rollup during a search
+def popularity_counts(db_session, latitude, longitude, radius):
+    first_row, last_row, first_column, last_column = geo.cell_range(latitude, longitude, radius, settings.ROLLUP_CELL_SIZE)
+    counts = {}
+    for place_name, address, search_count in db_session.query(PlaceRollup.place_name, PlaceRollup.address, PlaceRollup.search_count).\
+            filter(PlaceRollup.cell_row.between(first_row, last_row), PlaceRollup.cell_column.between(first_column, last_column)):
+        counts[(place_name, address)] = counts.get((place_name, address), 0) + search_count
+    return counts
@@ -0,0 +1,181 @@
+import os  # for building file paths relative to the project
+import config  # contains API keys, and optionally overrides for any of the settings below
+
+# directory containing this file, used to locate the instance folder holding hotelhelper.db
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+# function to obtain a setting from the config file, falling back to a default value if config.py does not define it
+def get(name, default):
+    return getattr(config, name, default)
+
+
+# function to obtain the path of the file an SQLite database URI refers to (Flask-SQLAlchemy places a relative sqlite:/// path such as sqlite:///hotelhelper.db
+# in the instance folder), or None for in-memory SQLite and other databases
+def sqlite_path(uri):
+    prefix = "sqlite:///"
+    path = uri[len(prefix):].split("?")[0] if uri.startswith(prefix) else ""
+    if path in ("", ":memory:"):
+        return None
+    return os.path.join(BASE_DIR, "instance", path)
+
+
+# database: the SQLAlchemy URI (a relative sqlite:/// path is placed in the instance folder, and postgresql:// URIs are also supported),
+# the connections kept open per worker, the extra connections allowed under load, seconds to wait for a free connection, and seconds before a connection is replaced
+DATABASE_URI = get("DATABASE_URI", "sqlite:///hotelhelper.db")
+DATABASE_POOL_SIZE = get("DATABASE_POOL_SIZE", 10)
+DATABASE_MAX_OVERFLOW = get("DATABASE_MAX_OVERFLOW", 10)
+DATABASE_POOL_TIMEOUT = get("DATABASE_POOL_TIMEOUT", 30)
+DATABASE_POOL_RECYCLE = get("DATABASE_POOL_RECYCLE", 1800)
+
+# SQLite pragmas set on every new connection: write-ahead logging so reads do not block on writes, fewer fsyncs (safe with WAL), milliseconds to wait for a lock
+# rather than failing with "database is locked", bytes of the file read through memory mapping, and the page cache size (negative values are in KiB)
+SQLITE_PRAGMAS = get("SQLITE_PRAGMAS", {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -16000,
+})
+
+# read routing for history pages and exports: whether their queries use a separate read-only engine, the URI of that engine (such as a PostgreSQL replica;
+# None opens the SQLite database file read-only, and reads from other databases stay on the primary), and whether a user's history is read from the
+# primary while the read engine has not yet caught up with their latest search (read-your-own-writes)
+DATABASE_READ_ROUTING = get("DATABASE_READ_ROUTING", True)
+DATABASE_READ_URI = get("DATABASE_READ_URI", None)
+DATABASE_READ_YOUR_WRITES = get("DATABASE_READ_YOUR_WRITES", True)
+
+# geocode cache: seconds a found location is kept, seconds a "location not found" result is kept, maximum number of cached queries, and the SQLite file backing the cache
+# (None keeps the cache in memory only); by default the cache shares the app's SQLite database file, and is kept in memory when the app uses another database such as PostgreSQL
+GEOCODE_CACHE_TTL = get("GEOCODE_CACHE_TTL", 30 * 24 * 60 * 60)
+GEOCODE_CACHE_NEGATIVE_TTL = get("GEOCODE_CACHE_NEGATIVE_TTL", 60 * 60)
+GEOCODE_CACHE_SIZE = get("GEOCODE_CACHE_SIZE", 2048)
+GEOCODE_CACHE_PATH = get("GEOCODE_CACHE_PATH", sqlite_path(DATABASE_URI))
+
+# FourSquare results cache: seconds results are served as fresh, further seconds stale results are served while being refreshed in the background, size in degrees of the grid cells nearby searches share, and maximum number of cached searches
+PLACES_CACHE_MAX_AGE = get("PLACES_CACHE_MAX_AGE", 6 * 60 * 60)
+PLACES_CACHE_STALE_TTL = get("PLACES_CACHE_STALE_TTL", 24 * 60 * 60)
+PLACES_CACHE_CELL_SIZE = get("PLACES_CACHE_CELL_SIZE", 0.0025)
+PLACES_CACHE_SIZE = get("PLACES_CACHE_SIZE", 1024)
+
+# upstream API requests: connect and read timeouts in seconds, connections kept alive per host, retries after a failed request with the base and maximum backoff in seconds,
+# and the consecutive failures that open an API's circuit breaker along with the seconds before a trial request is let through
+UPSTREAM_CONNECT_TIMEOUT = get("UPSTREAM_CONNECT_TIMEOUT", 3.05)
+UPSTREAM_READ_TIMEOUT = get("UPSTREAM_READ_TIMEOUT", 10)
+UPSTREAM_POOL_SIZE = get("UPSTREAM_POOL_SIZE", 10)
+UPSTREAM_RETRIES = get("UPSTREAM_RETRIES", 2)
+UPSTREAM_BACKOFF_BASE = get("UPSTREAM_BACKOFF_BASE", 0.25)
+UPSTREAM_BACKOFF_MAX = get("UPSTREAM_BACKOFF_MAX", 2)
+UPSTREAM_BREAKER_THRESHOLD = get("UPSTREAM_BREAKER_THRESHOLD", 5)
+UPSTREAM_BREAKER_RESET = get("UPSTREAM_BREAKER_RESET", 30)
+
+# batch search API: maximum queries per request, upstream calls running at once for a batch, and the radius in metres used when an item does not give one
+BATCH_MAX_ITEMS = get("BATCH_MAX_ITEMS", 200)
+BATCH_CONCURRENCY = get("BATCH_CONCURRENCY", 8)
+BATCH_DEFAULT_RADIUS = get("BATCH_DEFAULT_RADIUS", 1000)
+
+# search history: seconds within which a place the user has already saved is not saved again (0 saves every result)
+HISTORY_DEDUPE_WINDOW = get("HISTORY_DEDUPE_WINDOW", 0)
+
+# search history write-behind queue: whether history is written on a background thread, the maximum queued searches, the searches written per commit,
+# the seconds a partial batch waits before being written, and what happens when the queue is full ("block" waits, "drop" discards, "sync" writes during the request)
+HISTORY_WRITE_BEHIND = get("HISTORY_WRITE_BEHIND", False)
+HISTORY_QUEUE_SIZE = get("HISTORY_QUEUE_SIZE", 1000)
+HISTORY_BATCH_SIZE = get("HISTORY_BATCH_SIZE", 50)
+HISTORY_FLUSH_INTERVAL = get("HISTORY_FLUSH_INTERVAL", 0.5)
+HISTORY_BACKPRESSURE = get("HISTORY_BACKPRESSURE", "sync")
+
+# search history pages: entries shown per page, and seconds a user's cached entry count is reused for page numbers
+HISTORY_PAGE_SIZE = get("HISTORY_PAGE_SIZE", 20)
+HISTORY_COUNT_TTL = get("HISTORY_COUNT_TTL", 60)
+
+# popularity rankings: days of daily buckets kept for windowed and time-decayed rankings, and the half-life in days of the decayed ranking
+POPULARITY_DAILY_RETENTION = get("POPULARITY_DAILY_RETENTION", 30)
+POPULARITY_HALF_LIFE = get("POPULARITY_HALF_LIFE", 7)
+
+# cross-property popular places: size in degrees of the grid cells places are rolled up into, seconds before the rollup is refreshed when it is read,
+# seconds a history entry must be saved for before a refresh on PostgreSQL counts it (longer than any transaction saving history stays open),
+# and the default and maximum radius in metres of a nearby popular places query
+ROLLUP_CELL_SIZE = get("ROLLUP_CELL_SIZE", 0.01)
+ROLLUP_REFRESH_INTERVAL = get("ROLLUP_REFRESH_INTERVAL", 300)
+ROLLUP_LAG = get("ROLLUP_LAG", 60)
+ROLLUP_DEFAULT_RADIUS = get("ROLLUP_DEFAULT_RADIUS", 1000)
+ROLLUP_MAX_RADIUS = get("ROLLUP_MAX_RADIUS", 50000)
+
+# offline fallback: whether places already saved to search history are shown when FourSquare cannot be reached, and the most places shown
+OFFLINE_FALLBACK = get("OFFLINE_FALLBACK", True)
+OFFLINE_FALLBACK_LIMIT = get("OFFLINE_FALLBACK_LIMIT", 50)
+
+# local place store: whether searches are answered from it when a past FourSquare search covers the area, the size in degrees of its grid cells,
+# the seconds a past search counts as covering its area, and the results FourSquare returns per search (a search returning this many only covers up to its farthest result)
+PLACES_LOCAL_FIRST = get("PLACES_LOCAL_FIRST", True)
+PLACES_CELL_SIZE = get("PLACES_CELL_SIZE", 0.01)
+PLACES_COVERAGE_MAX_AGE = get("PLACES_COVERAGE_MAX_AGE", 7 * 24 * 60 * 60)
+PLACES_PAGE_SIZE = get("PLACES_PAGE_SIZE", 10)
+
+# result ranking: whether search results are re-ranked rather than left in FourSquare's distance order, the weights of the distance, category match and
+# popularity parts of the score, and the most extra origins (such as a conference venue as well as the hotel) a search can rank distances to
+RANKING_ENABLED = get("RANKING_ENABLED", True)
+RANKING_WEIGHTS = get("RANKING_WEIGHTS", {"distance": 0.6, "category": 0.2, "popularity": 0.2})
+RANKING_MAX_ORIGINS = get("RANKING_MAX_ORIGINS", 5)
+
+# search form: the FourSquare categories (name and ID) shown as checkboxes and the radius choices in metres shown as radio buttons,
+# compiled once into HTML fragments when utils.py is loaded, and the seconds browsers may reuse the options JSON and the search page without revalidating
+SEARCH_OPTIONS = get("SEARCH_OPTIONS", {
+    "categories": [
+        {"name": "Arts and Entertainment", "id": 10000},
+        {"name": "Community", "id": 12000},
+        {"name": "Dining and Drinking", "id": 13000},
+        {"name": "Events", "id": 14000},
+        {"name": "Landmarks and Outdoors", "id": 16000},
+        {"name": "Retail", "id": 17000},
+        {"name": "Sports", "id": 18000},
+        {"name": "Travel and Transportation", "id": 19000},
+    ],
+    "radii": [500, 1000, 2500, 5000, 10000],
+})
+SEARCH_OPTIONS_MAX_AGE = get("SEARCH_OPTIONS_MAX_AGE", 3600)
+SEARCH_PAGE_MAX_AGE = get("SEARCH_PAGE_MAX_AGE", 300)
+
+# history pages: the most rendered history, popular searches and keyword search pages kept in memory
+PAGE_CACHE_SIZE = get("PAGE_CACHE_SIZE", 256)
+
+# response compression: gzip level (and brotli quality, when the brotli package is installed), the smallest response in bytes worth compressing, and the content types compressed
+COMPRESSION_LEVEL = get("COMPRESSION_LEVEL", 6)
+COMPRESSION_MIN_SIZE = get("COMPRESSION_MIN_SIZE", 500)
+COMPRESSION_MIMETYPES = get("COMPRESSION_MIMETYPES", ["application/json", "text/html"])
+
+# seconds browsers may cache static files requested with their current content hash
+STATIC_MAX_AGE = get("STATIC_MAX_AGE", 365 * 24 * 60 * 60)
+
+# history export: the entries fetched from the database, and written to the response, at a time
+EXPORT_BATCH_SIZE = get("EXPORT_BATCH_SIZE", 1000)
+
+# passwords: the bcrypt cost (log2 of its iterations; hashes made with another cost are rehashed at the next login), the worker processes running bcrypt off the
+# request threads (0 runs it on the request thread), and the most password hashes or checks queued or running at once before logins are turned away with 503
+BCRYPT_ROUNDS = get("BCRYPT_ROUNDS", 12)
+PASSWORD_WORKERS = get("PASSWORD_WORKERS", 2)
+PASSWORD_MAX_PENDING = get("PASSWORD_MAX_PENDING", 16)
+
+# rate limiting: whether it is applied, the Redis URL buckets are shared through between app processes (None keeps them in each process),
+# the most buckets kept in process, and each limit as (requests, per seconds) - logins per client IP, failed logins per username, registrations per client IP,
+# searches per client IP on /search and /search/async, and queries per client IP on the batch search API - all checked before any bcrypt or upstream work
+RATE_LIMIT_ENABLED = get("RATE_LIMIT_ENABLED", True)
+RATE_LIMIT_REDIS_URL = get("RATE_LIMIT_REDIS_URL", None)
+RATE_LIMIT_MAX_KEYS = get("RATE_LIMIT_MAX_KEYS", 10000)
+RATE_LIMITS = get("RATE_LIMITS", {
+    "login_ip": (20, 60),
+    "login_username": (5, 300),
+    "register_ip": (10, 3600),
+    "search_ip": (60, 60),
+    "batch_ip": (400, 60),
+})
+
+# upstream API quotas: the calls each API key may make per day (reset at midnight UTC) and per second, the fraction of the daily budget kept for searches
+# rather than background refreshes of stale cached results, and the seconds a call waits for a per-second slot before it is refused
+UPSTREAM_QUOTAS = get("UPSTREAM_QUOTAS", {
+    "opencage": {"daily": 2500, "per_second": 1},
+    "foursquare": {"daily": 10000, "per_second": 50},
+})
+UPSTREAM_QUOTA_RESERVE = get("UPSTREAM_QUOTA_RESERVE", 0.1)
+UPSTREAM_QUOTA_MAX_WAIT = get("UPSTREAM_QUOTA_MAX_WAIT", 1.0)
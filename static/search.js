@@ -61,7 +61,7 @@ document.getElementById("search-form").addEventListener('submit', async function
                 data.results.forEach(result => {
                     // create a custom marker icon using a png file
                     const customIcon = L.icon({
-                        iconUrl: '/static/images/marker.png',
+                        iconUrl: form.dataset.markerUrl,
                         iconSize: [25, 41],
                         iconAnchor: [12, 41],
                         popupAnchor: [1, -34],
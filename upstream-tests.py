@@ -0,0 +1,209 @@
+from upstream import CircuitBreaker, CircuitOpenError, QuotaAccountant, QuotaExhaustedError, SingleFlight
+from unittest.mock import Mock, patch
+import threading
+import asyncio
+import unittest
+import requests
+import settings
+import upstream
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.breaker = CircuitBreaker(threshold=2, reset_timeout=30, clock=lambda: self.now)
+
+    def test_opens_after_threshold(self):
+        self.breaker.record_failure()
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state(), "open")
+        self.assertFalse(self.breaker.allow())
+
+    def test_half_open_trial(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.now += 31
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state(), "open")
+        self.now += 31
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state(), "closed")
+
+
+class TestUpstreamGet(unittest.TestCase):
+    def setUp(self):
+        self.session = Mock()
+        self.patches = [patch.dict(upstream.sessions, {"api.test": self.session}),
+                        patch.dict(upstream.breakers, {"api.test": CircuitBreaker(threshold=1, reset_timeout=30)}),
+                        patch.object(upstream.time, "sleep")]
+        for patcher in self.patches:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patches:
+            patcher.stop()
+
+    def test_timeout_and_success(self):
+        self.session.get.return_value = Mock(status_code=200)
+        response = upstream.get("https://api.test/search", params={"q": "London"})
+        self.assertEqual(response.status_code, 200)
+        timeout = self.session.get.call_args[1]["timeout"]
+        self.assertEqual(timeout, (settings.UPSTREAM_CONNECT_TIMEOUT, settings.UPSTREAM_READ_TIMEOUT))
+
+    def test_retries_server_errors(self):
+        self.session.get.side_effect = [Mock(status_code=503, headers={}), Mock(status_code=200)]
+        response = upstream.get("https://api.test/search")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.session.get.call_count, 2)
+
+    def test_circuit_opens_on_connection_failures(self):
+        self.session.get.side_effect = requests.exceptions.ConnectionError()
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            upstream.get("https://api.test/search")
+        self.assertEqual(self.session.get.call_count, settings.UPSTREAM_RETRIES + 1)
+        with self.assertRaises(CircuitOpenError):
+            upstream.get("https://api.test/search")
+        self.assertEqual(self.session.get.call_count, settings.UPSTREAM_RETRIES + 1)
+
+    def test_retries_are_counted_against_quota(self):
+        quotas = QuotaAccountant({"api": {"daily": 2}})
+        self.session.get.side_effect = [Mock(status_code=503, headers={}), Mock(status_code=200, headers={})]
+        with patch.object(upstream, "quotas", quotas):
+            self.assertEqual(upstream.get("https://api.test/search", quota=("api", "key")).status_code, 200)
+            self.assertEqual(quotas.remaining("api", "key")["used"], 2)
+            # a refused call is not sent, and leaves the circuit breaker as it was
+            with self.assertRaises(QuotaExhaustedError):
+                upstream.get("https://api.test/search", quota=("api", "key"))
+        self.assertEqual(self.session.get.call_count, 2)
+        self.assertEqual(upstream.breakers["api.test"].state(), "closed")
+
+    def test_other_errors_end_trial_request(self):
+        breaker = upstream.breakers["api.test"]
+        breaker.record_failure()
+        breaker.opened_at -= 31
+        self.session.get.side_effect = requests.exceptions.ChunkedEncodingError()
+        with self.assertRaises(requests.exceptions.ChunkedEncodingError):
+            upstream.get("https://api.test/search")
+        self.assertEqual(self.session.get.call_count, 1)
+        # the failed trial reopens the circuit rather than leaving it half-open, so another trial follows the reset timeout
+        self.assertEqual(breaker.state(), "open")
+        breaker.opened_at -= 31
+        self.session.get.side_effect = None
+        self.session.get.return_value = Mock(status_code=200)
+        self.assertEqual(upstream.get("https://api.test/search").status_code, 200)
+        self.assertEqual(breaker.state(), "closed")
+
+    def test_cancelled_async_trial_request(self):
+        breaker = upstream.breakers["api.test"]
+        breaker.record_failure()
+        breaker.opened_at -= 31
+        client = Mock()
+        client.get = Mock(side_effect=asyncio.CancelledError())
+        with self.assertRaises(asyncio.CancelledError):
+            asyncio.run(upstream.get_async(client, "https://api.test/search"))
+        self.assertEqual(breaker.state(), "open")
+
+
+class TestQuotaAccountant(unittest.TestCase):
+    def setUp(self):
+        # midday UTC, so a day's calls do not cross midnight
+        self.now = 86400 * 20000 + 43200.0
+        self.quotas = QuotaAccountant({"opencage": {"daily": 10, "per_second": 2}}, reserve=0.2, max_wait=1.0, clock=lambda: self.now)
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+    def test_daily_budget_and_reserve(self):
+        for _ in range(8):
+            self.quotas.acquire("opencage", "key", background=self.now % 2 == 0)
+            self.now += 1
+        # the last 20% of the budget is kept for calls that have no stale result to fall back on
+        with self.assertRaises(QuotaExhaustedError):
+            self.quotas.acquire("opencage", "key", background=True)
+        self.quotas.acquire("opencage", "key")
+        self.quotas.acquire("opencage", "key")
+        with self.assertRaises(QuotaExhaustedError):
+            self.quotas.acquire("opencage", "key")
+        self.assertEqual(self.quotas.remaining("opencage", "key"), {"daily": 10, "used": 10, "remaining": 0, "per_second": 2, "refused": 2})
+        # another key has its own budget, APIs without a quota are not limited, and the budget resets at midnight UTC
+        self.quotas.acquire("opencage", "other key")
+        self.quotas.acquire("foursquare", "key")
+        self.now += 43200
+        self.quotas.acquire("opencage", "key")
+        self.assertEqual(self.quotas.remaining("opencage", "key")["used"], 1)
+        self.assertEqual(set(self.quotas.stats()), {"opencage:" + QuotaAccountant.fingerprint("key"), "opencage:" + QuotaAccountant.fingerprint("other key")})
+
+    def test_per_second_limit_waits_then_refuses(self):
+        with patch.object(upstream.time, "sleep", side_effect=self.sleep) as sleep:
+            self.quotas.acquire("opencage", "key")
+            self.quotas.acquire("opencage", "key")
+            # the third call in the second waits for the next one
+            self.quotas.acquire("opencage", "key")
+            self.assertEqual(sleep.call_count, 1)
+            self.assertEqual(self.now, 86400 * 20000 + 43201.0)
+            self.quotas.acquire("opencage", "key")
+            with self.assertRaises(QuotaExhaustedError):
+                self.quotas.acquire("opencage", "key", background=True)
+            self.quotas.max_wait = 0.5
+            with self.assertRaises(QuotaExhaustedError):
+                self.quotas.acquire("opencage", "key")
+
+    def test_observe_rate_limit_header(self):
+        self.quotas.acquire("opencage", "key")
+        self.quotas.observe("opencage", "key", Mock(headers={"X-RateLimit-Remaining": "3"}))
+        self.assertEqual(self.quotas.remaining("opencage", "key")["remaining"], 3)
+        self.quotas.observe("opencage", "key", Mock(headers={}))
+        self.assertEqual(self.quotas.remaining("opencage", "key")["used"], 7)
+
+
+class TestSingleFlight(unittest.TestCase):
+    def test_concurrent_callers_share_one_call(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        function = Mock(side_effect=lambda: release.wait(5) and "Paris")
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(flight.do("paris", function))) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        while flight.stats()["coalesced"] < 9:
+            release.wait(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ["Paris"] * 10)
+        self.assertEqual(function.call_count, 1)
+        self.assertEqual(flight.stats(), {"calls": 1, "coalesced": 9, "in_flight": 0})
+        # a finished call is not reused
+        self.assertEqual(flight.do("paris", lambda: "Paris again"), "Paris again")
+
+    def test_errors_and_async_callers(self):
+        flight = SingleFlight()
+        started, release = threading.Event(), threading.Event()
+
+        def fail():
+            started.set()
+            release.wait(5)
+            raise CircuitOpenError("api.test is temporarily unavailable")
+        leader = threading.Thread(target=lambda: self.assertRaises(CircuitOpenError, flight.do, "paris", fail))
+        leader.start()
+        started.wait(5)
+
+        # a coroutine on another thread's event loop waits for the thread's call and receives its error
+        async def follow():
+            waiting = asyncio.ensure_future(flight.do_async("paris", Mock(side_effect=AssertionError)))
+            await asyncio.sleep(0)
+            release.set()
+            return await waiting
+        with self.assertRaises(CircuitOpenError):
+            asyncio.run(follow())
+        leader.join()
+        self.assertEqual(asyncio.run(flight.do_async("london", lambda: asyncio.sleep(0, "London"))), "London")
+        self.assertEqual(flight.stats(), {"calls": 2, "coalesced": 1, "in_flight": 0})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,370 @@
+from urllib.parse import urlsplit  # for obtaining the host of a request URL
+from requests.adapters import HTTPAdapter  # connection pool attached to each session
+from concurrent.futures import Future  # result of an in-flight call, awaited by concurrent callers in threads or event loops
+import hashlib  # fingerprints of API keys, so quota reports do not show the keys
+import requests  # for API requests
+import httpx  # non-blocking HTTP client used by the async search endpoint
+import asyncio  # for non-blocking backoff sleeps
+import random  # jitter for retry backoff
+import threading  # lock guarding the shared sessions and circuit breakers
+import time  # for backoff sleeps and circuit breaker timing
+import settings  # timeouts, retry and circuit breaker settings
+
+# status codes worth retrying: rate limiting and temporary server failures
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+# error raised without contacting the API while its circuit breaker is open
+class CircuitOpenError(requests.exceptions.RequestException):
+    pass
+
+
+# error raised without contacting the API when its key's daily quota is used up, or its per-second limit is reached and a slot does not free up in time
+class QuotaExhaustedError(requests.exceptions.RequestException):
+    pass
+
+
+# circuit breaker for one API host: after enough consecutive failures the circuit opens and requests fail fast,
+# until reset_timeout seconds have passed and a single trial request is let through to test whether the API has recovered
+class CircuitBreaker:
+    def __init__(self, threshold=settings.UPSTREAM_BREAKER_THRESHOLD, reset_timeout=settings.UPSTREAM_BREAKER_RESET, clock=time.monotonic):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    # function to check whether a request may be sent, letting one trial request through once the reset timeout has passed
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if not self.trial_running and self.clock() - self.opened_at >= self.reset_timeout:
+                self.trial_running = True
+                return True
+            return False
+
+    # function to close the circuit after a successful request
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    # function to give up a trial request that was never sent, such as one refused by the API key's quota, so that a later request can be the trial
+    def cancel_trial(self):
+        with self.lock:
+            self.trial_running = False
+
+    # function to count a failed request, opening the circuit once the threshold is reached or when a trial request fails
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial_running or self.failures >= self.threshold:
+                self.opened_at = self.clock()
+            self.trial_running = False
+
+    # function to report the circuit state: closed, open or half-open
+    def state(self):
+        with self.lock:
+            if self.opened_at is None:
+                return "closed"
+            return "half-open" if self.trial_running else "open"
+
+
+# quota accountant tracking the calls made with each API key against the daily and per-second limits in settings.UPSTREAM_QUOTAS, keyed by API name ("opencage", "foursquare")
+# calls are refused with QuotaExhaustedError once the day's budget (which resets at midnight UTC) is used up; background calls, such as refreshes of stale cached results
+# that can keep being served, are refused once usage reaches the last settings.UPSTREAM_QUOTA_RESERVE of the budget, keeping it for searches with nothing to serve
+# a call over the per-second limit waits for the next second, up to settings.UPSTREAM_QUOTA_MAX_WAIT seconds in all, or is refused at once if it is a background call
+class QuotaAccountant:
+    def __init__(self, quotas=settings.UPSTREAM_QUOTAS, reserve=settings.UPSTREAM_QUOTA_RESERVE, max_wait=settings.UPSTREAM_QUOTA_MAX_WAIT, clock=time.time):
+        self.quotas = quotas
+        self.reserve = reserve
+        self.max_wait = max_wait
+        self.clock = clock
+        self.usage = {}
+        self.lock = threading.Lock()
+
+    # function to obtain a short fingerprint of an API key, identifying it in reports without revealing it
+    @staticmethod
+    def fingerprint(key):
+        return hashlib.sha256(str(key).encode("utf-8")).hexdigest()[:8]
+
+    # function to take one call from an API key's quota, waiting for a per-second slot if needed, or raising QuotaExhaustedError
+    def acquire(self, api, key, background=False):
+        waited = 0
+        while True:
+            wait = self._try_acquire(api, key, background, waited)
+            if not wait:
+                return
+            time.sleep(wait)
+            waited += wait
+
+    # function to take one call from an API key's quota without blocking the event loop, for the async search path
+    async def acquire_async(self, api, key, background=False):
+        waited = 0
+        while True:
+            wait = self._try_acquire(api, key, background, waited)
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+            waited += wait
+
+    # function to correct the calls counted for today from an API's X-RateLimit-Remaining response header (sent by OpenCage), which includes calls made by other processes
+    def observe(self, api, key, response):
+        daily = self.quotas.get(api, {}).get("daily")
+        try:
+            remaining = int(response.headers.get("X-RateLimit-Remaining"))
+        except (TypeError, ValueError):
+            return
+        if daily is not None:
+            with self.lock:
+                usage = self._usage(api, key, self.clock())
+                usage["used"] = max(usage["used"], daily - remaining)
+
+    # function to report the remaining budget of an API key: the daily limit, calls used and remaining today, the per-second limit and the calls refused
+    def remaining(self, api, key):
+        limits = self.quotas.get(api, {})
+        with self.lock:
+            usage = self._usage(api, key, self.clock())
+            daily = limits.get("daily")
+            return {"daily": daily, "used": usage["used"], "remaining": None if daily is None else max(0, daily - usage["used"]),
+                    "per_second": limits.get("per_second"), "refused": usage["refused"]}
+
+    # function to report the remaining budget of every API key used so far, keyed by API name and key fingerprint
+    def stats(self):
+        with self.lock:
+            keys = [(api, usage["key"]) for (api, _), usage in self.usage.items()]
+        return {f"{api}:{self.fingerprint(key)}": self.remaining(api, key) for api, key in keys}
+
+    # function to obtain the usage counters of an API key, starting new counts for a new day or second
+    def _usage(self, api, key, now):
+        usage = self.usage.setdefault((api, self.fingerprint(key)), {"key": key, "day": None, "used": 0, "second": None, "in_second": 0, "refused": 0})
+        day = time.strftime("%Y-%m-%d", time.gmtime(now))
+        if usage["day"] != day:
+            usage.update(day=day, used=0)
+        if usage["second"] != int(now):
+            usage.update(second=int(now), in_second=0)
+        return usage
+
+    # function to count a call if the quota allows it, returning 0, or the seconds until the next per-second slot, or raising QuotaExhaustedError
+    def _try_acquire(self, api, key, background, waited):
+        limits = self.quotas.get(api)
+        if not limits:
+            return 0
+        now = self.clock()
+        with self.lock:
+            usage = self._usage(api, key, now)
+            daily = limits.get("daily")
+            if daily is not None and daily - usage["used"] <= (daily * self.reserve if background else 0):
+                usage["refused"] += 1
+                raise QuotaExhaustedError(f"{api} daily quota used up")
+            per_second = limits.get("per_second")
+            if per_second is not None and usage["in_second"] >= per_second:
+                wait = usage["second"] + 1 - now
+                if background or waited + wait > self.max_wait:
+                    usage["refused"] += 1
+                    raise QuotaExhaustedError(f"{api} per-second limit reached")
+                return wait
+            usage["used"] += 1
+            usage["in_second"] += 1
+            return 0
+
+
+# single-flight coalescing of upstream calls: while a call for a key is in flight, callers with the same key wait for its result (or its error) rather than
+# making the same call again; callers can be threads (do) or coroutines on any event loop (do_async), sharing calls with each other
+class SingleFlight:
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.counters = {"calls": 0, "coalesced": 0}
+
+    # function to call function for a key, or wait for the result of the call already in flight for the key
+    def do(self, key, function):
+        future, leader = self._join(key)
+        if not leader:
+            return future.result()
+        try:
+            result = function()
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result)
+        return result
+
+    # function to await a coroutine function for a key, or the result of the call already in flight for the key
+    async def do_async(self, key, function):
+        future, leader = self._join(key)
+        if not leader:
+            return await asyncio.wrap_future(future)
+        try:
+            result = await function()
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result)
+        return result
+
+    # function to report the calls made and the callers that shared another's call
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, in_flight=len(self.calls))
+
+    # function to obtain the future of the call in flight for a key, or register a new one, returning it and whether the caller should make the call
+    def _join(self, key):
+        with self.lock:
+            future = self.calls.get(key)
+            if future is not None:
+                self.counters["coalesced"] += 1
+                return future, False
+            future = self.calls[key] = Future()
+            self.counters["calls"] += 1
+            return future, True
+
+    # function to remove a finished call, so later callers make a new one, and pass its result or error to the callers waiting for it
+    def _finish(self, key, future, result=None, error=None):
+        with self.lock:
+            self.calls.pop(key, None)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+
+# quota accountant and in-flight calls shared by the synchronous and async search paths
+quotas = QuotaAccountant()
+calls = SingleFlight()
+
+# pooled sessions and circuit breakers, one of each per API host
+sessions = {}
+breakers = {}
+lock = threading.Lock()
+
+
+# function to obtain the shared session for a host, creating it with a keep-alive connection pool on first use
+def get_session(host):
+    with lock:
+        if host not in sessions:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.UPSTREAM_POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            sessions[host] = session
+        return sessions[host]
+
+
+# function to obtain the circuit breaker for a host
+def get_breaker(host):
+    with lock:
+        if host not in breakers:
+            breakers[host] = CircuitBreaker()
+        return breakers[host]
+
+
+# function to calculate the delay before a retry, using full jitter on an exponential backoff and honouring a short Retry-After header
+def backoff_delay(attempt, response=None):
+    delay = random.uniform(0, min(settings.UPSTREAM_BACKOFF_MAX, settings.UPSTREAM_BACKOFF_BASE * 2 ** attempt))
+    if response is not None:
+        try:
+            delay = max(delay, min(float(response.headers.get("Retry-After", 0)), settings.UPSTREAM_BACKOFF_MAX))
+        except ValueError:
+            pass
+    return delay
+
+
+# function to send a GET request to an API through its pooled session, with connect and read timeouts, bounded retries on
+# connection failures, timeouts, 429 and 5xx responses, and a circuit breaker that raises CircuitOpenError while the API is down
+# quota is an optional (API name, API key) pair: every attempt, including each retry, is counted against the key's quota and may raise QuotaExhaustedError
+# (background as for QuotaAccountant.acquire), and each response's rate limit header is observed
+def get(url, params=None, headers=None, quota=None, background=False):
+    host = urlsplit(url).netloc
+    session = get_session(host)
+    breaker = get_breaker(host)
+
+    if not breaker.allow():
+        raise CircuitOpenError(f"{host} is temporarily unavailable")
+
+    attempts = settings.UPSTREAM_RETRIES + 1
+    for attempt in range(attempts):
+        if quota is not None:
+            try:
+                quotas.acquire(*quota, background)
+            except BaseException:
+                # the request was not sent, so it is not counted against the API
+                breaker.cancel_trial()
+                raise
+        try:
+            response = session.get(url, params=params, headers=headers, timeout=(settings.UPSTREAM_CONNECT_TIMEOUT, settings.UPSTREAM_READ_TIMEOUT))
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            # re-raise the error once retries are used up, counting it against the circuit breaker
+            if attempt == attempts - 1:
+                breaker.record_failure()
+                raise
+            time.sleep(backoff_delay(attempt))
+            continue
+        except BaseException:
+            # any other error, such as a broken chunked response or too many redirects, still counts as a failure, so a trial request cannot leave the circuit half-open
+            breaker.record_failure()
+            raise
+        if quota is not None:
+            quotas.observe(*quota, response)
+
+        if response.status_code not in RETRY_STATUS_CODES:
+            breaker.record_success()
+            return response
+
+        # return the final rate limited or failed response once retries are used up, so callers can report the API's error message
+        if attempt == attempts - 1:
+            breaker.record_failure()
+            return response
+        time.sleep(backoff_delay(attempt, response))
+
+
+# function to create a non-blocking HTTP client with the same timeouts and connection limits as the pooled sessions
+def create_async_client():
+    timeout = httpx.Timeout(settings.UPSTREAM_READ_TIMEOUT, connect=settings.UPSTREAM_CONNECT_TIMEOUT)
+    return httpx.AsyncClient(timeout=timeout, limits=httpx.Limits(max_connections=settings.UPSTREAM_POOL_SIZE))
+
+
+# function to send a non-blocking GET request with an httpx client, sharing the retry policy and per-host circuit breakers of get()
+# every attempt is counted against the quota, waiting for a per-second slot without blocking the event loop
+async def get_async(client, url, params=None, headers=None, quota=None, background=False):
+    host = urlsplit(url).netloc
+    breaker = get_breaker(host)
+
+    if not breaker.allow():
+        raise CircuitOpenError(f"{host} is temporarily unavailable")
+
+    attempts = settings.UPSTREAM_RETRIES + 1
+    for attempt in range(attempts):
+        if quota is not None:
+            try:
+                await quotas.acquire_async(*quota, background)
+            except BaseException:
+                breaker.cancel_trial()
+                raise
+        try:
+            response = await client.get(url, params=params, headers=headers)
+        except httpx.TransportError:
+            if attempt == attempts - 1:
+                breaker.record_failure()
+                raise
+            await asyncio.sleep(backoff_delay(attempt))
+            continue
+        except BaseException:
+            # including cancellation of the search, which would otherwise leave a trial request running forever
+            breaker.record_failure()
+            raise
+        if quota is not None:
+            quotas.observe(*quota, response)
+
+        if response.status_code not in RETRY_STATUS_CODES:
+            breaker.record_success()
+            return response
+
+        if attempt == attempts - 1:
+            breaker.record_failure()
+            return response
+        await asyncio.sleep(backoff_delay(attempt, response))
@@ -1,5 +1,8 @@
-from utils import enter_query, generate_checkboxes, generate_radio_buttons, get_coordinates, get_destinations, requests
-from unittest.mock import Mock
+from utils import enter_query, generate_checkboxes, generate_radio_buttons, get_coordinates, get_destinations, upstream
+import requests
+import threading
+import utils
+from unittest.mock import Mock, patch
 import unittest
 
 
@@ -40,7 +43,7 @@ class TestUtils(unittest.TestCase):
             "results": [{"geometry": {"lat": 1.0, "lng": 2.0}}]
         }
 
-        requests.get = Mock(return_value=mock_response)
+        upstream.get = Mock(return_value=mock_response)
 
         lat, lng, error = get_coordinates("test")
         self.assertEqual(lat, 1.0)
@@ -60,11 +63,68 @@ class TestUtils(unittest.TestCase):
         }
         mock_response.status_code = 200
 
-        requests.get = Mock(return_value=mock_response)
+        upstream.get = Mock(return_value=mock_response)
 
         destinations = get_destinations(1.0, 2.0, "", 1000, None, None)
         self.assertEqual(len(destinations), 1)
 
+    def test_get_destinations_offline_fallback(self):
+        upstream.get = Mock(side_effect=requests.exceptions.ConnectionError())
+        saved = [{"name": "Eiffel Tower", "location": {"formatted_address": "Champ de Mars, 75007 Paris, France"}, "geocodes": {"main": {"latitude": 48.8584, "longitude": 2.2945}}}]
+        session = Mock()
+        with patch.object(utils.places, "find_local_places", return_value=[]), patch.object(utils, "find_saved_places", return_value=saved) as find_saved_places:
+            destinations = get_destinations(48.8580, 2.2950, "16000", 1000, 1, session)
+            find_saved_places.assert_called_once_with(session, 48.8580, 2.2950, 1000, "16000", utils.settings.OFFLINE_FALLBACK_LIMIT)
+        self.assertEqual(destinations[0]["name"], "Eiffel Tower")
+        self.assertTrue(destinations[0]["offline"])
+        with patch.object(utils.places, "find_local_places", return_value=[]), patch.object(utils, "find_saved_places", return_value=[]):
+            self.assertEqual(get_destinations(48.8581, 2.2950, "16000", 1000, 1, session), "Error: connection failure - check your internet connection")
+
+    def test_get_coordinates_coalesces_concurrent_searches(self):
+        release = threading.Event()
+        mock_response = Mock(headers={"X-RateLimit-Remaining": "2000"})
+        mock_response.json.return_value = {"status": {"code": 200}, "total_results": 1, "results": [{"geometry": {"lat": 48.8566, "lng": 2.3522}}]}
+        mock_response.status_code = 200
+        session = Mock()
+        session.get.side_effect = lambda *args, **kwargs: release.wait(5) and mock_response
+        get = session.get
+        flight, quotas = upstream.SingleFlight(), upstream.QuotaAccountant({"opencage": {"daily": 2500, "per_second": 1}})
+        results = []
+        with patch.object(upstream, "calls", flight), patch.object(upstream, "quotas", quotas), patch.object(upstream, "get_session", return_value=session), \
+                patch.object(utils.geocode_cache, "get", return_value=None), patch.object(utils.geocode_cache, "set"):
+            # ten staff search the same city at once, in slightly different ways
+            threads = [threading.Thread(target=lambda query=query: results.append(get_coordinates(query))) for query in ["Paris", " paris "] * 5]
+            for thread in threads:
+                thread.start()
+            while flight.stats()["coalesced"] < 9:
+                release.wait(0.01)
+            release.set()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(results, [(48.8566, 2.3522, None)] * 10)
+        self.assertEqual(get.call_count, 1)
+        self.assertEqual(quotas.remaining("opencage", utils.config.key1)["used"], 500)
+
+    def test_get_destinations_quota_used_up(self):
+        session = Mock()
+        session.get.side_effect = AssertionError
+        saved = [{"name": "Eiffel Tower", "location": {"formatted_address": "Champ de Mars, 75007 Paris, France"}, "geocodes": {"main": {"latitude": 48.8584, "longitude": 2.2945}}}]
+        with patch.object(upstream, "quotas", upstream.QuotaAccountant({"foursquare": {"daily": 0}})), patch.object(upstream, "get_session", return_value=session), patch.object(utils.places_cache, "get", return_value=None), \
+                patch.object(utils.places, "find_local_places", return_value=[]), patch.object(utils, "find_saved_places", return_value=saved):
+            # places already saved nearby are served instead, and without them the search is refused
+            self.assertTrue(get_destinations(48.8580, 2.2950, "16000", 1000, None, Mock())[0]["offline"])
+            self.assertEqual(get_destinations(48.8580, 2.2950, "16000", 1000, None, None), "Error: place search limit reached - please try again later")
+
+    def test_project_results(self):
+        results = [{"fsq_id": "abc", "name": "Eiffel Tower", "location": {"formatted_address": "Paris", "country": "FR"}, "geocodes": {"main": {"latitude": 48.8, "longitude": 2.3}, "roof": {}},
+                    "categories": [{"id": 16020}]}]
+        self.assertEqual(utils.project_results(results), [{"name": "Eiffel Tower", "location": {"formatted_address": "Paris"}, "geocodes": {"main": {"latitude": 48.8, "longitude": 2.3}}}])
+        # ranked results keep their score and distances to each origin
+        results[0].update(score=0.9, distances=[120, 2400])
+        self.assertEqual(utils.project_results(results)[0]["distances"], [120, 2400])
+        self.assertEqual(utils.project_results(results)[0]["score"], 0.9)
+        self.assertEqual(utils.project_results("No valid locations found for this area"), "No valid locations found for this area")
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,5 +1,14 @@
-from database import save_history  # function from database.py
+from database import save_history, find_saved_places  # functions from database.py
+from cache import geocode_cache, places_cache  # caches of previously geocoded locations and FourSquare results
+from markupsafe import Markup  # HTML fragments that templates include without escaping
 import requests  # for AIP requests
+import upstream  # pooled API sessions with timeouts, retries and circuit breakers
+import places  # local store of places FourSquare has returned
+import ranking  # re-ranking of results by distance, category match and popularity
+import rollup  # cross-property popularity counts
+import settings  # search form options, fallback and ranking settings
+import hashlib  # ETag of the search form options
+import json  # search form options for the frontend
 import config  # contains API keys
 
 
@@ -17,156 +26,259 @@ def enter_query(query):
         return None, "Error: invalid query"
 
 
-# generates set of checkboxes that user can select to refine their search choices
+# compiles the search form options from settings.SEARCH_OPTIONS into the checkbox and radio button HTML fragments, and the JSON body and ETag of the options for the frontend
+# names and values are escaped as the fragments are built, so templates can include them as Markup without escaping them again
+def compile_search_options(options):
+    # one checkbox per FourSquare category, including divs, classes and ids for CSS, and accompanying label
+    checkbox = Markup('<div class="form-check"><input type="checkbox" class="form-check-input" name="categories" value="{0}" id="checkbox_{1}">'
+                      '<label class="form-check-label" for="checkbox_{1}">{2}</label></div>')
+    checkboxes = Markup("").join(checkbox.format(category["id"], counter, category["name"]) for counter, category in enumerate(options["categories"]))
+
+    # one radio button per radius, in the same way
+    radio_button = Markup('<div class="form-group"><div class="form-check"><input class="form-check-input" type="radio" name="radius" value="{0}" id="radius-{0}">'
+                          '<label class="form-check-label" for="radius-{0}">{0}</label></div></div>')
+    radius_buttons = Markup("").join(radio_button.format(value) for value in options["radii"])
+
+    body = json.dumps(options, separators=(",", ":"), sort_keys=True)
+    return {"checkboxes": checkboxes, "radius_buttons": radius_buttons, "json": body, "etag": hashlib.sha256(body.encode("utf-8")).hexdigest()[:32]}
+
+
+# search form fragments and options JSON, compiled once when the module is loaded
+search_options = compile_search_options(settings.SEARCH_OPTIONS)
+
+
+# returns the set of checkboxes that user can select to refine their search choices, from the compiled search form options
 def generate_checkboxes():
-    # dictionary containing key FourSquare categories with respective IDs, utilised in API call
-    categories = {
-        "Arts and Entertainment": 10000,
-        "Community": 12000,
-        "Dining and Drinking": 13000,
-        "Events": 14000,
-        "Landmarks and Outdoors": 16000,
-        "Retail": 17000,
-        "Sports": 18000,
-        "Travel and Transportation": 19000,
-    }
-
-    # string to store all categories in categories, and counter for checkbox IDs and labels
-    checkboxes = ""
-    counter = 0
-
-    # iterate through categories to generate HTML checkboxes from all categories, including divs, classes and ids for CSS, and accompanying label
-    for name, id in categories.items():
-        checkbox_str = f'<div class="form-check">'
-        checkbox_str += f'<input type="checkbox" class="form-check-input" name="categories" value="{id}" id="checkbox_{counter}">'
-        checkbox_str += f'<label class="form-check-label" for="checkbox_{counter}">{name}</label>'
-        checkbox_str += '</div>'
-
-        checkboxes += checkbox_str
-
-        counter += 1
-
-    # jinja in HTML will work with the checkboxes string to display individual checkboxes
-    return checkboxes
-
-
-# generates set of radius buttons that user can select to select their radius choices
+    return search_options["checkboxes"]
+
+
+# returns the set of radius buttons that user can select to select their radius choices, from the compiled search form options
 def generate_radio_buttons():
-    # list of radiuses, providing radius options the user can store
-    values = [500, 1000, 2500, 5000, 10000]
+    return search_options["radius_buttons"]
 
-    radius_buttons = ""  # string to store all radio buttons in values
 
-    # iterate through values to generate HTML radio buttons from all values, including divs, classes and ids for CSS, and accompanying label
-    for value in values:
-        button_str = f'<div class="form-group">'
-        button_str += f'<div class="form-check">'
-        button_str += f'<input class="form-check-input" type="radio" name="radius" value="{value}" id="radius-{value}">'
-        button_str += f'<label class="form-check-label" for="radius-{value}">{value}</label>'
-        button_str += '</div>'
-        button_str += '</div>'
+# reads a parsed OpenCage JSON response for a search, returning latitude and longitude values or an error message, and caching found locations and "not found" results
+def read_coordinates(search, data):
+    # obtaining the status code from the parsed JSON response
+    status_code = int(data["status"]["code"])
 
-        radius_buttons += button_str
+    # status code 200 indicates a successful request
+    if status_code == 200:
 
-    # jinja in HTML will work with the radius_buttons string to display individual checkboxes
-    return radius_buttons
+        # checking if a latitude and longitude value are in the JSON response, returning the latitude and longitude values
+        if data["total_results"] == 1:
+            result = data["results"][0]
+            latitude = result["geometry"]["lat"]
+            longitude = result["geometry"]["lng"]
+            geocode_cache.set(search, latitude, longitude)
+            return latitude, longitude, None
 
+        # error message for if latitude and longitude values were not in the JSON response (potential output for typos), cached for a shorter time
+        elif data["total_results"] == 0:
+            error_message = "Error: location not found - please use a valid location"
+            geocode_cache.set(search, None, None, error_message)
+            return None, None, error_message
 
-# utilises OpenCage API to retrieve valid latitude and longitude values for a user input location, returning error messages for invalid locations
-def get_coordinates(search):
-    try:
-        # constructing URL for API call, including base URL with query from enter_query(query) and API key from config
-        base_url = "https://api.opencagedata.com/geocode/v1/json"
-        url = base_url + "?q=" + search + "&key=" + config.key1
+        # error message if multiple latitude and longitude values were found in the JSON response (potential output for a non-specific input returning multiple latitudes and longitudes), cached for a shorter time
+        else:
+            error_message = "Error: multiple locations or invalid location found - check for misspellings or provide a more specific location"
+            geocode_cache.set(search, None, None, error_message)
+            return None, None, error_message
 
-        # executing GET request to OpenCage API
-        response = requests.get(url)
+    # error message if the status code is not 200, concatenating API error message with status code
+    else:
+        return None, None, f"Error {status_code}: {data['status']['message']}"
 
-        # parsing JSON response from API call and obtaining the status code
-        data = response.json()
-        status_code = int(data["status"]["code"])
 
-        # status code 200 indicates a successful request
-        if status_code == 200:
+# requests the coordinates of a location from OpenCage within the API key's quota, returning latitude, longitude and an error message
+def request_coordinates(search):
+    # base URL for OpenCage API, with parameters including the query from enter_query(query) and API key from config
+    url = "https://api.opencagedata.com/geocode/v1/json"
+    param_dict = {"q": search, "key": config.key1}
 
-            # checking if a latitude and longitude value are in the JSON response, returning the latitude and longitude values
-            if data["total_results"] == 1:
-                result = data["results"][0]
-                latitude = result["geometry"]["lat"]
-                longitude = result["geometry"]["lng"]
-                return latitude, longitude, None
+    # executing GET request to OpenCage API through the shared upstream session, counting each attempt against the key's quota
+    response = upstream.get(url, params=param_dict, quota=("opencage", config.key1))
 
-            # error message for if latitude and longitude values were not in the JSON response (potential output for typos)
-            elif data["total_results"] == 0:
-                return None, None, "Error: location not found - please use a valid location"
+    # parsing JSON response from API call into latitude, longitude and error message values
+    return read_coordinates(search, response.json())
 
-            # error message if multiple latitude and longitude values were found in the JSON response (potential output for a non-specific input returning multiple latitudes and longitudes)
-            else:
-                return None, None, "Error: multiple locations or invalid location found - check for misspellings or provide a more specific location"
 
-        # error message if the status code is not 200, concatenating API error message with status code
-        else:
-            return None, None, f"Error {status_code}: {data['status']['message']}"
+# utilises OpenCage API to retrieve valid latitude and longitude values for a user input location, returning error messages for invalid locations
+def get_coordinates(search):
+    # return the cached result if this location was geocoded recently, avoiding a call to OpenCage
+    cached = geocode_cache.get(search)
+    if cached is not None:
+        return cached
 
-    # except block error message for unknown cases of error
+    try:
+        # concurrent searches for the same location share one OpenCage request, waiting for the first search's result
+        return upstream.calls.do(("opencage", geocode_cache.normalise(search)), lambda: request_coordinates(search))
+
+    # except block error messages for a used up quota, an unavailable or slow API, and unknown cases of error
+    except upstream.QuotaExhaustedError:
+        return None, None, "Error: location search limit reached - please try again later"
+    except upstream.CircuitOpenError:
+        return None, None, "Error: location service temporarily unavailable - please try again shortly"
+    except requests.exceptions.Timeout:
+        return None, None, "Error: location service timed out - please try again"
     except requests.exceptions.ConnectionError:
-        return "Error: connection failure - check your internet connection"
+        return None, None, "Error: connection failure - check your internet connection"
     except Exception:
-        return "Error: failed to retrieve destinations"
+        return None, None, "Error: failed to retrieve destinations"
 
 
-# utilises FourSquare API to retrieve list of valid location results, and saves results to user's search history if they are logged in
-# parameters include latitude and longitude values returned from get_coordinates(), categories and radius from search.js form input, and the user's id and the database session to save results to history
-def get_destinations(latitude, longitude, categories, radius, user_id, db_session):
-    try:
+# reads a parsed FourSquare JSON response, returning the list of results that have a formatted address
+def filter_destinations(data):
+    # list to store valid results from the respinse
+    filtered_results = []
 
-        # base URL for FourSquare API
-        url = "https://api.foursquare.com/v3/places/search"
+    # checking if each location has a formatted address, useful to the user, and appends it to filtered_results
+    if "results" in data:
+        for result in data["results"]:
+            if "formatted_address" in result.get("location", {}):
+                filtered_results.append(result)
 
-        # header containing authorisation details, including API key from config file
-        header = {"accept": "application/json", "Authorization": config.key2}
+    return filtered_results
 
-        # dictionary of parameters including latitude and longitude in a string value per FourSquare API documentation, DISTANCE to sort the results by nearest distance to input location, integer radius value, and categories in a string
-        param_dict = {"ll": f"{latitude},{longitude}",
-                      "sort": "DISTANCE",
-                      "radius": radius,
-                      "categories": categories}
 
-        # executing GET request to FourSquare API with URL, parameters and header
-        response = requests.get(url, params=param_dict, headers=header)
+# requests places from FourSquare API for a location, returning a tuple of the results that have a formatted address, an error message (one of which is None),
+# and the whole page of results returned, including those without an address (None on error)
+# background is set for refreshes of stale cached results, which are refused once the API key's quota is nearly used up, so the stale results keep being served
+def fetch_destinations(latitude, longitude, categories, radius, background=False):
+    # base URL for FourSquare API
+    url = "https://api.foursquare.com/v3/places/search"
 
-        # parsing JSON response from API call
-        data = response.json()
+    # header containing authorisation details, including API key from config file
+    header = {"accept": "application/json", "Authorization": config.key2}
 
-        # status 200 code indicates a successful request
-        if response.status_code == 200:
+    # dictionary of parameters including latitude and longitude in a string value per FourSquare API documentation, DISTANCE to sort the results by nearest distance to input location, integer radius value, and categories in a string
+    param_dict = {"ll": f"{latitude},{longitude}",
+                  "sort": "DISTANCE",
+                  "radius": radius,
+                  "categories": categories}
 
-            # list to store valid results from the respinse
-            filtered_results = []
+    # executing GET request to FourSquare API with URL, parameters and header through the shared upstream session, counting each attempt against the key's quota
+    response = upstream.get(url, params=param_dict, headers=header, quota=("foursquare", config.key2), background=background)
 
-            # checking if each location has a formatted address, useful to the user, and appends it to filtered_results
-            if "results" in data:
-                for result in data["results"]:
-                    if "formatted_address" in result.get("location", {}):
-                        filtered_results.append(result)
+    # parsing JSON response from API call
+    data = response.json()
 
-            # saves search histroy with save_history() from database.py if the user_id is provided (if not, it is a None value)
-            if user_id is not None:
-                save_history(db_session, user_id, filtered_results)
+    # status 200 code indicates a successful request
+    if response.status_code == 200:
+        return filter_destinations(data), None, data.get("results", [])
 
-            # if filtered_results list is not empty and has results, the list is returned
-            if len(filtered_results) > 0:
-                return filtered_results
-            # return a message if filtered_lists results is empty, indicating that no valid locations were found
-            else:
-                return "No valid locations found for this area"
+    # return API error message if the status code is not 200
+    else:
+        return None, f"Error: {data['message']}", None
 
-        # return API error message if the status code is not 200
-        else:
-            return f"Error: {data['message']}"
 
-    # except block error message for unknown cases of error
+# utilises FourSquare API to retrieve list of valid location results, and saves results to user's search history if they are logged in
+# parameters include latitude and longitude values returned from get_coordinates(), categories and radius from search.js form input, and the user's id and the database session to save results to history
+# origins is an optional list of extra (latitude, longitude) points, such as a conference venue, that results are ranked by distance to as well as the searched location
+def get_destinations(latitude, longitude, categories, radius, user_id, db_session, origins=None):
+    try:
+        # key shared by searches in the same grid cell with the same categories and radius, so nearby searches reuse one FourSquare response
+        key = places_cache.key(latitude, longitude, categories, radius)
+
+        # obtain cached results, with stale results refreshed from FourSquare in the background while they are served
+        filtered_results = places_cache.get(key, lambda: fetch_destinations(latitude, longitude, categories, radius, background=True)[0])
+
+        # answer from the local place store if a past FourSquare search covered this area
+        if filtered_results is None and settings.PLACES_LOCAL_FIRST and db_session is not None:
+            filtered_results = get_local_destinations(latitude, longitude, categories, radius, db_session)
+
+        # otherwise request results from FourSquare, caching successful responses and adding them to the local place store
+        # concurrent searches with the same cache key share one request, made and stored by the first search, and wait for its results
+        if filtered_results is None:
+            def fetch_and_store():
+                results, error_message, page = fetch_destinations(latitude, longitude, categories, radius)
+                if not error_message:
+                    places_cache.set(key, results)
+                    store_destinations(latitude, longitude, categories, radius, results, page, db_session)
+                return results, error_message
+            filtered_results, error_message = upstream.calls.do(("foursquare", key), fetch_and_store)
+            if error_message:
+                return get_saved_destinations(latitude, longitude, categories, radius, db_session) or error_message
+
+        # saves search histroy with save_history() from database.py if the user_id is provided (if not, it is a None value), including for cached results
+        if user_id is not None:
+            save_history(db_session, user_id, filtered_results)
+
+        # if filtered_results list is not empty and has results, the list is returned, ranked if enabled
+        if len(filtered_results) > 0:
+            if settings.RANKING_ENABLED:
+                return rank_destinations(latitude, longitude, categories, radius, filtered_results, db_session, origins)
+            return list(filtered_results)
+        # return a message if filtered_lists results is empty, indicating that no valid locations were found
+        else:
+            return "No valid locations found for this area"
+
+    # except block error messages for an unavailable or slow API, and unknown cases of error
+    # places already found nearby are returned instead when FourSquare cannot be reached, or the API key's quota is used up
+    except upstream.QuotaExhaustedError:
+        return get_saved_destinations(latitude, longitude, categories, radius, db_session) or "Error: place search limit reached - please try again later"
+    except upstream.CircuitOpenError:
+        return get_saved_destinations(latitude, longitude, categories, radius, db_session) or "Error: place service temporarily unavailable - please try again shortly"
+    except requests.exceptions.Timeout:
+        return get_saved_destinations(latitude, longitude, categories, radius, db_session) or "Error: place service timed out - please try again"
     except requests.exceptions.ConnectionError:
-        return "Error: connection failure - check your internet connection"
+        return get_saved_destinations(latitude, longitude, categories, radius, db_session) or "Error: connection failure - check your internet connection"
     except Exception:
         return "Error: failed to retrieve destinations"
+
+
+# re-ranks results by distance to the searched location and any extra origins, category match and cross-property popularity (when there is a database session)
+def rank_destinations(latitude, longitude, categories, radius, results, db_session, origins=None):
+    popularity = rollup.popularity_counts(db_session, latitude, longitude, int(radius)) if db_session is not None else None
+    return ranking.rank_places(results, [(latitude, longitude)] + list(origins or []), categories, int(radius), popularity)
+
+
+# trims search results to the fields search.js uses (the name, formatted address and main coordinates) before they are sent to the browser,
+# keeping the score and distances in metres to each origin of ranked results; error and "no locations" messages are returned as they are
+def project_results(results):
+    if not isinstance(results, list):
+        return results
+    projected = []
+    for result in results:
+        trimmed = {"name": result["name"], "location": {"formatted_address": result["location"]["formatted_address"]},
+                   "geocodes": {"main": result.get("geocodes", {}).get("main", {})}}
+        trimmed.update({field: result[field] for field in ("score", "distances") if field in result})
+        projected.append(trimmed)
+    return projected
+
+
+# obtains results from the local place store when a past FourSquare search covered the area, or None to request them from FourSquare
+def get_local_destinations(latitude, longitude, categories, radius, db_session):
+    try:
+        return places.search_local(db_session, latitude, longitude, categories, int(radius))
+    except Exception:
+        db_session.rollback()
+        return None
+
+
+# adds FourSquare results to the local place store and records the area covered by the page they came from, without failing the search if they cannot be stored
+def store_destinations(latitude, longitude, categories, radius, results, page, db_session):
+    if db_session is None:
+        return
+    try:
+        places.store_places(db_session, results)
+        places.record_coverage(db_session, latitude, longitude, int(radius), categories, page)
+        db_session.commit()
+    except Exception:
+        db_session.rollback()
+
+
+# obtains places from the local place store, or failing that places already saved to search history, within the radius, used in place of FourSquare results when FourSquare cannot be reached
+# returns a list of results marked as offline, or None if the fallback is disabled, there is no database session, or no places were found
+# offline results are not saved to search history again
+def get_saved_destinations(latitude, longitude, categories, radius, db_session):
+    if not settings.OFFLINE_FALLBACK or db_session is None:
+        return None
+    try:
+        results = places.find_local_places(db_session, latitude, longitude, categories, int(radius), settings.OFFLINE_FALLBACK_LIMIT) or \
+            find_saved_places(db_session, latitude, longitude, int(radius), categories, settings.OFFLINE_FALLBACK_LIMIT)
+    except Exception:
+        return None
+    for result in results:
+        result["offline"] = True
+    return results or None